@@ -1,117 +1,546 @@
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Tuple
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-import jsonpickle
+import httpx
 import requests
 from requests.auth import HTTPBasicAuth
 
-from src.apptoto_event import ApptotoEvent
-from src.constants import MAX_EVENTS, ASH_CALENDAR_ID
+from src.apptoto_event import ApptotoEvent, encode_events
+from src.async_transport import AsyncTransport, get_async_transport
+from src.constants import ASH_CALENDAR_ID, CHUNK_SIZE, DELETE_ATTEMPTS, EVENTS_PAGE_SIZE, MAX_IN_FLIGHT
+from src.json_stream import iter_array
+from src.profiling import section
+from src.rate_control import AdaptiveController
+from src.transport import RateLimiter, Transport, get_transport
+
+STREAM_CHUNK_SIZE = 1 << 16  # Bytes read at a time from streamed responses
+POST_ATTEMPTS = 3  # Times a post rejected by Apptoto's rate limit is sent, with an adaptive controller
+DELETE_BACKOFF = 0.5  # Seconds before retrying a failed deletion, doubled after each attempt
+CONVERSATIONS_BEGIN = datetime(year=2021, month=4, day=1)  # No participant replied before this
+
+
+class ApptotoError(Exception):
+    def __init__(self, message):
+        """
+        An exception for interactions with Apptoto.
+
+        :param message: A string describing the error
+        """
+        self.message = message
+
+
+class DeleteResult:
+    def __init__(self, event_id: int, deleted: bool, attempts: int, error: str = ''):
+        """
+        The result of deleting one event.
+
+        :param event_id: Apptoto event identifier
+        :param deleted: True if Apptoto deleted the event
+        :param attempts: Number of times the deletion was tried
+        :param error: Why the last attempt failed
+        """
+        self.event_id = event_id
+        self.deleted = deleted
+        self.attempts = attempts
+        self.error = error
 
 
 class Apptoto:
-    def __init__(self, api_token: str, user: str):
+    def __init__(self, api_token: str, user: str, endpoint: str = 'https://api.apptoto.com/v1',
+                 max_in_flight: int = MAX_IN_FLIGHT, chunk_size: int = CHUNK_SIZE,
+                 timeout: float = 30, transport: Transport = None, rate_limit: float = None,
+                 controller: AdaptiveController = None):
         """
         Create an Apptoto instance.
 
         :param api_token: Apptoto API token
         :param user: Apptoto user name
+        :param endpoint: Apptoto API endpoint URI
+        :param max_in_flight: Maximum number of chunks of events posted at the same time,
+        across all calls sharing this instance.
+        Connections are only reused if this is no more than the transport's pool size.
+        :param chunk_size: Number of events posted in each request
+        :param timeout: Seconds to wait for a response
+        :param transport: HTTP transport, defaults to the process-wide transport
+        :param rate_limit: Maximum number of chunks posted, or events deleted, each second, across all calls
+        sharing this instance. With a controller, posts are paced by the controller only.
+        :param controller: Adjusts the chunk size and rate of posts from Apptoto's responses, across all calls
+        sharing this instance. Without one, every chunk has `chunk_size` events.
         """
-        self._endpoint = 'https://api.apptoto.com/v1'
+        self._endpoint = endpoint
         self._api_token = api_token
         self._user = user
         self._headers = {'Content-Type': 'application/json'}
-        self._timeout = 30
+        self._timeout = timeout
+        self._auth = HTTPBasicAuth(username=self._user, password=self._api_token)
+        self._max_in_flight = max(1, max_in_flight)
+        self._chunk_size = max(1, chunk_size)
+        self._transport = transport
+        self._in_flight = threading.BoundedSemaphore(self._max_in_flight)
+        self._rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._controller = controller
 
-    def post_events(self, events: List[ApptotoEvent]):
+    @property
+    def _http(self) -> Transport:
+        return self._transport or get_transport()
+
+    @section('apptoto')
+    def post_events(self, events: List[ApptotoEvent], progress: Optional[Callable[[int, int], None]] = None,
+                    on_posted: Optional[Callable[[int, List[ApptotoEvent]], None]] = None) -> bool:
         """
         Post events to the /v1/events API to create events that will send messages to all participants.
 
+        Events are posted in chunks, with up to `max_in_flight` chunks posted at the same time.
+        Chunk results are checked in order, and chunks not yet started are cancelled after the first failure.
+
         :param events: List of events to create
+        :param progress: Called with the number of events posted so far and the number of events,
+        after each chunk is posted
+        :param on_posted: Called from the posting thread with the index of the first event in a chunk and the
+        chunk's events, as soon as Apptoto accepts the chunk, including chunks accepted after an earlier one failed
+        :return: True if all events were posted
         """
-        url = f'{self._endpoint}/events'
-        # Post 5 events at a time because Apptoto's API can't handle all events at once.
-        for i in range(0, len(events), 5):
-            events_slice = events[i:i + 5]
-            request_data = jsonpickle.encode({'events': events_slice, 'prevent_calendar_creation': True}, unpicklable=False)
-            print('Posting events to apptoto')
-            r = requests.post(url=url,
-                              data=request_data,
-                              headers=self._headers,
-                              timeout=self._timeout,
-                              auth=HTTPBasicAuth(username=self._user, password=self._api_token))
+        # Post a few events at a time because Apptoto's API can't handle all events at once.
+        # With a controller, each chunk's size is chosen when it is sent, from the responses so far.
+        if not events:
+            return True
 
-            if r.status_code == requests.codes.ok:
-                print('Posted events to apptoto')
-            else:
-                print(f'Failed to post events {i} through {i+5}, starting at {events[i].start_time}')
-                print(f'Failed to post events - {str(r.status_code)} - {str(r.content)}')
-                return r.status_code == requests.codes.ok
+        pending = deque()
+        next_start = 0
+        with ThreadPoolExecutor(max_workers=self._max_in_flight) as executor:
+            while pending or next_start < len(events):
+                while next_start < len(events) and len(pending) < self._max_in_flight:
+                    chunk = events[next_start:next_start + self._next_chunk_size()]
+                    pending.append((next_start, chunk, executor.submit(self._post_chunk, next_start, chunk,
+                                                                       on_posted)))
+                    next_start += len(chunk)
+
+                i, chunk, future = pending.popleft()
+                try:
+                    r = future.result()
+                except requests.RequestException as err:
+                    failure = str(err)
+                else:
+                    failure = None if r.status_code == requests.codes.ok else f'{str(r.status_code)} - {str(r.content)}'
+
+                if failure:
+                    for _, _, f in pending:
+                        f.cancel()
+                    print(f'Failed to post events {i} through {i + len(chunk)}, starting at {events[i].start_time}')
+                    print(f'Failed to post events - {failure}')
+                    return False
+
+                if progress:
+                    progress(i + len(chunk), len(events))
 
+        if self._controller:
+            print(f'Posted {len(events)} events to apptoto - {self._controller.describe()}')
         return True
 
-    def get_events(self, begin: datetime, phone_number: str) -> List[int]:
+    def _next_chunk_size(self) -> int:
+        return self._controller.chunk_size if self._controller else self._chunk_size
+
+    def _post_chunk(self, start: int, events_slice: List[ApptotoEvent],
+                    on_posted: Optional[Callable[[int, List[ApptotoEvent]], None]]) -> requests.Response:
         url = f'{self._endpoint}/events'
-        params = {'begin': begin.isoformat(),
-                  'phone_number': phone_number,
-                  'page_size': MAX_EVENTS}
-        r = requests.get(url=url,
-                         params=params,
-                         headers=self._headers,
-                         timeout=self._timeout,
-                         auth=HTTPBasicAuth(username=self._user, password=self._api_token))
+        request_data = encode_events(events_slice, prevent_calendar_creation=True)
+        # A post rejected by the rate limit created nothing, so with a controller it is sent again, more slowly.
+        for attempt in range(POST_ATTEMPTS if self._controller else 1):
+            with self._in_flight:
+                # The controller's rate already stays under the configured limit, so posts aren't paced twice.
+                if self._controller:
+                    self._controller.wait()
+                elif self._rate_limiter:
+                    self._rate_limiter.wait()
+                print('Posting events to apptoto')
+                began = time.monotonic()
+                try:
+                    r = self._http.post(url=url,
+                                        service='apptoto',
+                                        operation='post_events',
+                                        data=request_data,
+                                        headers=self._headers,
+                                        timeout=self._timeout,
+                                        auth=self._auth)
+                except requests.RequestException:
+                    if self._controller:
+                        self._controller.observe(len(events_slice), len(request_data), time.monotonic() - began,
+                                                 None)
+                    raise
+            if self._controller:
+                self._controller.observe(len(events_slice), len(request_data), time.monotonic() - began,
+                                         r.status_code)
+            if r.status_code != requests.codes.too_many_requests:
+                break
+            retry_after = r.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                time.sleep(int(retry_after))
 
-        event_ids = []
         if r.status_code == requests.codes.ok:
-            events = r.json()['events']
-            event_ids = [e['id'] for e in events if not e.get('is_deleted') and e.get('calendar_id') == ASH_CALENDAR_ID]
-        else:
-            print(f'Failed to get events - {str(r.status_code)} - {str(r.content)}')
+            print('Posted events to apptoto')
+            if on_posted:
+                on_posted(start, events_slice)
+
+        return r
+
+    def iter_events(self, begin: datetime, phone_number: str = None, end: datetime = None,
+                    include_conversations: bool = False, include_deleted: bool = False,
+                    page_size: int = EVENTS_PAGE_SIZE, operation: str = 'get_events') -> Iterator[Dict]:
+        """
+        Yield events on the ASH calendar, one page of events at a time.
+
+        Each page is parsed as it arrives, so only one page is in memory at a time.
+        The calendar is sent to Apptoto as a filter, and also checked here.
+
+        :param begin: Earliest start time of events
+        :param phone_number: Only get events for this phone number, if set
+        :param end: Latest start time of events, if set
+        :param include_conversations: Include each participant's conversations in the events
+        :param include_deleted: Include deleted events
+        :param page_size: Number of events requested in each page
+        :param operation: Name of the call in metrics
+        :raises ApptotoError: If Apptoto doesn't return a page
+        """
+        url = f'{self._endpoint}/events'
+        params = _events_params(begin, phone_number, end, include_conversations, page_size)
+        page = 0
+        while True:
+            params['page'] = page
+            with self._http.get(url=url,
+                                service='apptoto',
+                                operation=operation,
+                                params=params,
+                                headers=self._headers,
+                                timeout=self._timeout,
+                                auth=self._auth,
+                                stream=True) as r:
+                _check_page(r)
 
+                count = 0
+                for e in iter_array(r.iter_content(chunk_size=STREAM_CHUNK_SIZE), 'events'):
+                    count += 1
+                    if _listed(e, include_deleted):
+                        yield e
+
+            if count < page_size:
+                return
+            page += 1
+
+    def iter_event_ids(self, begin: datetime, phone_number: str, end: datetime = None) -> Iterator[int]:
+        """
+        Yield identifiers of the participant's events on the ASH calendar that are not deleted, page by page.
+
+        :param begin: Earliest start time of events
+        :param phone_number: Participant's phone number
+        :param end: Latest start time of events, if set
+        """
+        for e in self.iter_events(begin=begin, phone_number=phone_number, end=end):
+            yield e['id']
+
+    def get_events(self, begin: datetime, phone_number: str) -> List[int]:
+        event_ids = []
+        try:
+            for event_id in self.iter_event_ids(begin=begin, phone_number=phone_number):
+                event_ids.append(event_id)
+        except ApptotoError as err:
+            print(err.message)
         return event_ids
 
-    def delete_event(self, event_id: int):
+    def delete_event(self, event_id: int) -> bool:
+        """
+        Delete one event, without retrying.
+
+        :param event_id: Apptoto event identifier
+        :return: True if Apptoto deleted the event
+        """
+        return self._delete_with_retries(event_id, attempts=1).deleted
+
+    @section('apptoto')
+    def delete_events(self, event_ids: Iterable[int], progress: Optional[Callable[[int, int], None]] = None,
+                      attempts: int = DELETE_ATTEMPTS) -> List[DeleteResult]:
+        """
+        Delete events, with up to `max_in_flight` deletions at the same time.
+
+        :param event_ids: Apptoto event identifiers
+        :param progress: Called with the number of deletions finished and the number of events,
+        after each deletion finishes
+        :param attempts: Times a failed deletion is tried before it is reported
+        :return: A result for each event, in the order given
+        """
+        event_ids = list(event_ids)
+        results = {}
+        for result in self.iter_delete_events(event_ids, attempts=attempts):
+            results[result.event_id] = result
+            if progress:
+                progress(len(results), len(event_ids))
+        return [results[e] for e in event_ids]
+
+    def iter_delete_events(self, event_ids: Iterable[int], attempts: int = DELETE_ATTEMPTS) -> Iterator[DeleteResult]:
+        """
+        Delete events, with up to `max_in_flight` deletions at the same time, and yield each result as it finishes.
+
+        Deletions that fail with a connection error, a server error or a rate limit are tried again after a delay.
+        All event identifiers are read before the first deletion, because deleting events while paging through
+        them would move later events onto pages already read.
+        If the caller stops early, the remaining deletions still finish before the generator closes.
+
+        :param event_ids: Apptoto event identifiers
+        :param attempts: Times a failed deletion is tried before it is reported
+        """
+        event_ids = list(event_ids)
+        if not event_ids:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self._max_in_flight, len(event_ids))) as executor:
+            futures = [executor.submit(self._delete_with_retries, e, attempts) for e in event_ids]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _delete_with_retries(self, event_id: int, attempts: int) -> DeleteResult:
         url = f'{self._endpoint}/events'
         params = {'id': event_id}
-        r = requests.delete(url=url,
-                            params=params,
-                            headers=self._headers,
-                            timeout=self._timeout,
-                            auth=HTTPBasicAuth(username=self._user, password=self._api_token))
+        error = ''
+        attempt = 0
+        while attempt < max(1, attempts):
+            if attempt:
+                time.sleep(DELETE_BACKOFF * 2 ** (attempt - 1))
+            attempt += 1
 
-        if r.status_code == requests.codes.ok:
-            print(f'Deleted event - {event_id}')
+            try:
+                with self._in_flight:
+                    if self._rate_limiter:
+                        self._rate_limiter.wait()
+                    r = self._http.delete(url=url,
+                                          service='apptoto',
+                                          operation='delete_event',
+                                          params=params,
+                                          headers=self._headers,
+                                          timeout=self._timeout,
+                                          auth=self._auth)
+            except requests.RequestException as err:
+                error = str(err)
+                continue
+
+            if r.status_code == requests.codes.ok:
+                print(f'Deleted event - {event_id}')
+                return DeleteResult(event_id, deleted=True, attempts=attempt)
+
+            error = f'{str(r.status_code)} - {str(r.content)}'
+            # Other client errors, such as an unknown event, fail the same way every time.
+            if r.status_code < 500 and r.status_code != requests.codes.too_many_requests:
+                break
+
+        print(f'Failed to delete event {event_id} - {error}')
+        return DeleteResult(event_id, deleted=False, attempts=attempt, error=error)
 
     def get_conversations(self, phone_number: str) -> List[Tuple[str, str]]:
         """Get timestamp and content of participant's responses."""
-        url = f'{self._endpoint}/events'
-        begin = datetime(year=2021, month=4, day=1).isoformat()
-        params = {'begin': begin,
-                  'phone_number': phone_number,
-                  'include_conversations': True}
-        r = requests.get(url=url,
-                         params=params,
-                         headers=self._headers,
-                         timeout=self._timeout,
-                         auth=HTTPBasicAuth(username=self._user, password=self._api_token))
-
         conversations = []
-        if r.status_code == requests.codes.ok:
-            response = r.json()['events']
-            for e in response:
-                # Check only events on the right calendar, where there is a conversation
-                if e['calendar_id'] == ASH_CALENDAR_ID and \
-                    e['participants'] and \
-                        e['participants'][0]['conversations']:
-                    for conversation in e['participants'][0]['conversations']:
-                        if conversation['messages']:
-                            for m in conversation['messages']:
-                                # for each replied event get the content and the time.
-                                # Content should be the participant's response.
-                                if 'replied' in m['event_type']:
-                                    conversations.append((m['at'], m['content']))
-        else:
-            print(f'Failed to get events - {str(r.status_code)} - {str(r.content)}')
+        try:
+            for reply in self.iter_replies(phone_number=phone_number):
+                conversations.append(reply)
+        except ApptotoError as err:
+            print(err.message)
+        return conversations
+
+    def iter_replies(self, phone_number: str, begin: datetime = None, end: datetime = None) \
+            -> Iterator[Tuple[str, str]]:
+        """
+        Yield timestamp and content of participant's responses to events in a time range, as the events stream in.
+
+        :param phone_number: Participant's phone number
+        :param begin: Earliest start time of events, defaults to the start of the study
+        :param end: Latest start time of events, if set
+        :raises ApptotoError: If Apptoto doesn't return the events
+        """
+        for e in self.iter_events(begin=begin or CONVERSATIONS_BEGIN, phone_number=phone_number, end=end,
+                                  include_conversations=True, include_deleted=True, operation='get_conversations'):
+            yield from _participant_replies(e)
+
+    def iter_replies_by_phone(self, phone_numbers: List[str], begin: datetime = None, end: datetime = None) \
+            -> Iterator[Tuple[str, str, str]]:
+        """
+        Yield phone number, timestamp and content of many participants' responses, from one listing of
+        the calendar's events in a time range.
+
+        Phone numbers are matched on their last ten digits, so differences in formatting don't matter.
+
+        :param phone_numbers: Participants' phone numbers, which are yielded as given
+        :param begin: Earliest start time of events, defaults to the start of the study
+        :param end: Latest start time of events, if set
+        :raises ApptotoError: If Apptoto doesn't return the events
+        """
+        wanted = {_phone_key(p): p for p in phone_numbers}
+        for e in self.iter_events(begin=begin or CONVERSATIONS_BEGIN, end=end,
+                                  include_conversations=True, include_deleted=True, operation='get_conversations'):
+            yield from _replies_by_phone(e, wanted)
+
+
+def _events_params(begin: datetime, phone_number: Optional[str], end: Optional[datetime],
+                   include_conversations: bool, page_size: int) -> Dict:
+    params = {'begin': begin.isoformat(),
+              'calendar_id': ASH_CALENDAR_ID,
+              'page_size': page_size}
+    if phone_number:
+        params['phone_number'] = phone_number
+    if end:
+        params['end'] = end.isoformat()
+    if include_conversations:
+        params['include_conversations'] = True
+    return params
+
+
+def _check_page(r):
+    """Raise an ApptotoError unless a response, from either client, holds a page of events."""
+    if r.status_code != requests.codes.ok:
+        raise ApptotoError(f'Failed to get events - {str(r.status_code)} - {str(r.content)}')
+
+
+def _listed(event: Dict, include_deleted: bool) -> bool:
+    """Return True if an event in a page should be listed, being on the ASH calendar and not deleted."""
+    return (include_deleted or not event.get('is_deleted')) and event.get('calendar_id') == ASH_CALENDAR_ID
+
+
+def _participant_replies(event: Dict) -> Iterator[Tuple[str, str]]:
+    """Yield timestamp and content of replies in an event listed for one phone number."""
+    if event.get('participants'):
+        yield from _replies(event['participants'][0])
+
+
+def _replies_by_phone(event: Dict, wanted: Dict[str, str]) -> Iterator[Tuple[str, str, str]]:
+    """Yield phone number, timestamp and content of replies in an event from the wanted participants."""
+    for participant in event.get('participants') or []:
+        phone_number = wanted.get(_phone_key(participant.get('phone') or ''))
+        if phone_number:
+            for at, content in _replies(participant):
+                yield phone_number, at, content
+
+
+def _phone_key(phone_number: str) -> str:
+    return ''.join(c for c in phone_number if c.isdigit())[-10:]
+
+
+def _replies(participant: Dict) -> Iterator[Tuple[str, str]]:
+    """Yield timestamp and content of a participant's replies in an event's conversations."""
+    for conversation in participant.get('conversations') or []:
+        for m in conversation.get('messages') or []:
+            # for each replied event get the content and the time.
+            # Content should be the participant's response.
+            if 'replied' in m['event_type']:
+                yield m['at'], m['content']
 
+
+class AsyncApptoto:
+    def __init__(self, api_token: str, user: str, endpoint: str = 'https://api.apptoto.com/v1',
+                 timeout: float = 30, transport: AsyncTransport = None):
+        """
+        Read events and participants' replies from the Apptoto API in asyncio code, with the same methods
+        as `Apptoto` as coroutines or async generators.
+
+        Posting and deleting events stay with `Apptoto`, which applies the adaptive controller, the rate limit
+        and the bound on requests in flight.
+
+        :param api_token: Apptoto API token
+        :param user: Apptoto user name
+        :param endpoint: Apptoto API endpoint URI
+        :param timeout: Seconds to wait for a response
+        :param transport: Async HTTP transport, defaults to the process-wide async transport
+        """
+        self._endpoint = endpoint
+        self._headers = {'Content-Type': 'application/json'}
+        self._timeout = timeout
+        self._auth = httpx.BasicAuth(username=user, password=api_token)
+        self._transport = transport
+
+    @property
+    def _http(self) -> AsyncTransport:
+        return self._transport or get_async_transport()
+
+    async def iter_events(self, begin: datetime, phone_number: str = None, end: datetime = None,
+                          include_conversations: bool = False, include_deleted: bool = False,
+                          page_size: int = EVENTS_PAGE_SIZE, operation: str = 'get_events') -> AsyncIterator[Dict]:
+        """
+        Yield events on the ASH calendar, one page of events at a time.
+
+        Each page is read whole before its events are parsed.
+
+        :param begin: Earliest start time of events
+        :param phone_number: Only get events for this phone number, if set
+        :param end: Latest start time of events, if set
+        :param include_conversations: Include each participant's conversations in the events
+        :param include_deleted: Include deleted events
+        :param page_size: Number of events requested in each page
+        :param operation: Name of the call in metrics
+        :raises ApptotoError: If Apptoto doesn't return a page
+        """
+        params = _events_params(begin, phone_number, end, include_conversations, page_size)
+        page = 0
+        while True:
+            params['page'] = page
+            r = await self._http.get(url=f'{self._endpoint}/events',
+                                     service='apptoto',
+                                     operation=operation,
+                                     params=params,
+                                     headers=self._headers,
+                                     timeout=self._timeout,
+                                     auth=self._auth)
+            _check_page(r)
+
+            count = 0
+            for e in iter_array([r.content], 'events'):
+                count += 1
+                if _listed(e, include_deleted):
+                    yield e
+
+            if count < page_size:
+                return
+            page += 1
+
+    async def get_conversations(self, phone_number: str) -> List[Tuple[str, str]]:
+        """Get timestamp and content of participant's responses."""
+        conversations = []
+        try:
+            async for reply in self.iter_replies(phone_number=phone_number):
+                conversations.append(reply)
+        except ApptotoError as err:
+            print(err.message)
         return conversations
+
+    async def iter_replies(self, phone_number: str, begin: datetime = None, end: datetime = None) \
+            -> AsyncIterator[Tuple[str, str]]:
+        """
+        Yield timestamp and content of participant's responses to events in a time range.
+
+        :param phone_number: Participant's phone number
+        :param begin: Earliest start time of events, defaults to the start of the study
+        :param end: Latest start time of events, if set
+        :raises ApptotoError: If Apptoto doesn't return the events
+        """
+        async for e in self.iter_events(begin=begin or CONVERSATIONS_BEGIN, phone_number=phone_number, end=end,
+                                        include_conversations=True, include_deleted=True,
+                                        operation='get_conversations'):
+            for reply in _participant_replies(e):
+                yield reply
+
+    async def iter_replies_by_phone(self, phone_numbers: List[str], begin: datetime = None, end: datetime = None) \
+            -> AsyncIterator[Tuple[str, str, str]]:
+        """
+        Yield phone number, timestamp and content of many participants' responses, from one listing of
+        the calendar's events in a time range.
+
+        :param phone_numbers: Participants' phone numbers, which are yielded as given
+        :param begin: Earliest start time of events, defaults to the start of the study
+        :param end: Latest start time of events, if set
+        :raises ApptotoError: If Apptoto doesn't return the events
+        """
+        wanted = {_phone_key(p): p for p in phone_numbers}
+        async for e in self.iter_events(begin=begin or CONVERSATIONS_BEGIN, end=end,
+                                        include_conversations=True, include_deleted=True,
+                                        operation='get_conversations'):
+            for reply in _replies_by_phone(e, wanted):
+                yield reply
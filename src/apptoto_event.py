@@ -1,10 +1,20 @@
+import json
 from datetime import datetime
-from typing import List
+from typing import Dict, List
 
 from src.apptoto_participant import ApptotoParticipant
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
 
 class ApptotoEvent:
+    __slots__ = ('calendar', 'title', 'start_time', 'end_time', 'content', 'participants')
+
     def __init__(self, calendar: str, title: str, start_time: datetime, end_time: datetime,
                  content: str, participants: List[ApptotoParticipant]):
         """
@@ -26,3 +36,51 @@ class ApptotoEvent:
         self.end_time = end_time.isoformat()
         self.content = content
         self.participants = participants
+
+    def to_dict(self, participants: List[Dict[str, str]] = None) -> Dict:
+        """
+        The event as sent to the Apptoto API.
+
+        :param participants: The event's participants already as dictionaries, so events can share them
+        """
+        return {'calendar': self.calendar,
+                'title': self.title,
+                'start_time': self.start_time,
+                'end_time': self.end_time,
+                'content': self.content,
+                'participants': participants if participants is not None else
+                [p.to_dict() for p in self.participants]}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> 'ApptotoEvent':
+        return cls(calendar=d['calendar'],
+                   title=d['title'],
+                   start_time=datetime.fromisoformat(d['start_time']),
+                   end_time=datetime.fromisoformat(d['end_time']),
+                   content=d['content'],
+                   participants=[ApptotoParticipant(**p) for p in d['participants']])
+
+
+def encode_events(events: List[ApptotoEvent], **fields) -> bytes:
+    """
+    Encode events as the JSON body of a request to the Apptoto API.
+
+    Each participant is converted once, however many events share it.
+    The JSON is written by orjson when it is installed.
+
+    :param events: Events to encode
+    :param fields: Other members of the body, such as prevent_calendar_creation
+    :return: UTF-8 JSON
+    """
+    participants: Dict[int, Dict[str, str]] = {}
+
+    def participant_dict(p: ApptotoParticipant) -> Dict[str, str]:
+        d = participants.get(id(p))
+        if d is None:
+            d = participants[id(p)] = p.to_dict()
+        return d
+
+    body = dict(fields, events=[e.to_dict([participant_dict(p) for p in e.participants]) for e in events])
+    if orjson is not None:
+        return orjson.dumps(body)
+    return _encoder.encode(body).encode()
@@ -1,4 +1,9 @@
+from typing import Dict
+
+
 class ApptotoParticipant:
+    __slots__ = ('name', 'phone', 'email')
+
     def __init__(self, name: str, phone: str, email: str = ''):
         """
         Create an ApptotoParticipant.
@@ -13,3 +18,6 @@ class ApptotoParticipant:
         self.name = name
         self.phone = phone
         self.email = email
+
+    def to_dict(self) -> Dict[str, str]:
+        return {'name': self.name, 'phone': self.phone, 'email': self.email}
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.metrics import (
+    UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY, UPSTREAM_RECEIVED_BYTES, UPSTREAM_REQUESTS, UPSTREAM_SENT_BYTES
+)
+from src.profiling import section
+from src.transport import POOL_MAXSIZE, TIMEOUT
+
+
+class AsyncTransport:
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE, timeout: float = TIMEOUT,
+                 http_transport: httpx.AsyncBaseTransport = None):
+        """
+        Asynchronous HTTP transport shared by the async Apptoto and REDCap clients.
+
+        An `httpx.AsyncClient` can only be used by the event loop that created it, so each event loop gets
+        its own client for each host, which keeps connections alive until `aclose` is called on that loop.
+        A script running many calls in one loop reuses connections for all of them.
+
+        :param pool_maxsize: Maximum number of connections kept alive for each host
+        :param timeout: Default number of seconds to wait for a response
+        :param http_transport: Transport used by the clients instead of the network, for example in tests
+        """
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._http_transport = http_transport
+        self._clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def client(self, url: str) -> httpx.AsyncClient:
+        """
+        Get the running event loop's client for the host of `url`, creating it on first use.
+
+        :param url: Any URL on the host
+        :return: The host's client
+        """
+        parts = urlsplit(url)
+        host = f'{parts.scheme}://{parts.netloc}'
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(host)
+            if client is None:
+                limits = httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize)
+                client = httpx.AsyncClient(limits=limits, transport=self._http_transport)
+                clients[host] = client
+
+        return client
+
+    async def request(self, method: str, url: str, service: str = None, operation: str = None,
+                      **kwargs) -> httpx.Response:
+        """
+        Send a request, recording its latency, status code and size in the upstream metrics.
+
+        :param method: HTTP method
+        :param url: URL of the request
+        :param service: Name of the service, for metrics, defaulting to the host
+        :param operation: Name of the call, for metrics, defaulting to the method
+        :param kwargs: Arguments to `httpx.AsyncClient.request`
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        labels = {'service': service or urlsplit(url).netloc, 'operation': operation or method}
+        UPSTREAM_IN_FLIGHT.inc(**labels)
+        start = time.perf_counter()
+        try:
+            with section(labels['service']):
+                r = await self.client(url).request(method=method, url=url, **kwargs)
+        except httpx.HTTPError:
+            UPSTREAM_REQUESTS.inc(status='error', **labels)
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, **labels)
+            UPSTREAM_IN_FLIGHT.dec(**labels)
+
+        UPSTREAM_REQUESTS.inc(status=str(r.status_code), **labels)
+        UPSTREAM_SENT_BYTES.inc(len(r.request.content), **labels)
+        UPSTREAM_RECEIVED_BYTES.inc(len(r.content), **labels)
+        return r
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('DELETE', url, **kwargs)
+
+    async def aclose(self):
+        """Close the running event loop's clients, before the loop is closed."""
+        with self._lock:
+            clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+
+_async_transport: Optional[AsyncTransport] = None
+_async_transport_lock = threading.Lock()
+
+
+def get_async_transport() -> AsyncTransport:
+    """Get the process-wide async transport, creating it with default settings on first use."""
+    global _async_transport
+    with _async_transport_lock:
+        if _async_transport is None:
+            _async_transport = AsyncTransport()
+        return _async_transport
+
+
+def set_async_transport(transport: Optional[AsyncTransport]) -> Optional[AsyncTransport]:
+    """
+    Replace the process-wide async transport.
+
+    :param transport: The new transport, or None to create a default one on next use
+    :return: The previous transport
+    """
+    global _async_transport
+    with _async_transport_lock:
+        previous, _async_transport = _async_transport, transport
+    return previous
+
+
+def configure_async_transport(config: Dict[str, str]) -> AsyncTransport:
+    """
+    Create the process-wide async transport from configuration values.
+
+    :param config: A dictionary of configuration values, which may set `http_pool_maxsize` and `http_timeout`
+    :return: The new transport
+    """
+    transport = AsyncTransport(pool_maxsize=int(config.get('http_pool_maxsize', POOL_MAXSIZE)),
+                               timeout=float(config.get('http_timeout', TIMEOUT)))
+    set_async_transport(transport)
+    return transport
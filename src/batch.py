@@ -0,0 +1,161 @@
+import argparse
+import csv
+import io
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List
+
+from src.apptoto import Apptoto
+from src.constants import MAX_IN_FLIGHT, BATCH_WORKERS
+from src.event_generator import EventGenerator
+from src.journal import PostingJournal
+from src.participant import Participant, valid_participant_id
+from src.redcap import Redcap, RedcapError
+from src.rate_control import get_controller
+from src.redcap_mirror import RedcapMirror
+
+
+class BatchResult:
+    def __init__(self, participant_id: str, generated: bool = False, error: str = '', messages_csv: str = None):
+        """
+        The result of generating messages for one participant in a batch.
+
+        :param participant_id: The participant identifier
+        :param generated: True if all events were posted to Apptoto
+        :param error: Why messages were not generated
+        :param messages_csv: CSV of the generated messages
+        """
+        self.participant_id = participant_id
+        self.generated = generated
+        self.error = error
+        self.messages_csv = messages_csv
+
+
+def parse_participant_ids(text: str) -> List[str]:
+    """
+    Split participant identifiers separated by commas or whitespace, dropping duplicates.
+
+    :param text: Participant identifiers
+    :return: List of participant identifiers in the order given
+    """
+    return list(dict.fromkeys(text.replace(',', ' ').split()))
+
+
+def generate_batch(config: Dict[str, str], instance_path: str, participant_ids: List[str],
+                   mirror: RedcapMirror = None, journal: PostingJournal = None,
+                   progress: Callable[[int, int], None] = None) -> List[BatchResult]:
+    """
+    Generate messages for many participants.
+
+    REDCap data for all participants is exported with one request. Participants are generated in parallel,
+    and all of them post to Apptoto through one client, which bounds the requests in flight and their rate.
+
+    :param config: A dictionary of configuration values
+    :param instance_path: Folder holding the message file
+    :param participant_ids: Participant identifiers in the form ASHnnn
+    :param mirror: Local copy of REDCap records, if any
+    :param journal: Journal of planned and posted events, so running a batch again only posts missing events
+    :param progress: Called with the number of participants done and the number in the batch
+    :return: A result for each participant, in the order given
+    """
+    results = {p: BatchResult(p, error='Participant identifier must be in form "ASHnnn"')
+               for p in participant_ids if not valid_participant_id(p)}
+    valid_ids = [p for p in participant_ids if p not in results]
+    if progress:
+        progress(len(results), len(participant_ids))
+
+    if valid_ids:
+        rc = Redcap(api_token=config['redcap_api_token'], mirror=mirror)
+        try:
+            participants = rc.get_participants_specific_data(valid_ids)
+        except RedcapError as err:
+            participants = {p: err for p in valid_ids}
+
+        rate_limit = config.get('apptoto_rate_limit')
+        apptoto = Apptoto(api_token=config['apptoto_api_token'],
+                          user=config['apptoto_user'],
+                          max_in_flight=int(config.get('apptoto_max_in_flight', MAX_IN_FLIGHT)),
+                          rate_limit=float(rate_limit) if rate_limit else None,
+                          controller=get_controller(config))
+
+        generators = {p: EventGenerator(config=config, participant=part, instance_path=instance_path, apptoto=apptoto)
+                      for p, part in participants.items() if not isinstance(part, RedcapError)}
+        # Schedules for the whole batch are planned together, before any participant is posted.
+        EventGenerator.plan_many(list(generators.values()))
+
+        def generate(participant_id: str) -> BatchResult:
+            part = participants[participant_id]
+            if isinstance(part, RedcapError):
+                return BatchResult(participant_id, error=part.message)
+            return _generate_participant(part, generators[participant_id], journal)
+
+        with ThreadPoolExecutor(max_workers=int(config.get('batch_workers', BATCH_WORKERS))) as executor:
+            for result in executor.map(generate, valid_ids):
+                results[result.participant_id] = result
+                if progress:
+                    progress(len(results), len(participant_ids))
+
+    return [results[p] for p in participant_ids]
+
+
+def _generate_participant(part: Participant, eg: EventGenerator, journal: PostingJournal) -> BatchResult:
+    try:
+        generated = eg.generate(journal=journal)
+    except ValueError as err:
+        return BatchResult(part.participant_id, error=str(err))
+
+    if not generated:
+        return BatchResult(part.participant_id, error='Failed to create some messages')
+
+    with io.StringIO(newline='') as csvfile:
+        eg.write_csv(csvfile)
+        return BatchResult(part.participant_id, generated=True, messages_csv=csvfile.getvalue())
+
+
+def write_archive(results: List[BatchResult], f: BinaryIO):
+    """
+    Write a ZIP archive with a report of the batch and the messages CSV of each generated participant.
+
+    :param results: Results of the batch
+    :param f: File-like object opened for binary writing
+    """
+    with zipfile.ZipFile(f, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with io.StringIO(newline='') as report:
+            filewriter = csv.DictWriter(report, fieldnames=['participant_id', 'generated', 'error'])
+            filewriter.writeheader()
+            for r in results:
+                filewriter.writerow({'participant_id': r.participant_id, 'generated': r.generated, 'error': r.error})
+            zf.writestr('report.csv', report.getvalue())
+
+        for r in results:
+            if r.messages_csv is not None:
+                zf.writestr(f'{r.participant_id}.csv', r.messages_csv)
+
+
+def main(argv: List[str] = None) -> int:
+    """Generate messages for many participants from the command line."""
+    parser = argparse.ArgumentParser(description='Generate messages for many participants. '
+                                                 'Configuration is read from MESSAGE_AUTOMATION_SETTINGS.')
+    parser.add_argument('participants', nargs='+', help='Participant identifiers in the form ASHnnn')
+    parser.add_argument('-o', '--output', default='batch.zip', help='ZIP archive of the report and messages')
+    args = parser.parse_args(argv)
+
+    from src.flask_app import create_app
+    app = create_app()
+
+    results = generate_batch(app.config['AUTOMATIONCONFIG'], app.instance_path,
+                             parse_participant_ids(' '.join(args.participants)),
+                             mirror=app.extensions.get('redcap_mirror'),
+                             journal=app.extensions.get('journal'))
+    with open(args.output, 'wb') as f:
+        write_archive(results, f)
+
+    for r in results:
+        print(f'{r.participant_id}\t{"generated" if r.generated else "failed"}\t{r.error}')
+
+    return 0 if all(r.generated for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,24 @@
-from datetime import datetime
+import base64
+import csv
+import io
+from datetime import date, datetime
 from typing import Optional, List
 
 from flask import (
-    Blueprint, current_app, flash, make_response, render_template, request, send_file
+    Blueprint, Response, abort, current_app, flash, make_response, redirect, render_template, request, send_file,
+    stream_template, url_for
 )
 from flask.json import jsonify
 from werkzeug.datastructures import ImmutableMultiDict
 
-from src.apptoto import Apptoto
+from src.apptoto import Apptoto, ApptotoError
+from src.batch import parse_participant_ids
+from src.constants import MAX_IN_FLIGHT
 from src.event_generator import EventGenerator
+from src.exports import FORMATS, MESSAGE_FIELDS, ExportError, export_rows
+from src.participant import valid_participant_id
+from src.profiling import is_profiling
+from src.rate_control import get_controller
 from src.redcap import Redcap, RedcapError
 
 bp = Blueprint('blueprints', __name__)
@@ -16,7 +26,7 @@ bp = Blueprint('blueprints', __name__)
 
 def _validate_participant_id(form_data: ImmutableMultiDict) -> Optional[List[str]]:
     errors = []
-    if len(form_data['participant']) != 6 or not form_data['participant'].startswith('ASH'):
+    if not valid_participant_id(form_data['participant']):
         errors.append('Participant identifier must be in form \"ASHnnn\"')
 
     if errors:
@@ -25,6 +35,19 @@ def _validate_participant_id(form_data: ImmutableMultiDict) -> Optional[List[str
         return None
 
 
+def _redcap() -> Redcap:
+    return Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'],
+                  mirror=current_app.extensions.get('redcap_mirror'))
+
+
+def _apptoto() -> Apptoto:
+    config = current_app.config['AUTOMATIONCONFIG']
+    return Apptoto(api_token=config['apptoto_api_token'],
+                   user=config['apptoto_user'],
+                   max_in_flight=int(config.get('apptoto_max_in_flight', MAX_IN_FLIGHT)),
+                   controller=get_controller(config))
+
+
 @bp.route('/diary', methods=['GET', 'POST'])
 def diary_form():
     if request.method == 'GET':
@@ -38,7 +61,7 @@ def diary_form():
                     flash(e, 'danger')
                 return render_template('daily_diary_form.html')
 
-            rc = Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'])
+            rc = _redcap()
             try:
                 part = rc.get_session_0(request.form['participant'])
             except RedcapError as err:
@@ -65,21 +88,65 @@ def generation_form():
                     flash(e, 'danger')
                 return render_template('generation_form.html')
 
-            rc = Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'])
-            try:
-                part = rc.get_participant_specific_data(request.form['participant'])
-            except RedcapError as err:
-                flash(str(err), 'danger')
-                return render_template('generation_form.html')
+            # Generating takes minutes, so run it in the background and show its progress.
+            # The job is profiled too when this request is, since it does the work.
+            job = current_app.extensions['jobs'].submit('generate', {'participant_id': request.form['participant']},
+                                                        profile=is_profiling())
+            return redirect(url_for('.job_status', job_id=job.job_id))
 
-            eg = EventGenerator(config=current_app.config['AUTOMATIONCONFIG'], participant=part,
-                                instance_path=current_app.instance_path)
-            if eg.generate():
-                f = eg.write_file()
-                return send_file(f, mimetype='text/csv', as_attachment=True)
-            else:
-                flash('Failed to create some messages', 'danger')
-            return render_template('generation_form.html')
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = current_app.extensions['jobs'].store.get(job_id)
+    if job is None:
+        abort(404)
+
+    if request.accept_mimetypes.best == 'application/json':
+        return make_response(jsonify(job.to_dict()), 200)
+    return render_template('job_status.html', job=job)
+
+
+@bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = current_app.extensions['jobs'].store.get(job_id)
+    if job is None or job.result is None:
+        abort(404)
+
+    if job.kind == 'batch':
+        return send_file(io.BytesIO(base64.b64decode(job.result)), mimetype='application/zip',
+                         as_attachment=True, download_name='batch.zip')
+
+    # Messages are downloaded as CSV, or with ?format=ndjson or ?format=parquet for analysis.
+    export_format = request.args.get('format', 'csv')
+    if export_format not in FORMATS:
+        return make_response((jsonify(f'Unknown format - {export_format}'), 400))
+
+    rows = csv.DictReader(io.StringIO(job.result, newline=''))
+    try:
+        body = export_rows(rows, MESSAGE_FIELDS, export_format)
+    except ExportError as err:
+        return make_response((jsonify(err.message), 501))
+
+    mimetype, extension = FORMATS[export_format]
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={job.params["participant_id"]}.{extension}'})
+
+
+@bp.route('/batch', methods=['GET', 'POST'])
+def batch_form():
+    if request.method == 'GET':
+        return render_template('batch_form.html')
+    elif request.method == 'POST':
+        if 'submit' in request.form:
+            participant_ids = parse_participant_ids(request.form.get('participants', ''))
+            if not participant_ids:
+                flash('Enter at least one participant identifier', 'danger')
+                return render_template('batch_form.html')
+
+            # A batch takes as long as all of its participants, so run it in the background like a single one.
+            job = current_app.extensions['jobs'].submit('batch', {'participant_ids': ' '.join(participant_ids)},
+                                                        profile=is_profiling())
+            return redirect(url_for('.job_status', job_id=job.job_id))
 
 
 @bp.route('/delete', methods=['GET', 'POST'])
@@ -90,7 +157,7 @@ def delete_events():
         if 'submit' in request.form:
             # Access form properties, get participant information, get events, and delete
             participant_id = request.form['participant']
-            rc = Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'])
+            rc = _redcap()
 
             try:
                 phone_number = rc.get_participant_phone(participant_id)
@@ -98,16 +165,67 @@ def delete_events():
                 flash(str(err), 'danger')
                 return render_template('delete_form.html')
 
-            apptoto = Apptoto(api_token=current_app.config['AUTOMATIONCONFIG']['apptoto_api_token'],
-                              user=current_app.config['AUTOMATIONCONFIG']['apptoto_user'])
+            apptoto = _apptoto()
 
             begin = datetime.now()
-            event_ids = apptoto.get_events(begin=begin, phone_number=phone_number)
-            for event_id in event_ids:
-                apptoto.delete_event(event_id)
+            try:
+                event_ids = list(apptoto.iter_event_ids(begin=begin, phone_number=phone_number))
+            except ApptotoError as err:
+                flash(str(err), 'danger')
+                return render_template('delete_form.html')
+            journal = current_app.extensions.get('journal')
+
+            def deletions():
+                deleted = True
+                for result in apptoto.iter_delete_events(event_ids):
+                    deleted = deleted and result.deleted
+                    yield result
+
+                # Generating messages again should plan new events rather than skip those just deleted.
+                # Events left after a failed deletion are still posted, so their record is kept.
+                if journal and deleted:
+                    journal.clear(participant_id)
+
+            # Show each result as its deletion finishes, rather than after all of them.
+            return stream_template('delete_progress.html', participant_id=participant_id, total=len(event_ids),
+                                   results=deletions())
 
-            flash('Deleted messages', 'success')
-            return render_template('delete_form.html')
+
+@bp.route('/reschedule', methods=['GET', 'POST'])
+def reschedule():
+    if request.method == 'GET':
+        return render_template('reschedule_form.html')
+    elif request.method == 'POST':
+        if 'submit' in request.form:
+            error = _validate_participant_id(request.form)
+            if error:
+                for e in error:
+                    flash(e, 'danger')
+                return render_template('reschedule_form.html')
+
+            rc = _redcap()
+            try:
+                part = rc.get_participant_specific_data(request.form['participant'])
+            except RedcapError as err:
+                flash(str(err), 'danger')
+                return render_template('reschedule_form.html')
+
+            # Only the events that differ from the participant's current data are deleted and created.
+            eg = EventGenerator(config=current_app.config['AUTOMATIONCONFIG'], participant=part,
+                                instance_path=current_app.instance_path, apptoto=_apptoto())
+            try:
+                result = eg.reconcile(journal=current_app.extensions.get('journal'))
+            except ValueError as err:
+                flash(str(err), 'danger')
+                return render_template('reschedule_form.html')
+
+            summary = (f'Kept {len(result.kept)} messages, created {len(result.created)} '
+                       f'and deleted {len(result.deleted) - len(result.failed_deletions)}')
+            if result.succeeded:
+                flash(summary, 'success')
+            else:
+                flash(f'{summary}, but some changes failed. Reschedule again to finish them.', 'danger')
+            return render_template('reschedule_form.html')
 
 
 @bp.route('/task', methods=['GET', 'POST'])
@@ -122,7 +240,7 @@ def task():
                     flash(e, 'danger')
                 return render_template('task_form.html')
 
-            rc = Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'])
+            rc = _redcap()
             try:
                 part = rc.get_participant_specific_data(request.form['participant'])
             except RedcapError as err:
@@ -133,7 +251,8 @@ def task():
                                 instance_path=current_app.instance_path)
 
             f = eg.task_input_file()
-            return send_file(f, mimetype='text/csv', as_attachment=True)
+            return send_file(f, mimetype='application/zip', as_attachment=True,
+                             download_name=f'{part.participant_id}_conditions.zip')
 
 
 @bp.route('/count/<participant_id>', methods=['GET'])
@@ -144,15 +263,66 @@ def participant_responses(participant_id):
         return make_response((jsonify(error), 400))
 
     # Use participant ID to get phone number, then get all events and filter conversations for participant responses.
-    rc = Redcap(api_token=current_app.config['AUTOMATIONCONFIG']['redcap_api_token'])
+    rc = _redcap()
 
     try:
         phone_number = rc.get_participant_phone(participant_id)
     except RedcapError as err:
         return make_response((jsonify(str(err)), 404))
 
-    apptoto = Apptoto(api_token=current_app.config['AUTOMATIONCONFIG']['apptoto_api_token'],
-                      user=current_app.config['AUTOMATIONCONFIG']['apptoto_user'])
+    apptoto = _apptoto()
 
-    conversations = apptoto.get_conversations(phone_number=phone_number)
+    store = current_app.extensions.get('conversations')
+    if store is None:
+        conversations = apptoto.get_conversations(phone_number=phone_number)
+        return make_response(jsonify(conversations), 200)
+
+    # Only replies newer than the last sync are fetched from Apptoto.
+    try:
+        conversations = store.replies(phone_number, lambda begin, end: apptoto.iter_replies(phone_number=phone_number,
+                                                                                            begin=begin, end=end))
+    except ApptotoError as err:
+        return make_response((jsonify(str(err)), 502))
     return make_response(jsonify(conversations), 200)
+
+
+@bp.route('/counts', methods=['GET'])
+def participants_responses():
+    # Participants are given as ?participants=ASH001,ASH002, or ?active=true for everyone currently sent messages.
+    active = request.args.get('active', '').lower() in ('1', 'true', 'yes')
+    participant_ids = parse_participant_ids(request.args.get('participants', ''))
+    if not participant_ids and not active:
+        return make_response((jsonify('Give participant identifiers in "participants", or set "active"'), 400))
+
+    errors = [f'Participant identifier must be in form "ASHnnn" - {p}'
+              for p in participant_ids if not valid_participant_id(p)]
+    if errors:
+        return make_response((jsonify(errors), 400))
+
+    # One REDCap export finds all phone numbers, and one listing of the calendar finds all responses.
+    rc = _redcap()
+    try:
+        phone_numbers = rc.get_participant_phones(participant_ids or None,
+                                                  active_on=date.today() if active else None)
+    except RedcapError as err:
+        return make_response((jsonify(str(err)), 502))
+
+    apptoto = _apptoto()
+    phones = list(dict.fromkeys(phone_numbers.values()))
+
+    def fetch(begin, end):
+        return apptoto.iter_replies_by_phone(phones, begin=begin, end=end)
+
+    store = current_app.extensions.get('conversations')
+    try:
+        if store is None:
+            replies = {p: [] for p in phones}
+            for phone_number, at, content in fetch(None, None):
+                replies[phone_number].append((at, content))
+        else:
+            replies = store.replies_by_phone(phones, fetch)
+    except ApptotoError as err:
+        return make_response((jsonify(str(err)), 502))
+
+    return make_response(jsonify({'responses': {p: replies[phone] for p, phone in phone_numbers.items()},
+                                  'missing': [p for p in participant_ids if p not in phone_numbers]}), 200)
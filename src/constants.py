@@ -2,5 +2,10 @@ MESSAGES_PER_DAY_1 = 5
 MESSAGES_PER_DAY_2 = 4
 DAYS_1 = 28
 DAYS_2 = 28
-MAX_EVENTS = 350  # Total number of events to delete is actually 338
+EVENTS_PAGE_SIZE = 100  # Events requested from Apptoto in each page
 ASH_CALENDAR_ID = 1000026606  # Numeric calendar identifier for ASH Messages
+CHUNK_SIZE = 5  # Number of events posted to Apptoto in each request
+MAX_IN_FLIGHT = 8  # Number of requests posting events to Apptoto at the same time
+DELETE_ATTEMPTS = 3  # Times a failed event deletion is tried before it is reported
+BATCH_WORKERS = 4  # Participants generated at the same time in a batch
+JOB_WORKERS = 2  # Background jobs run at the same time by each worker process
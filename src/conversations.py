@@ -0,0 +1,93 @@
+import logging
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CONVERSATION_LOOKBACK = 2  # Days before the last sync searched again for late replies
+
+Fetch = Callable[[Optional[datetime], datetime], Iterable[Tuple[str, str]]]
+FetchMany = Callable[[Optional[datetime], datetime], Iterable[Tuple[str, str, str]]]
+
+
+class ConversationStore:
+    def __init__(self, path: str, lookback: timedelta = timedelta(days=CONVERSATION_LOOKBACK)):
+        """
+        A local log of participants' replies, kept in SQLite and extended with the replies received since
+        each phone number was last synced.
+
+        Replies are found through the events they answer, so a sync also fetches events that started
+        `lookback` before the last sync, to pick up late replies to them. Replies already in the log are skipped.
+
+        :param path: SQLite database file
+        :param lookback: Time before the last sync searched again for replies
+        """
+        self._path = path
+        self._lookback = lookback
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS replies '
+                         '(phone_number TEXT, at TEXT, content TEXT, PRIMARY KEY (phone_number, at, content))')
+            conn.execute('CREATE TABLE IF NOT EXISTS cursors (phone_number TEXT PRIMARY KEY, synced_at TEXT)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def replies(self, phone_number: str, fetch: Fetch) -> List[Tuple[str, str]]:
+        """
+        Get the timestamp and content of a participant's replies, syncing new replies first.
+
+        If the sync fails, replies already in the log are returned, unless the phone number was never synced.
+
+        :param phone_number: Participant's phone number
+        :param fetch: Fetches replies to events starting between two times, or since the start of the study for None
+        :return: List of replies, oldest first
+        """
+        return self.replies_by_phone([phone_number],
+                                     lambda begin, end: ((phone_number, at, content)
+                                                         for at, content in fetch(begin, end)))[phone_number]
+
+    def replies_by_phone(self, phone_numbers: List[str], fetch: FetchMany) -> Dict[str, List[Tuple[str, str]]]:
+        """
+        Get the timestamp and content of many participants' replies, syncing new replies with one fetch first.
+
+        The fetch starts from the oldest sync of the phone numbers, so it covers all of them.
+        If the sync fails, replies already in the log are returned, unless a phone number was never synced.
+
+        :param phone_numbers: Participants' phone numbers
+        :param fetch: Fetches phone number, timestamp and content of replies to events starting between two times,
+        or since the start of the study for None
+        :return: List of replies for each phone number, oldest first
+        """
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        if not phone_numbers:
+            return {}
+
+        started_at = datetime.now()
+        synced = [self._synced_at(p) for p in phone_numbers]
+        synced_at = None if None in synced else min(synced)
+
+        try:
+            replies = list(fetch(None if synced_at is None else synced_at - self._lookback, started_at))
+        except Exception as err:
+            if synced_at is None:
+                raise
+            logging.warning(f'Unable to sync replies, using replies from {synced_at} - {err}')
+        else:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany('INSERT OR IGNORE INTO replies VALUES (?, ?, ?)', replies)
+                conn.executemany('INSERT OR REPLACE INTO cursors VALUES (?, ?)',
+                                 [(p, started_at.isoformat()) for p in phone_numbers])
+
+        results = {p: [] for p in phone_numbers}
+        placeholders = ', '.join('?' * len(phone_numbers))
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f'SELECT phone_number, at, content FROM replies WHERE phone_number IN ({placeholders}) '
+                                'ORDER BY at, rowid', phone_numbers).fetchall()
+        for phone_number, at, content in rows:
+            results[phone_number].append((at, content))
+        return results
+
+    def _synced_at(self, phone_number: str) -> Optional[datetime]:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT synced_at FROM cursors WHERE phone_number = ?', (phone_number,)).fetchone()
+        return None if row is None else datetime.fromisoformat(row[0])
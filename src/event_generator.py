@@ -1,24 +1,31 @@
-import copy
 import csv
+import io
 import logging
-import random
 import zipfile
-from collections import namedtuple
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional
 
-from src.apptoto import Apptoto
+import numpy as np
+
+from src.apptoto import Apptoto, ApptotoError
 from src.apptoto_event import ApptotoEvent
 from src.apptoto_participant import ApptotoParticipant
-from src.constants import DAYS_1, DAYS_2, MESSAGES_PER_DAY_1, MESSAGES_PER_DAY_2
+from src.constants import DAYS_1, DAYS_2, MESSAGES_PER_DAY_1, MESSAGES_PER_DAY_2, MAX_IN_FLIGHT
 from src.enums import Condition
-from src.message import MessageLibrary
+from src.exports import MESSAGE_FIELDS, iter_csv
+from src.journal import Plan, PostingJournal, event_keys
+from src.message import IndividualMessage, MessageLibrary
 from src.participant import Participant
+from src.rate_control import get_controller
+from src.reconcile import Reconciliation, diff_events, event_key, future_events, keep_fitting_days
+from src.schedule import ONE_HOUR, build_schedule, check_participant, spaced_offsets
 
-SMS_TITLE = 'ASH SMS'
-CIGS_TITLE = 'ASH CIGS'
 TASK_MESSAGES = 20
+ARCHIVE_COMPRESSION = {'stored': zipfile.ZIP_STORED,
+                       'deflated': zipfile.ZIP_DEFLATED,
+                       'bzip2': zipfile.ZIP_BZIP2,
+                       'lzma': zipfile.ZIP_LZMA}
 ITI = [
     0.0,
     1.2,
@@ -51,7 +58,7 @@ def intervals_valid(deltas: List[int]) -> bool:
     :return: True if the interval between each consecutive pair of entries
     to deltas is greater than one hour.
     """
-    one_hour = timedelta(seconds=3600)
+    one_hour = timedelta(seconds=ONE_HOUR)
     for a, b in zip(deltas, deltas[1:]):
         interval = timedelta(seconds=(b - a))
         if interval < one_hour:
@@ -60,66 +67,52 @@ def intervals_valid(deltas: List[int]) -> bool:
     return True
 
 
-def random_times(start: datetime, end: datetime, n: int) -> List[datetime]:
+def random_times(start: datetime, end: datetime, n: int, rng: Optional[np.random.Generator] = None) -> List[datetime]:
     """
-    Create randomly spaced times between start and sleep_time.
-    :param n:
+    Create randomly spaced times between start and sleep_time, at least one hour apart.
+
     :param start: Start time
     :type start: datetime
     :param end: End time
     :type end: datetime
     :param n: Number of times to create
+    :param rng: Source of random numbers, by default a new generator
     :return: List of datetime
+    :raises ValueError: If n times at least one hour apart don't fit between start and end
     """
     delta = end - start
-    r = [random.randrange(int(delta.total_seconds())) for _ in range(n)]
-    r.sort()
-
-    while not intervals_valid(r):
-        r = [random.randrange(int(delta.total_seconds())) for _ in range(n)]
-        r.sort()
+    r = spaced_offsets([int(delta.total_seconds())], n, ONE_HOUR, rng or np.random.default_rng())[0]
 
-    times = [start + timedelta(seconds=x) for x in r]
+    times = [start + timedelta(seconds=x) for x in r.tolist()]
     return times
 
 
-def _create_archive(participant_id: str) -> str:
-    compression = zipfile.ZIP_STORED
-
-    archive_name = Path.home().joinpath(f'{participant_id}_conditions.zip')
-    with zipfile.ZipFile(archive_name, mode='w', compression=compression) as zf:
-        p = Path.home()
-
-        for f in p.glob(f'*{participant_id}*.csv'):
-            zf.write(f, arcname=f.name, compress_type=compression)
-
-    return str(archive_name)
-
-
-def _condition_abbrev(condition: Condition) -> str:
-    if condition == Condition.VALUES:
-        return 'Values'
-    elif condition == Condition.HIGHLEVEL:
-        return 'HLC'
-    elif condition == Condition.DOWNREG:
-        return 'CR'
-    else:
-        assert 'Invalid condition'
-
-
 class EventGenerator:
-    def __init__(self, config: Dict[str, str], participant: Participant, instance_path: str):
+    def __init__(self, config: Dict[str, str], participant: Participant, instance_path: str,
+                 apptoto: Apptoto = None):
         """
         Generate events for making text messages.
 
         :param config: A dictionary of configuration values
         :param participant: The participant who will receive messages
         :type participant: Participant
+        :param apptoto: Apptoto client to post events with, shared with other generators.
+        By default each call creates its own client from the configuration.
         """
         self._config = config
         self._participant = participant
         self._path = Path(instance_path) / config['message_file']
         self._messages = None
+        self._planned = None
+        self._shared_apptoto = apptoto
+
+    def _apptoto(self) -> Apptoto:
+        if self._shared_apptoto:
+            return self._shared_apptoto
+        return Apptoto(api_token=self._config['apptoto_api_token'],
+                       user=self._config['apptoto_user'],
+                       max_in_flight=int(self._config.get('apptoto_max_in_flight', MAX_IN_FLIGHT)),
+                       controller=get_controller(self._config))
 
     def daily_diary(self):
         """
@@ -129,8 +122,7 @@ class EventGenerator:
         which are sent after session 0, before session 1.
         :return:
         """
-        apptoto = Apptoto(api_token=self._config['apptoto_api_token'],
-                          user=self._config['apptoto_user'])
+        apptoto = self._apptoto()
         part = ApptotoParticipant(name=self._participant.initials, phone=self._participant.phone_number)
 
         first_day = self._participant.daily_diary_time()
@@ -145,7 +137,7 @@ class EventGenerator:
                                        start_time=t,
                                        end_time=t,
                                        content=content,
-                                       participants=[copy.copy(part)]))
+                                       participants=[part]))
 
         # Add quit_message_date date boosters
         s = datetime.strptime(f'{self._participant.quit_date} {self._participant.wake_time}', '%Y-%m-%d %H:%M')
@@ -157,7 +149,7 @@ class EventGenerator:
                                    start_time=quit_message_date,
                                    end_time=quit_message_date,
                                    content=content,
-                                   participants=[copy.copy(part)]))
+                                   participants=[part]))
 
         quit_message_date = quit_message_date - timedelta(days=1)
         content = 'UO: Day Before'
@@ -167,149 +159,257 @@ class EventGenerator:
                                    start_time=quit_message_date,
                                    end_time=quit_message_date,
                                    content=content,
-                                   participants=[copy.copy(part)]))
+                                   participants=[part]))
 
         if len(events) > 0:
             return apptoto.post_events(events)
 
-    def generate(self) -> bool:
+    def generate(self, progress: Optional[Callable[[int, int], None]] = None,
+                 journal: PostingJournal = None) -> bool:
         """
         Generate events for intervention messages, messages about daily cigarette usage,
         messages for boosters, daily diary rounds 2, 3 and 4.
-        :return:
+
+        With a journal, the planned events are saved before posting and each event is recorded once Apptoto
+        accepts it. Calling again after a failure posts only the events of the saved plan that were not accepted,
+        and calling again after success posts nothing. If the participant's REDCap data changed since the plan
+        was saved, their future events are reconciled with a new plan instead.
+
+        :param progress: Called with the number of events posted so far and the number of events
+        :param journal: Journal of planned and posted events
+        :return: True if all events were posted
         """
-        apptoto = Apptoto(api_token=self._config['apptoto_api_token'],
-                          user=self._config['apptoto_user'])
-        part = ApptotoParticipant(name=self._participant.initials, phone=self._participant.phone_number)
+        apptoto = self._apptoto()
+        if journal is None:
+            return apptoto.post_events(self._plan_events(), progress=progress)
+
+        participant_id = self._participant.participant_id
+        plan = journal.plan(participant_id)
+        if plan is None:
+            events = self._plan_events()
+            journal.save_plan(participant_id, events, self._messages)
+            posted = set()
+        elif self._plan_changed(plan):
+            print(f'Saved plan for {participant_id} no longer matches REDCap, changing its events')
+            return self.reconcile(journal=journal).succeeded
+        else:
+            events = plan.events
+            self._messages = plan.messages
+            if plan.completed:
+                print(f'Events already posted for {participant_id}')
+                return True
+            posted = journal.posted(participant_id)
+
+        pending = [(k, e) for k, e in zip(event_keys(events), events) if k not in posted]
+        pending_keys = [k for k, _ in pending]
+        already_posted = len(events) - len(pending)
+
+        def report(done: int, total: int):
+            if progress:
+                progress(already_posted + done, len(events))
+
+        def record(start: int, chunk: List[ApptotoEvent]):
+            journal.record(participant_id, pending_keys[start:start + len(chunk)], start)
+
+        if not apptoto.post_events([e for _, e in pending], progress=report, on_posted=record):
+            return False
 
-        events = []
-        messages = MessageLibrary(path=self._path)
-        num_required_messages = 28 * (MESSAGES_PER_DAY_1 + MESSAGES_PER_DAY_2)
-        self._messages = messages.get_messages_by_condition(self._participant.condition,
-                                                            self._participant.message_values,
-                                                            num_required_messages)
+        journal.complete(participant_id)
+        return True
 
-        s = datetime.strptime(f'{self._participant.quit_date} {self._participant.wake_time}', '%Y-%m-%d %H:%M')
-        e = datetime.strptime(f'{self._participant.quit_date} {self._participant.sleep_time}', '%Y-%m-%d %H:%M')
-        hour_before_sleep_time = e - timedelta(seconds=3600)
-        three_hours_before_sleep_time = e - timedelta(hours=3)
-
-        Event = namedtuple('Event', ['time', 'title', 'content'])
-
-        # Generate intervention messages
-        n = 0
-        for days in range(DAYS_1):
-            delta = timedelta(days=days)
-            start = s + delta
-            end = e + delta
-            # Get times each day to send messages
-            # Send 5 messages a day for the first 28 days
-            times_list = random_times(start, end, MESSAGES_PER_DAY_1)
-            for t in times_list:
-                # Prepend each message with "UO: "
-                content = "UO: " + self._messages[n].message
-                events.append(Event(time=t, title=SMS_TITLE, content=content))
-                n = n + 1
-
-        for days in range(DAYS_1, DAYS_1 + DAYS_2):
-            delta = timedelta(days=days)
-            start = s + delta
-            end = e + delta
-            # Get times each day to send messages
-            # Send 4 messages a day for the first 28 days
-            times_list = random_times(start, end, MESSAGES_PER_DAY_2)
-            for t in times_list:
-                # Prepend each message with "UO: "
-                content = "UO: " + self._messages[n].message
-                events.append(Event(time=t, title=SMS_TITLE, content=content))
-                n = n + 1
-
-        # Add one message per day asking for a reply with the number of cigarettes smoked
-        for days in range(DAYS_1 + DAYS_2):
-            delta = timedelta(days=days)
-            t = hour_before_sleep_time + delta
-            content = "UO: Good evening! Please respond with the number of cigarettes you have smoked today. " \
-                      "If you have not smoked any cigarettes, please respond with a 0. Thank you!"
-            events.append(Event(time=t, title=CIGS_TITLE, content=content))
-
-        # Add booster messages
-        n = 1
-        for days in range(1, 51, 7):
-            delta = timedelta(days=days)
-            t = three_hours_before_sleep_time + delta
-            title = f'{_condition_abbrev(self._participant.condition)} Booster {n}'
-            content = "UO: Booster session"
-            events.append(Event(time=t, title=title, content=content))
-            n = n + 1
-
-            delta = timedelta(days=(days + 3))
-            t = three_hours_before_sleep_time + delta
-            title = f'{_condition_abbrev(self._participant.condition)} Booster {n}'
-            content = "UO: Booster session"
-            events.append(Event(time=t, title=title, content=content))
-            n = n + 1
-
-        # Add daily diary messages
-        first_day = self._participant.daily_diary_time()
-        for day in range(0, 4):
-            content = f'UO: Daily Diary #{day + 5}'
-            title = f'ASH Daily Diary #{day + 5}'
-            t = first_day + timedelta(days=day + 37)
-            events.append(Event(time=t, title=title, content=content))
-        for day in range(0, 4):
-            content = f'UO: Daily Diary #{day + 9}'
-            title = f'ASH Daily Diary #{day + 9}'
-            t = first_day + timedelta(days=day + 114)
-            events.append(Event(time=t, title=title, content=content))
+    def reconcile(self, journal: PostingJournal = None, now: datetime = None) -> Reconciliation:
+        """
+        Change the participant's future events to match a new plan, for example after their wake time,
+        sleep time or quit date is corrected, deleting and creating only the events that differ.
+
+        The new plan keeps the intervention messages of the journal's plan, if any, and the existing
+        intervention messages of each day that still fits the participant's wake and sleep times.
+        Existing events are matched to planned events by title, start time and content.
+        Events that are not planned are deleted first, then the missing events are posted.
+        Reconciling again after a failure finishes the changes.
+
+        :param journal: Journal of planned and posted events, updated with the new plan
+        :param now: Events starting before this time are left as they are, by default the current time
+        :return: The changes made, and whether all of them succeeded
+        """
+        apptoto = self._apptoto()
+        participant_id = self._participant.participant_id
+        begin = now or datetime.now()
+
+        plan = journal.plan(participant_id) if journal else None
+        if plan is not None:
+            self._messages = plan.messages
+        else:
+            self._messages = self._select_messages()
+        schedule = build_schedule([self._participant], [self._messages])
+        planned = schedule.apptoto_events(0, self._config['apptoto_calendar'], self._apptoto_participant())
+
+        # Only events of the kinds planned here are changed, leaving those created by daily_diary alone.
+        try:
+            existing = [e for e in apptoto.iter_events(begin=begin, phone_number=self._participant.phone_number)
+                        if e['title'] in schedule.titles]
+        except ApptotoError as err:
+            print(err.message)
+            return Reconciliation(planned, [], [], [])
+
+        events = future_events(keep_fitting_days(planned, existing, self._participant), begin)
+        result = diff_events(events, existing)
+        print(f'Reconciling events for {participant_id} - keeping {len(result.kept)}, '
+              f'creating {len(result.created)}, deleting {len(result.deleted)}')
+
+        result.failed_deletions = [r.event_id for r in apptoto.delete_events(result.deleted) if not r.deleted]
+
+        if journal is None:
+            result.posted = apptoto.post_events(result.events_to_create)
+            return result
+
+        # The journal keeps the future events, so generating afterwards posts only what is still missing.
+        journal.save_plan(participant_id, events, self._messages)
+        keys = event_keys(events)
+        journal.record(participant_id, [keys[i] for i in result.kept], 0)
+        created_keys = [keys[i] for i in result.created]
+
+        def record(start: int, chunk: List[ApptotoEvent]):
+            journal.record(participant_id, created_keys[start:start + len(chunk)], start)
+
+        result.posted = apptoto.post_events(result.events_to_create, on_posted=record)
+        if result.succeeded:
+            journal.complete(participant_id)
+        return result
+
+    def _plan_changed(self, plan: Plan) -> bool:
+        """
+        Check whether a saved plan differs from a new plan with the same messages, for example because
+        the participant's quit date or wake time changed in REDCap.
 
-        if len(events) > 0:
-            apptoto_events = []
-            for e in events:
-                apptoto_events.append(ApptotoEvent(calendar=self._config['apptoto_calendar'],
-                                                   title=e.title,
-                                                   start_time=e.time,
-                                                   end_time=e.time,
-                                                   content=e.content,
-                                                   participants=[copy.copy(part)]))
-
-            return apptoto.post_events(apptoto_events)
-
-    def write_file(self):
-        f = Path.home() / (self._participant.participant_id + '.csv')
-        with open(f, 'w', newline='') as csvfile:
-            fieldnames = ['UO_ID', 'Message']
-            filewriter = csv.DictWriter(csvfile,
-                                        delimiter=',',
-                                        quotechar='\"',
-                                        quoting=csv.QUOTE_MINIMAL,
-                                        fieldnames=fieldnames)
-            filewriter.writeheader()
-            for m in self._messages:
-                filewriter.writerow({'UO_ID': m.message_id, 'Message': m.message})
+        Intervention messages are at random times, so the saved messages of each day that still fits are kept
+        in the new plan before comparing. Only events from the first saved event on are compared, since a plan
+        saved by `reconcile` has only future events.
 
-        return f
+        :param plan: The saved plan
+        :return: True if the saved plan no longer matches
+        """
+        if not plan.events:
+            return False
+
+        schedule = build_schedule([self._participant], [plan.messages])
+        planned = schedule.apptoto_events(0, self._config['apptoto_calendar'], self._apptoto_participant())
+        begin = min(datetime.fromisoformat(e.start_time) for e in plan.events)
+        events = future_events(keep_fitting_days(planned, [e.to_dict() for e in plan.events], self._participant),
+                               begin)
+        return (sorted(event_key(e.title, e.start_time, e.content) for e in events)
+                != sorted(event_key(e.title, e.start_time, e.content) for e in plan.events))
+
+    def _plan_events(self) -> List[ApptotoEvent]:
+        """
+        Plan events for intervention messages, messages about daily cigarette usage,
+        messages for boosters, daily diary rounds 2, 3 and 4.
+        :return: List of events
+        """
+        if self._planned is not None:
+            return self._planned
+
+        self._messages = self._select_messages()
+        schedule = build_schedule([self._participant], [self._messages])
+        return schedule.apptoto_events(0, self._config['apptoto_calendar'], self._apptoto_participant())
 
-    def task_input_file(self):
-        messages = MessageLibrary(path=self._path)
+    @staticmethod
+    def plan_many(generators: List['EventGenerator']):
+        """
+        Plan the events of many generators with one schedule, which they post when they generate.
 
-        for session in range(1, 3):
-            for run in range(1, 5):
-                file_name = Path.home() / f'VAFF_{self._participant.participant_id}_Session{session}_Run{run}.csv'
+        Generators whose participant can't be planned are left to plan, and fail, on their own.
 
-                with open(file_name, 'w', newline='') as csvfile:
-                    fieldnames = ['message', 'iti']
-                    filewriter = csv.DictWriter(csvfile,
-                                                delimiter=',',
-                                                quotechar='\"',
-                                                quoting=csv.QUOTE_MINIMAL,
-                                                fieldnames=fieldnames)
-                    filewriter.writeheader()
+        :param generators: Generators to plan
+        """
+        ready = []
+        for g in generators:
+            try:
+                check_participant(g._participant)
+                g._messages = g._select_messages()
+                ready.append(g)
+            except ValueError:
+                continue
+
+        if not ready:
+            return
+
+        schedule = build_schedule([g._participant for g in ready], [g._messages for g in ready])
+        for i, g in enumerate(ready):
+            g._planned = schedule.apptoto_events(i, g._config['apptoto_calendar'], g._apptoto_participant())
+
+    def _select_messages(self) -> List[IndividualMessage]:
+        messages = MessageLibrary.load(path=self._path)
+        num_required_messages = DAYS_1 * MESSAGES_PER_DAY_1 + DAYS_2 * MESSAGES_PER_DAY_2
+        return messages.get_messages_by_condition(self._participant.condition,
+                                                  self._participant.message_values,
+                                                  num_required_messages,
+                                                  balance=bool(self._config.get('balance_message_values')))
+
+    def _apptoto_participant(self) -> ApptotoParticipant:
+        # All events share one participant, which is only converted to JSON once per request.
+        return ApptotoParticipant(name=self._participant.initials, phone=self._participant.phone_number)
+
+    def message_rows(self) -> Iterator[Dict[str, str]]:
+        """Yield the identifier and text of each generated message, as rows keyed by MESSAGE_FIELDS."""
+        for m in self._messages:
+            yield {'UO_ID': m.message_id, 'Message': m.message}
+
+    def write_csv(self, csvfile):
+        """
+        Write the generated messages as CSV.
 
-                    task_messages = messages.get_messages_by_condition(Condition.VALUES,
-                                                                       self._participant.task_values,
-                                                                       TASK_MESSAGES)
+        :param csvfile: File-like object opened for text, with newline=''
+        """
+        csvfile.writelines(iter_csv(self.message_rows(), MESSAGE_FIELDS))
 
-                    for i, m in enumerate(task_messages):
-                        filewriter.writerow({fieldnames[0]: m.message, fieldnames[1]: ITI[i]})
+    def task_input_file(self, compression: str = None) -> io.BytesIO:
+        """
+        Create a ZIP archive of the task input files in memory.
 
-        return _create_archive(self._participant.participant_id)
+        :param compression: One of stored, deflated, bzip2 or lzma, defaulting to the `task_archive_compression`
+        configuration value, or deflated
+        :return: The archive, positioned at its start
+        """
+        f = io.BytesIO()
+        self.write_task_archive(f, compression=compression)
+        f.seek(0)
+        return f
+
+    def write_task_archive(self, f: BinaryIO, compression: str = None):
+        """
+        Write a ZIP archive with a task input file for each run of each session.
+
+        :param f: File-like object opened for binary writing
+        :param compression: One of stored, deflated, bzip2 or lzma, defaulting to the `task_archive_compression`
+        configuration value, or deflated
+        :raises ValueError: If the compression is unknown
+        """
+        compression = compression or self._config.get('task_archive_compression', 'deflated')
+        if compression not in ARCHIVE_COMPRESSION:
+            raise ValueError(f'Unknown compression for task input files - {compression}')
+
+        messages = MessageLibrary.load(path=self._path)
+
+        with zipfile.ZipFile(f, mode='w', compression=ARCHIVE_COMPRESSION[compression]) as zf:
+            for session in range(1, 3):
+                for run in range(1, 5):
+                    file_name = f'VAFF_{self._participant.participant_id}_Session{session}_Run{run}.csv'
+
+                    # Rows are compressed into the archive as they are written.
+                    with zf.open(file_name, mode='w') as entry, \
+                            io.TextIOWrapper(entry, encoding='utf-8', newline='') as csvfile:
+                        fieldnames = ['message', 'iti']
+                        filewriter = csv.DictWriter(csvfile,
+                                                    delimiter=',',
+                                                    quotechar='\"',
+                                                    quoting=csv.QUOTE_MINIMAL,
+                                                    fieldnames=fieldnames)
+                        filewriter.writeheader()
+
+                        task_messages = messages.get_messages_by_condition(Condition.VALUES,
+                                                                           self._participant.task_values,
+                                                                           TASK_MESSAGES)
+
+                        for i, m in enumerate(task_messages):
+                            filewriter.writerow({fieldnames[0]: m.message, fieldnames[1]: ITI[i]})
@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+from typing import Dict, Iterable, Iterator, List
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MESSAGE_FIELDS = ['UO_ID', 'Message']
+
+# Media type and file extension of each export format.
+FORMATS = {'csv': ('text/csv', 'csv'),
+           'ndjson': ('application/x-ndjson', 'ndjson'),
+           'parquet': ('application/vnd.apache.parquet', 'parquet')}
+
+
+class ExportError(Exception):
+    def __init__(self, message):
+        """
+        An exception for data that can't be exported in the format asked for.
+
+        :param message: A string describing the error
+        """
+        self.message = message
+
+
+def iter_csv(rows: Iterable[Dict[str, str]], fieldnames: List[str]) -> Iterator[str]:
+    """
+    Yield CSV text one row at a time, starting with the header.
+
+    :param rows: Rows keyed by field name
+    :param fieldnames: Fields in each row, in column order
+    """
+    with io.StringIO(newline='') as buffer:
+        filewriter = csv.DictWriter(buffer,
+                                    delimiter=',',
+                                    quotechar='\"',
+                                    quoting=csv.QUOTE_MINIMAL,
+                                    fieldnames=fieldnames)
+        filewriter.writeheader()
+        for row in rows:
+            filewriter.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        # A header without rows is still sent.
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterable[Dict[str, str]]) -> Iterator[str]:
+    """Yield each row as a line of JSON."""
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def parquet_bytes(rows: Iterable[Dict[str, str]], fieldnames: List[str]) -> bytes:
+    """
+    Write rows to a Parquet file in memory.
+
+    :param rows: Rows keyed by field name
+    :param fieldnames: Fields in each row, which become string columns
+    :raises ExportError: If pyarrow isn't installed
+    """
+    if pyarrow is None:
+        raise ExportError('Parquet export needs pyarrow, which is not installed')
+
+    columns = {f: [] for f in fieldnames}
+    for row in rows:
+        for f in fieldnames:
+            value = row.get(f)
+            columns[f].append(None if value is None else str(value))
+
+    table = pyarrow.table({f: pyarrow.array(values, type=pyarrow.string()) for f, values in columns.items()})
+    with io.BytesIO() as f:
+        pyarrow.parquet.write_table(table, f)
+        return f.getvalue()
+
+
+def export_rows(rows: Iterable[Dict[str, str]], fieldnames: List[str], export_format: str) -> Iterable:
+    """
+    Export rows in a format from FORMATS.
+
+    CSV and NDJSON are generated a row at a time, for streaming; Parquet is built whole.
+
+    :param rows: Rows keyed by field name
+    :param fieldnames: Fields in each row, in column order
+    :param export_format: One of csv, ndjson or parquet
+    :return: Chunks of the exported data
+    :raises ExportError: If the format is unknown or can't be written here
+    """
+    if export_format == 'csv':
+        return iter_csv(rows, fieldnames)
+    if export_format == 'ndjson':
+        return iter_ndjson(rows)
+    if export_format == 'parquet':
+        return [parquet_bytes(rows, fieldnames)]
+    raise ExportError(f'Unknown export format - {export_format}')
@@ -1,12 +1,23 @@
+import os
 import secrets
+from datetime import timedelta
 
 from flask import Flask
 
 from .blueprints import bp
+from .conversations import ConversationStore
+from .jobs import create_job_runner
+from .journal import PostingJournal
+from .message import MessageLibrary
+from .metrics import init_metrics
+from .profiling import init_profiling
+from .redcap_mirror import RedcapMirror, MIRROR_TTL
+from .transport import configure_transport
 
 
-def create_app(test_config=None):
+def create_app(test_config=None, resume_jobs=False):
     # create and configure the app
+    # Only the web server sets resume_jobs, so command-line scripts don't start jobs left by stopped workers.
     app = Flask(__name__, instance_relative_config=True)
     app.secret_key = secrets.token_urlsafe(64)
 
@@ -16,6 +27,43 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    automation_config = app.config.get('AUTOMATIONCONFIG', {})
+
+    # Connection pools are shared by all requests handled by this process.
+    configure_transport(automation_config)
+
+    if automation_config.get('redcap_mirror'):
+        os.makedirs(app.instance_path, exist_ok=True)
+        ttl = timedelta(seconds=float(automation_config.get('redcap_mirror_ttl', MIRROR_TTL)))
+        app.extensions['redcap_mirror'] = RedcapMirror(path=os.path.join(app.instance_path,
+                                                                         automation_config['redcap_mirror']),
+                                                       ttl=ttl)
+
+    # Read the messages once at startup, so requests don't have to.
+    message_file = os.path.join(app.instance_path, automation_config.get('message_file', ''))
+    if automation_config.get('message_file') and os.path.exists(message_file):
+        MessageLibrary.load(message_file)
+
+    # Requests are profiled on demand only when a token or a sample rate is configured.
+    if automation_config.get('profile_token') or automation_config.get('profile_sample_rate'):
+        init_profiling(app, automation_config)
+
+    if 'redcap_api_token' in automation_config:
+        os.makedirs(app.instance_path, exist_ok=True)
+        app.extensions['journal'] = PostingJournal(
+            os.path.join(app.instance_path, automation_config.get('posting_journal', 'posting_journal.sqlite3')))
+        app.extensions['jobs'] = create_job_runner(automation_config, app.instance_path,
+                                                   mirror=app.extensions.get('redcap_mirror'),
+                                                   journal=app.extensions['journal'],
+                                                   profiles=app.extensions.get('profiles'),
+                                                   resume=resume_jobs)
+
+    if 'apptoto_api_token' in automation_config:
+        os.makedirs(app.instance_path, exist_ok=True)
+        app.extensions['conversations'] = ConversationStore(
+            os.path.join(app.instance_path, automation_config.get('conversation_database', 'conversations.sqlite3')))
+
     app.register_blueprint(bp)
+    init_metrics(app)
 
     return app
@@ -0,0 +1,340 @@
+import base64
+import io
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from src.batch import generate_batch, write_archive
+from src.constants import JOB_WORKERS
+from src.event_generator import EventGenerator
+from src.journal import PostingJournal
+from src.profiling import PROFILE_WAIT, ProfileStore, profile_call
+from src.redcap import Redcap, RedcapError
+from src.redcap_mirror import RedcapMirror
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+JOB_HEARTBEAT = timedelta(seconds=30)  # How often a worker records that its running jobs are still alive
+# A running job whose worker hasn't recorded a heartbeat for this long is assumed to have lost its worker.
+JOB_STALE = timedelta(minutes=5)
+
+Progress = Callable[[int, int], None]
+
+
+class JobError(Exception):
+    def __init__(self, message):
+        """
+        An exception for a job that could not finish.
+
+        :param message: A string describing the error
+        """
+        self.message = message
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, params: Dict[str, str], status: str = QUEUED,
+                 progress: int = 0, total: int = 0, error: str = '', result: str = None,
+                 created_at: str = '', updated_at: str = '', owner: str = None, heartbeat_at: str = None):
+        """
+        A long-running request, run in the background.
+
+        :param job_id: Unique job identifier
+        :param kind: Name of the handler that runs the job
+        :param params: Parameters for the handler
+        :param status: One of queued, running, finished or failed
+        :param progress: Number of steps done, for example events posted
+        :param total: Number of steps in the job
+        :param error: Why the job failed
+        :param result: Result of a finished job
+        :param owner: Host and process id of the worker running the job
+        :param heartbeat_at: When the worker running the job last recorded that it is alive
+        """
+        self.job_id = job_id
+        self.kind = kind
+        self.params = params
+        self.status = status
+        self.progress = progress
+        self.total = total
+        self.error = error
+        self.result = result
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.owner = owner
+        self.heartbeat_at = heartbeat_at
+
+    @property
+    def done(self) -> bool:
+        return self.status in (FINISHED, FAILED)
+
+    def to_dict(self) -> Dict:
+        return {'id': self.job_id,
+                'kind': self.kind,
+                'params': self.params,
+                'status': self.status,
+                'progress': self.progress,
+                'total': self.total,
+                'error': self.error,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at}
+
+
+class JobStore:
+    _columns = ['job_id', 'kind', 'params', 'status', 'progress', 'total', 'error', 'result',
+                'created_at', 'updated_at', 'owner', 'heartbeat_at']
+
+    def __init__(self, path: str):
+        """
+        Keep jobs in SQLite, so they survive a worker restart and are shared by all workers.
+
+        :param path: SQLite database file
+        """
+        self._path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs '
+                         '(job_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, progress INTEGER, '
+                         'total INTEGER, error TEXT, result TEXT, created_at TEXT, updated_at TEXT, '
+                         'owner TEXT, heartbeat_at TEXT)')
+            # Databases created before jobs had owners get the new columns.
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column in ('owner', 'heartbeat_at'):
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def create(self, kind: str, params: Dict[str, str]) -> Job:
+        now = datetime.now().isoformat()
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, params=params, created_at=now, updated_at=now)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job.job_id, kind, json.dumps(params), job.status, 0, 0, '', None, now, now, None, None))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f'SELECT {", ".join(self._columns)} FROM jobs WHERE job_id = ?',
+                               (job_id,)).fetchone()
+
+        if row is None:
+            return None
+        values = dict(zip(self._columns, row))
+        values['params'] = json.loads(values['params'])
+        return Job(**values)
+
+    def update(self, job_id: str, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE job_id = ?', list(fields.values()) + [job_id])
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """
+        Mark a queued job as running by a worker.
+
+        :param job_id: The job identifier
+        :param owner: Host and process id of the worker
+        :return: True if this caller claimed the job, False if another worker already did
+        """
+        now = datetime.now().isoformat()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute('UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, updated_at = ? '
+                                  'WHERE job_id = ? AND status = ?', (RUNNING, owner, now, now, job_id, QUEUED))
+            return cursor.rowcount == 1
+
+    def heartbeat(self, owner: str):
+        """
+        Record that a worker is still running its jobs.
+
+        :param owner: Host and process id of the worker
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?',
+                         (datetime.now().isoformat(), RUNNING, owner))
+
+    def requeue_abandoned(self, stale_after: timedelta = JOB_STALE) -> List[str]:
+        """
+        Queue again the jobs that are queued, or running without a recent heartbeat from their worker.
+
+        :param stale_after: Time without a heartbeat after which a running job's worker is assumed stopped
+        :return: Identifiers of the queued jobs
+        """
+        stale = (datetime.now() - stale_after).isoformat()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE jobs SET status = ?, owner = NULL WHERE status = ? '
+                         'AND COALESCE(heartbeat_at, updated_at) < ?', (QUEUED, RUNNING, stale))
+            rows = conn.execute('SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at', (QUEUED,)).fetchall()
+        return [r[0] for r in rows]
+
+
+def _worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class JobRunner:
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[Job, Progress], str]],
+                 max_workers: int = JOB_WORKERS, profiles: ProfileStore = None,
+                 heartbeat: timedelta = JOB_HEARTBEAT, stale_after: timedelta = JOB_STALE):
+        """
+        Run jobs in background threads, recording a heartbeat for them while they run.
+
+        :param store: Where jobs are kept
+        :param handlers: Function for each kind of job, which reports progress and returns the job's result
+        :param max_workers: Number of jobs run at the same time by this process
+        :param profiles: Where profiles of jobs submitted with `profile` are kept
+        :param heartbeat: How often the heartbeat of running jobs is recorded
+        :param stale_after: Time without a heartbeat after which `resume` starts a running job again
+        """
+        self.store = store
+        self._handlers = handlers
+        self._profiles = profiles
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._heartbeat = heartbeat
+        self._stale_after = stale_after
+        self._resuming = False
+        threading.Thread(target=self._beat, daemon=True).start()
+
+    def submit(self, kind: str, params: Dict[str, str], profile: bool = False) -> Job:
+        """
+        Create a job and start it in the background.
+
+        :param kind: Name of the handler that runs the job
+        :param params: Parameters for the handler
+        :param profile: Profile the job, for example because the request submitting it is profiled
+        :return: The queued job
+        """
+        job = self.store.create(kind, params)
+        self._executor.submit(self._run, job.job_id, profile)
+        return job
+
+    def resume(self) -> List[str]:
+        """
+        Start jobs left queued, or abandoned while running by a worker that stopped,
+        and keep looking for them at every heartbeat.
+
+        :return: Identifiers of the jobs started now
+        """
+        self._resuming = True
+        job_ids = self.store.requeue_abandoned(self._stale_after)
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+        return job_ids
+
+    def _beat(self):
+        while True:
+            time.sleep(self._heartbeat.total_seconds())
+            try:
+                self.store.heartbeat(_worker_name())
+                if self._resuming:
+                    self.resume()
+            except sqlite3.Error:
+                logging.exception('Failed to record the heartbeat of running jobs')
+
+    def _run(self, job_id: str, profile: bool = False):
+        if not self.store.claim(job_id, _worker_name()):
+            return
+
+        job = self.store.get(job_id)
+
+        def progress(done: int, total: int):
+            self.store.update(job_id, progress=done, total=total)
+
+        try:
+            if profile and self._profiles:
+                # The request submitting the job is usually still profiled, so wait for its profile to finish.
+                result = profile_call(self._profiles, f'job {job.kind}', self._handlers[job.kind], job, progress,
+                                      wait=PROFILE_WAIT)
+            else:
+                result = self._handlers[job.kind](job, progress)
+        except (JobError, RedcapError, ValueError) as err:
+            self.store.update(job_id, status=FAILED, error=str(err))
+        except Exception as err:
+            logging.exception(f'Job {job_id} failed')
+            self.store.update(job_id, status=FAILED, error=f'Unexpected error - {err}')
+        else:
+            self.store.update(job_id, status=FINISHED, result=result)
+
+
+def generation_handler(config: Dict[str, str], instance_path: str, mirror: RedcapMirror = None,
+                       journal: PostingJournal = None) -> Callable[[Job, Progress], str]:
+    """
+    Create the handler for jobs generating messages for one participant.
+
+    :param config: A dictionary of configuration values
+    :param instance_path: Folder holding the message file
+    :param mirror: Local copy of REDCap records, if any
+    :param journal: Journal of planned and posted events, so a job started again doesn't post events twice
+    :return: A handler returning the CSV of generated messages
+    """
+    def generate(job: Job, progress: Progress) -> str:
+        rc = Redcap(api_token=config['redcap_api_token'], mirror=mirror)
+        part = rc.get_participant_specific_data(job.params['participant_id'])
+
+        eg = EventGenerator(config=config, participant=part, instance_path=instance_path)
+        if not eg.generate(progress=progress, journal=journal):
+            raise JobError('Failed to create some messages')
+
+        with io.StringIO(newline='') as csvfile:
+            eg.write_csv(csvfile)
+            return csvfile.getvalue()
+
+    return generate
+
+
+def batch_handler(config: Dict[str, str], instance_path: str, mirror: RedcapMirror = None,
+                  journal: PostingJournal = None) -> Callable[[Job, Progress], str]:
+    """
+    Create the handler for jobs generating messages for many participants.
+
+    :param config: A dictionary of configuration values
+    :param instance_path: Folder holding the message file
+    :param mirror: Local copy of REDCap records, if any
+    :param journal: Journal of planned and posted events, so a job started again only posts missing events
+    :return: A handler returning the batch's ZIP archive, encoded in base64
+    """
+    def generate(job: Job, progress: Progress) -> str:
+        results = generate_batch(config, instance_path, job.params['participant_ids'].split(),
+                                 mirror=mirror, journal=journal, progress=progress)
+
+        with io.BytesIO() as archive:
+            write_archive(results, archive)
+            return base64.b64encode(archive.getvalue()).decode('ascii')
+
+    return generate
+
+
+def create_job_runner(config: Dict[str, str], instance_path: str, mirror: RedcapMirror = None,
+                      journal: PostingJournal = None, profiles: ProfileStore = None,
+                      resume: bool = False) -> JobRunner:
+    """
+    Create the job runner for the app.
+
+    :param config: A dictionary of configuration values, which may set `job_database` and `job_workers`
+    :param instance_path: Folder holding the message file and the job database
+    :param mirror: Local copy of REDCap records, if any
+    :param journal: Journal of planned and posted events, if any
+    :param profiles: Where profiles of jobs are kept, if profiling is configured
+    :param resume: Start jobs left unfinished by workers that stopped, now and whenever more are found
+    :return: The job runner
+    """
+    store = JobStore(os.path.join(instance_path, config.get('job_database', 'jobs.sqlite3')))
+    runner = JobRunner(store,
+                       handlers={'generate': generation_handler(config, instance_path, mirror, journal),
+                                 'batch': batch_handler(config, instance_path, mirror, journal)},
+                       max_workers=int(config.get('job_workers', JOB_WORKERS)),
+                       profiles=profiles)
+    if resume:
+        runner.resume()
+    return runner
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from src.apptoto_event import ApptotoEvent
+from src.enums import Condition, CodedValues
+from src.message import IndividualMessage
+
+
+def event_keys(events: List[ApptotoEvent]) -> List[str]:
+    """
+    Create a stable key for each event from its content.
+
+    Events with identical content get a count appended, so each event in the list has its own key.
+
+    :param events: List of events
+    :return: A key for each event
+    """
+    keys = []
+    seen: Dict[str, int] = {}
+    for e in events:
+        digest = hashlib.sha256(json.dumps(e.to_dict(), sort_keys=True).encode()).hexdigest()
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        keys.append(f'{digest}-{n}')
+    return keys
+
+
+class Plan:
+    def __init__(self, events: List[ApptotoEvent], messages: List[IndividualMessage], completed: bool):
+        """
+        The events planned for a participant, with the messages they were created from.
+
+        :param events: Events to post to Apptoto
+        :param messages: Intervention messages in the events
+        :param completed: True once every event has been posted
+        """
+        self.events = events
+        self.messages = messages
+        self.completed = completed
+
+
+class PostingJournal:
+    def __init__(self, path: str):
+        """
+        Record the events planned for each participant and the events Apptoto has accepted.
+
+        A retry after a partial failure posts the same planned events, skipping those already accepted,
+        so no event is created twice.
+
+        :param path: SQLite database file
+        """
+        self._path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS plans '
+                         '(participant_id TEXT PRIMARY KEY, events TEXT, messages TEXT, '
+                         'created_at TEXT, completed_at TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS posted '
+                         '(participant_id TEXT, event_key TEXT, chunk INTEGER, posted_at TEXT, '
+                         'PRIMARY KEY (participant_id, event_key))')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def plan(self, participant_id: str) -> Optional[Plan]:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT events, messages, completed_at FROM plans WHERE participant_id = ?',
+                               (participant_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        events = [ApptotoEvent.from_dict(e) for e in json.loads(row[0])]
+        messages = [IndividualMessage(random_id=m['id'],
+                                      message=m['message'],
+                                      condition=Condition(m['condition']),
+                                      coded_values=CodedValues[m['coded_value']]) for m in json.loads(row[1])]
+        return Plan(events, messages, completed=row[2] is not None)
+
+    def save_plan(self, participant_id: str, events: List[ApptotoEvent], messages: List[IndividualMessage]):
+        """Save the events planned for a participant, replacing any previous plan and its posted events."""
+        messages_data = [{'id': m.message_id, 'message': m.message, 'condition': m.condition.value,
+                          'coded_value': m.coded_value.name} for m in messages]
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM posted WHERE participant_id = ?', (participant_id,))
+            conn.execute('INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?)',
+                         (participant_id, json.dumps([e.to_dict() for e in events]), json.dumps(messages_data),
+                          datetime.now().isoformat(), None))
+
+    def posted(self, participant_id: str) -> Set[str]:
+        """Get the keys of the participant's events that Apptoto has accepted."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT event_key FROM posted WHERE participant_id = ?', (participant_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def record(self, participant_id: str, keys: List[str], chunk: int):
+        """
+        Record events accepted by Apptoto.
+
+        :param participant_id: The participant identifier
+        :param keys: Keys of the accepted events
+        :param chunk: Index of the first accepted event in the posted events
+        """
+        now = datetime.now().isoformat()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR IGNORE INTO posted VALUES (?, ?, ?, ?)',
+                             [(participant_id, k, chunk, now) for k in keys])
+
+    def complete(self, participant_id: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE plans SET completed_at = ? WHERE participant_id = ?',
+                         (datetime.now().isoformat(), participant_id))
+
+    def clear(self, participant_id: str):
+        """Forget the participant's plan, for example after their events are deleted."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM posted WHERE participant_id = ?', (participant_id,))
+            conn.execute('DELETE FROM plans WHERE participant_id = ?', (participant_id,))
@@ -0,0 +1,126 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+_COMPACT_AFTER = 1 << 16  # Characters consumed before the buffer is trimmed
+
+
+class _Reader:
+    def __init__(self, chunks: Iterable[bytes]):
+        """
+        Read JSON text from chunks of UTF-8 bytes, keeping only the unread part in memory.
+
+        :param chunks: Chunks of a JSON document, for example from `requests.Response.iter_content`
+        """
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def _fill(self) -> bool:
+        """Read the next chunk. Return False at the end of the document."""
+        if self._exhausted:
+            return False
+
+        if self._pos > _COMPACT_AFTER:
+            self._text = self._text[self._pos:]
+            self._pos = 0
+
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._exhausted = True
+            self._text += self._utf8.decode(b'', final=True)
+            return False
+
+        self._text += self._utf8.decode(chunk)
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._text) and self._text[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._text) or not self._fill():
+                return
+
+    def next_char(self) -> str:
+        """Consume and return the next character that isn't whitespace."""
+        self._skip_whitespace()
+        if self._pos >= len(self._text):
+            raise ValueError('Unexpected end of JSON document')
+        c = self._text[self._pos]
+        self._pos += 1
+        return c
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        return self._text[self._pos] if self._pos < len(self._text) else ''
+
+    def expect(self, expected: str):
+        c = self.next_char()
+        if c != expected:
+            raise ValueError(f'Expected {expected!r} in JSON document, found {c!r}')
+
+    def value(self) -> Any:
+        """Consume and return the next complete JSON value."""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer may continue in the next chunk, for example '1' then '.5'.
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and (end == len(self._text) or self._text[end] in _NUMBER_CHARS) and self._fill()):
+                continue
+
+            self._pos = end
+            return value
+
+
+def iter_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    Yield the items of the array at `key` in a JSON object, as they arrive.
+
+    Only one item, plus the chunk being read, is held in memory at a time.
+    Other members of the object are parsed and discarded.
+
+    :param chunks: Chunks of a JSON object as UTF-8 bytes
+    :param key: Name of the member holding the array
+    :raises ValueError: If the document is not valid JSON
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield reader.value()
+                    c = reader.next_char()
+                    if c == ']':
+                        break
+                    if c != ',':
+                        raise ValueError(f"Expected ',' or ']' in JSON array, found {c!r}")
+        else:
+            reader.value()
+
+        c = reader.next_char()
+        if c == '}':
+            return
+        if c != ',':
+            raise ValueError(f"Expected ',' or '}}' in JSON object, found {c!r}")
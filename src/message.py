@@ -1,8 +1,14 @@
 import csv
-from random import shuffle
-from typing import List
+import hashlib
+import io
+import os
+import random
+import threading
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
 
 from src.enums import Condition, CodedValues
+from src.profiling import section
 
 
 class IndividualMessage:
@@ -33,40 +39,134 @@ class IndividualMessage:
         return self._coded_values
 
 
+def _reshuffled(pool: List[IndividualMessage]) -> Iterator[IndividualMessage]:
+    """
+    Yield every message in `pool` once per pass, forever, in a new random order each pass.
+
+    A pass never starts with the message that ended the previous pass, so a message is not sent twice in a row.
+
+    :param pool: Messages to yield
+    """
+    previous = None
+    while True:
+        order = random.sample(pool, len(pool))
+        if len(order) > 1 and order[0] is previous:
+            j = random.randrange(1, len(order))
+            order[0], order[j] = order[j], order[0]
+        yield from order
+        previous = order[-1]
+
+
+def _balanced(pools: List[List[IndividualMessage]]) -> Iterator[IndividualMessage]:
+    """
+    Yield one message from each pool in turn, in a new random order of pools each round.
+
+    :param pools: Messages for each value
+    """
+    streams = [_reshuffled(p) for p in pools]
+    while True:
+        for stream in random.sample(streams, len(streams)):
+            yield next(stream)
+
+
 class MessageLibrary:
+    _libraries: Dict[str, Tuple[Tuple[int, int], str, 'MessageLibrary']] = {}
+    _lock = threading.Lock()
+
     def __init__(self, path: str):
         """
         Read messages and associated metadata.
 
+        Messages are indexed by condition and coded value.
+        Use `MessageLibrary.load` to share one library per file across the process.
+
         :param path: File containing messages
         """
+        with open(path, 'rb') as f:
+            self._init_from_bytes(f.read())
+
+    def _init_from_bytes(self, content: bytes):
         self._messages = []
-        with open(path) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                identifier = int(row['UO_ID'])
-                condition = Condition(int(row['ConditionNo']))
-                if condition == Condition.VALUES:
-                    v = CodedValues[row['Value1']]
-                else:
-                    v = CodedValues.none
-
-                m = IndividualMessage(random_id=identifier,
-                                      message=row['Message'],
-                                      condition=condition,
-                                      coded_values=v)
-                self._messages.append(m)
-
-    def get_messages_by_condition(self, condition: Condition, values: List[CodedValues], num_messages)\
-            -> List[IndividualMessage]:
-        messages = []
+        self._index: Dict[Tuple[Condition, CodedValues], List[IndividualMessage]] = {}
+        reader = csv.DictReader(io.StringIO(content.decode(), newline=''))
+        for row in reader:
+            identifier = int(row['UO_ID'])
+            condition = Condition(int(row['ConditionNo']))
+            if condition == Condition.VALUES:
+                v = CodedValues[row['Value1']]
+            else:
+                v = CodedValues.none
+
+            m = IndividualMessage(random_id=identifier,
+                                  message=row['Message'],
+                                  condition=condition,
+                                  coded_values=v)
+            self._messages.append(m)
+            self._index.setdefault((condition, v), []).append(m)
+
+    @classmethod
+    @section('messages')
+    def load(cls, path: str) -> 'MessageLibrary':
+        """
+        Get the process-wide library for a file, reading it again only if it changed.
+
+        The file is checked for a new modification time or size on every call,
+        and read again only if its contents hash differently from the loaded copy.
+
+        :param path: File containing messages
+        :return: The library for the file
+        """
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with cls._lock:
+            cached = cls._libraries.get(key)
+            if cached and cached[0] == stamp:
+                return cached[2]
+
+            with open(key, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if cached and cached[1] == digest:
+                library = cached[2]
+            else:
+                library = cls.__new__(cls)
+                library._init_from_bytes(content)
+
+            cls._libraries[key] = (stamp, digest, library)
+            return library
+
+    def get_messages_by_condition(self, condition: Condition, values: List[CodedValues], num_messages: int,
+                                  balance: bool = False) -> List[IndividualMessage]:
+        """
+        Get `num_messages` random messages for a condition.
+
+        When there are fewer messages than `num_messages`, every message is used once, in random order,
+        before any is used again.
+
+        :param condition: Condition of the messages
+        :param values: Values expressed in the messages, for the values condition
+        :param num_messages: Number of messages to get
+        :param balance: For the values condition, take messages from each of `values` in turn,
+        instead of in proportion to the number of messages expressing each value
+        :return: List of messages
+        :raises ValueError: If there are no messages for the condition and values
+        """
         if condition is Condition.VALUES:
-            messages = [m for m in self._messages if m.condition is Condition.VALUES and m.coded_value in values]
+            pools = [self._index.get((Condition.VALUES, v), []) for v in dict.fromkeys(values)]
         else:
-            messages = [m for m in self._messages if m.condition is condition]
+            pools = [self._index.get((condition, CodedValues.none), [])]
+        pools = [p for p in pools if p]
+
+        if num_messages <= 0:
+            return []
+        if not pools:
+            raise ValueError(f'Unable to find messages for condition {condition.name} and values {values}')
 
-        shuffle(messages)
-        while len(messages) < num_messages:
-            messages = messages + messages
+        if balance and len(pools) > 1:
+            messages = _balanced(pools)
+        else:
+            messages = _reshuffled([m for p in pools for m in p])
 
-        return messages[:num_messages]
+        return list(islice(messages, num_messages))
@@ -0,0 +1,224 @@
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+
+# Upper bounds in seconds of the latency histograms' buckets. Upstream calls can take tens of seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        """
+        A metric, with a value for each combination of label values.
+
+        :param name: Metric name
+        :param documentation: What the metric measures
+        :param labels: Names of the labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(n, '')) for n in self.labels)
+
+    def samples(self) -> List[Tuple[str, Labels, Sequence[str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, values, extra_names, value in self.samples():
+            names = self.labels + tuple(extra_names)
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        A histogram of observed values, such as latencies.
+
+        :param name: Metric name
+        :param documentation: What the metric measures
+        :param labels: Names of the labels
+        :param buckets: Upper bounds of the buckets, in increasing order
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+            return sum(counts)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', key + (_format_value(bound),), ('le',), cumulative))
+                samples.append(('_sum', key, (), total[0]))
+                samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        """Metrics exposed together at /metrics."""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+ROUTE_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'Requests handled, by route, method and status code', ['route', 'method', 'status']))
+ROUTE_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by route and method', ['route', 'method']))
+ROUTE_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Requests being handled, by route', ['route']))
+
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    'upstream_requests_total', 'Requests to Apptoto and REDCap, by service, operation and status code',
+    ['service', 'operation', 'status']))
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'upstream_request_duration_seconds', 'Time until Apptoto or REDCap responds, by service and operation',
+    ['service', 'operation']))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    'upstream_requests_in_flight', 'Requests waiting for Apptoto or REDCap, by service and operation',
+    ['service', 'operation']))
+UPSTREAM_SENT_BYTES = REGISTRY.register(Counter(
+    'upstream_sent_bytes_total', 'Bytes of request bodies sent to Apptoto or REDCap', ['service', 'operation']))
+UPSTREAM_RECEIVED_BYTES = REGISTRY.register(Counter(
+    'upstream_received_bytes_total', 'Bytes of response bodies received from Apptoto or REDCap, '
+                                     'when their length is known', ['service', 'operation']))
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = _route()
+    ROUTE_IN_FLIGHT.inc(route=g.metrics_route)
+
+
+def _end_request(response: Response) -> Response:
+    g.metrics_status = str(response.status_code)
+    return response
+
+
+def _teardown_request(error: Optional[BaseException]):
+    # Recorded at teardown, which also runs when an error escapes every handler and no response was made.
+    if 'metrics_start' in g:
+        route = g.pop('metrics_route')
+        ROUTE_IN_FLIGHT.dec(route=route)
+        ROUTE_LATENCY.observe(time.perf_counter() - g.pop('metrics_start'), route=route, method=request.method)
+        ROUTE_REQUESTS.inc(route=route, method=request.method, status=g.pop('metrics_status', '500'))
+
+
+def _metrics_view() -> Response:
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app: Flask):
+    """
+    Measure every request to the app, and expose all metrics at /metrics.
+
+    Requests are labelled with their route's rule, such as /count/<participant_id>, rather than their path,
+    so each route has one set of values.
+
+    :param app: The Flask app
+    """
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
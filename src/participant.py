@@ -1,6 +1,16 @@
 from datetime import datetime, timedelta
 
 
+def valid_participant_id(identifier: str) -> bool:
+    """
+    Determine if a participant identifier is in the form ASHnnn.
+
+    :param identifier: The participant identifier
+    :return: True if the identifier has the right form
+    """
+    return len(identifier) == 6 and identifier.startswith('ASH')
+
+
 class Participant:
     def __init__(self, identifier: str = '', phone: str = ''):
         """
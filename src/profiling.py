@@ -0,0 +1,367 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import (Blueprint, Flask, Response, abort, current_app, g, has_request_context, jsonify, request,
+                   send_file)
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_KEEP = 100  # Profiles kept in the profile directory before the oldest are removed
+PROFILE_WAIT = 60  # Seconds a profiled job waits for the profile before it, such as the request submitting it
+TOP_ALLOCATIONS = 20  # Source lines listed by the memory they allocated
+TOP_FUNCTIONS = 40  # Functions listed in the text report of a profile
+
+_current: ContextVar[Optional['Profile']] = ContextVar('profile', default=None)
+
+# Only one cProfile profiler can run at a time, so requests arriving while one is profiled are not profiled.
+_profiling = threading.Lock()
+
+
+class Profile:
+    def __init__(self, name: str):
+        """
+        Wall time of the named sections of one request or job.
+
+        :param name: What was profiled, such as the request's route
+        """
+        self.profile_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now().isoformat()
+        self.sections: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, section: str, seconds: float):
+        with self._lock:
+            totals = self.sections.setdefault(section, {'seconds': 0.0, 'calls': 0})
+            totals['seconds'] += seconds
+            totals['calls'] += 1
+
+
+@contextmanager
+def section(name: str):
+    """
+    Add the time spent in a block to the profile of the current request or job, if it is profiled.
+
+    Blocks run by other threads, such as the Apptoto posting pool, are not counted on their own,
+    so sections wrap calls where the profiled thread waits for them.
+
+    :param name: Name of the section, such as redcap or apptoto
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def is_profiling() -> bool:
+    """Return True if the current request or job is being profiled."""
+    return _current.get() is not None
+
+
+class ProfileStore:
+    def __init__(self, directory: str, keep: int = PROFILE_KEEP):
+        """
+        Keep profiles as files, with a JSON summary and a cProfile dump for each profile.
+
+        Files are shared by every worker process using the directory.
+
+        :param directory: Folder for the profiles
+        :param keep: Number of profiles kept before the oldest are removed
+        """
+        self._directory = directory
+        self._keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self._directory, f'{profile_id}.{extension}')
+
+    @property
+    def enabled(self) -> bool:
+        """True if every request is profiled, as set by an admin."""
+        return os.path.exists(os.path.join(self._directory, 'enabled'))
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        marker = os.path.join(self._directory, 'enabled')
+        if value:
+            open(marker, 'w').close()
+        elif os.path.exists(marker):
+            os.remove(marker)
+
+    def save(self, summary: Dict, stats: pstats.Stats):
+        stats.dump_stats(self._path(summary['id'], 'prof'))
+        with open(self._path(summary['id'], 'json'), 'w') as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def _prune(self):
+        summaries = sorted((os.path.getmtime(os.path.join(self._directory, name)), name[:-len('.json')])
+                           for name in os.listdir(self._directory) if name.endswith('.json'))
+        for _, profile_id in summaries[:max(0, len(summaries) - self._keep)]:
+            for extension in ('json', 'prof'):
+                if os.path.exists(self._path(profile_id, extension)):
+                    os.remove(self._path(profile_id, extension))
+
+    def list(self) -> List[Dict]:
+        """Summaries of the kept profiles, newest first."""
+        summaries = []
+        for name in os.listdir(self._directory):
+            if name.endswith('.json'):
+                summary = self.get(name[:-len('.json')])
+                if summary:
+                    summaries.append(summary)
+        return sorted(summaries, key=lambda s: s['started_at'], reverse=True)
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        if not profile_id.isalnum() or not os.path.exists(self._path(profile_id, 'json')):
+            return None
+        with open(self._path(profile_id, 'json')) as f:
+            return json.load(f)
+
+    def stats_path(self, profile_id: str) -> Optional[str]:
+        """Path of a profile's cProfile dump, readable with `pstats` or `snakeviz`."""
+        if not profile_id.isalnum() or not os.path.exists(self._path(profile_id, 'prof')):
+            return None
+        return self._path(profile_id, 'prof')
+
+    def report(self, profile_id: str) -> Optional[str]:
+        """Text listing of the functions that took the most cumulative time."""
+        path = self.stats_path(profile_id)
+        if path is None:
+            return None
+        with io.StringIO() as out:
+            pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            return out.getvalue()
+
+
+class _Session:
+    def __init__(self, name: str):
+        """
+        Profile with cProfile and tracemalloc from now until `finish`, on the current thread.
+
+        Code the session runs on other threads is added with `profile_thread`.
+        """
+        self.profile = Profile(name)
+        _current.set(self.profile)
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        self._threads: List[cProfile.Profile] = []
+
+    @contextmanager
+    def profile_thread(self):
+        """Add the functions called by a block on another thread, such as an async view's event loop."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 a single profiler sees every thread, and a second one cannot start.
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._threads.append(profiler)
+
+    def finish(self, **details) -> Tuple[Dict, pstats.Stats]:
+        self._profiler.disable()
+        wall = time.perf_counter() - self._start
+        _current.set(None)
+
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+        if self._started_tracing:
+            tracemalloc.stop()
+
+        summary = {'id': self.profile.profile_id,
+                   'name': self.profile.name,
+                   'started_at': self.profile.started_at,
+                   'wall_seconds': wall,
+                   'sections': self.profile.sections,
+                   'memory_peak_bytes': peak,
+                   'top_allocations': [{'line': str(s.traceback[0]), 'bytes': s.size, 'count': s.count}
+                                       for s in allocations],
+                   **details}
+        stats = pstats.Stats(self._profiler)
+        for profiler in self._threads:
+            stats.add(profiler)
+        return summary, stats
+
+
+def profile_call(store: ProfileStore, name: str, fn: Callable, *args, wait: float = 0, **kwargs):
+    """
+    Call a function, profiling it once no other profile is running, and keep the profile in the store.
+
+    :param store: Where the profile is kept
+    :param name: What is profiled, such as the kind of job
+    :param wait: Seconds to wait for a running profile to finish before calling the function unprofiled
+    :return: The function's result
+    """
+    if not _profiling.acquire(timeout=wait):
+        logging.warning(f'Not profiling {name}, another profile is still running')
+        return fn(*args, **kwargs)
+
+    session = _Session(name)
+    error = None
+    try:
+        return fn(*args, **kwargs)
+    except Exception as err:
+        error = repr(err)
+        raise
+    finally:
+        try:
+            summary, stats = session.finish(error=error)
+            store.save(summary, stats)
+        finally:
+            _profiling.release()
+
+
+def _wanted(store: ProfileStore, token: Optional[str], sample_rate: float) -> bool:
+    given = request.headers.get(PROFILE_HEADER)
+    if token and given and secrets.compare_digest(given, token):
+        return True
+    return store.enabled or random.random() < sample_rate
+
+
+def _start_profile():
+    config = current_app.extensions['profiles_config']
+    store = current_app.extensions['profiles']
+    if request.blueprint == 'profiles' or not _wanted(store, config['token'], config['sample_rate']):
+        return
+    if not _profiling.acquire(blocking=False):
+        return
+
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.profile_session = _Session(f'{request.method} {rule}')
+
+
+def _record_status(response: Response) -> Response:
+    if 'profile_session' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def _finish_profile(error: Optional[BaseException]):
+    session = g.pop('profile_session', None)
+    if session is None:
+        return
+
+    try:
+        summary, stats = session.finish(method=request.method, path=request.path,
+                                        status=g.pop('profile_status', 500),
+                                        error=repr(error) if error else None)
+        current_app.extensions['profiles'].save(summary, stats)
+    finally:
+        _profiling.release()
+
+
+def _profile_async(async_to_sync: Callable) -> Callable:
+    """
+    Wrap `Flask.async_to_sync` so a profiled request also profiles its async views.
+
+    Flask awaits them in an event loop on another thread, which the request's profiler does not see.
+    """
+    @functools.wraps(async_to_sync)
+    def wrapper(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def profiled(*args, **kwargs):
+            session = g.get('profile_session') if has_request_context() else None
+            if session is None:
+                return await func(*args, **kwargs)
+            with session.profile_thread():
+                return await func(*args, **kwargs)
+
+        return async_to_sync(profiled)
+
+    return wrapper
+
+
+bp = Blueprint('profiles', __name__, url_prefix='/profiles')
+
+
+@bp.before_request
+def _require_token():
+    token = current_app.extensions['profiles_config']['token']
+    given = request.headers.get(PROFILE_HEADER)
+    if not token or not given or not secrets.compare_digest(given, token):
+        abort(404)
+
+
+@bp.route('', methods=['GET'])
+def list_profiles():
+    return jsonify(current_app.extensions['profiles'].list())
+
+
+@bp.route('/enabled', methods=['POST'])
+def set_enabled():
+    store = current_app.extensions['profiles']
+    store.enabled = request.args.get('enabled', '').lower() in ('1', 'true', 'yes')
+    return jsonify({'enabled': store.enabled})
+
+
+@bp.route('/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    store = current_app.extensions['profiles']
+    summary = store.get(profile_id)
+    if summary is None:
+        abort(404)
+
+    # The summary by default, the functions taking the most time with ?format=text,
+    # or the cProfile dump with ?format=pstats.
+    profile_format = request.args.get('format', 'json')
+    if profile_format == 'text':
+        return Response(store.report(profile_id), mimetype='text/plain')
+    if profile_format == 'pstats':
+        return send_file(store.stats_path(profile_id), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{profile_id}.prof')
+    return jsonify(summary)
+
+
+def init_profiling(app: Flask, config: Dict):
+    """
+    Profile requests on demand, and add admin endpoints under /profiles to read the profiles.
+
+    A request is profiled when it has the `X-Profile-Token` header set to `profile_token`, when an admin
+    has turned profiling on for every request, or at random with probability `profile_sample_rate`.
+    Admin endpoints need the same header, and are not found unless `profile_token` is set.
+
+    :param app: The Flask app
+    :param config: A dictionary of configuration values
+    """
+    app.extensions['profiles'] = ProfileStore(
+        os.path.join(app.instance_path, config.get('profile_directory', 'profiles')),
+        keep=int(config.get('profile_keep', PROFILE_KEEP)))
+    app.extensions['profiles_config'] = {'token': config.get('profile_token'),
+                                         'sample_rate': float(config.get('profile_sample_rate', 0))}
+
+    app.async_to_sync = _profile_async(app.async_to_sync)
+    app.before_request(_start_profile)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_profile)
+    app.register_blueprint(bp)
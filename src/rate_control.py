@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from src.constants import CHUNK_SIZE
+from src.metrics import Gauge, REGISTRY
+
+MAX_CHUNK_SIZE = 50  # Events posted in one request, unless configured otherwise
+MAX_PAYLOAD = 256 * 1024  # Bytes in the body of one request
+TARGET_LATENCY = 2.0  # Seconds a post may take before chunks shrink
+RATE_STEP = 1.0  # Posts per second added to the rate after each quick, successful post
+DECREASE = 0.5  # Factor applied to the chunk size, or the rate, after a slow or rejected post
+MIN_RATE = 0.5  # Posts per second the rate never drops below
+RATE_WINDOW = 20  # Recent posts used to measure the rate reached before the first rejection
+
+CHUNK_SIZE_GAUGE = REGISTRY.register(Gauge(
+    'apptoto_post_chunk_size', 'Events posted to Apptoto in each request, as set by the adaptive controller'))
+RATE_GAUGE = REGISTRY.register(Gauge(
+    'apptoto_post_rate', 'Posts to Apptoto allowed each second by the adaptive controller, 0 if not limited'))
+
+
+class AdaptiveController:
+    def __init__(self, chunk_size: int = CHUNK_SIZE, max_chunk_size: int = MAX_CHUNK_SIZE,
+                 max_rate: float = None, target_latency: float = TARGET_LATENCY, max_payload: int = MAX_PAYLOAD):
+        """
+        Adjust the number of events in each post to Apptoto, and the rate of posts, from how Apptoto responds.
+
+        Both grow additively while posts succeed quickly, and shrink multiplicatively (AIMD).
+        A rate limit (429), a server error or a connection error halves the chunk size and the rate.
+        A post slower than `target_latency` halves only the chunk size.
+        With `max_rate`, posts are paced at that rate from the first post, and it stays the ceiling as the rate
+        recovers. Without it, the rate is not limited until Apptoto first rejects a post, then starts from half
+        the rate reached.
+
+        :param chunk_size: Events in each post to start with
+        :param max_chunk_size: Most events in one post
+        :param max_rate: Most posts each second, or None for no ceiling
+        :param target_latency: Seconds a successful post may take without shrinking chunks
+        :param max_payload: Most bytes in one post, with the size of an event estimated from earlier posts
+        """
+        self._max_chunk_size = max(1, max_chunk_size)
+        self._chunk = float(min(max(1, chunk_size), self._max_chunk_size))
+        self._max_rate = max_rate
+        self._rate = max_rate
+        self._target_latency = target_latency
+        self._max_payload = max_payload
+        self._event_bytes = 0
+        self._recent = deque(maxlen=RATE_WINDOW)
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+        self._publish()
+
+    @property
+    def chunk_size(self) -> int:
+        """Events to put in the next post."""
+        with self._lock:
+            size = int(self._chunk)
+            if self._event_bytes:
+                size = min(size, self._max_payload // self._event_bytes)
+            return max(1, size)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Posts allowed each second, or None if not limited."""
+        return self._rate
+
+    def wait(self):
+        """Block until the next post may start at the current rate."""
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            if self._rate is None:
+                return
+            start = max(now, self._next)
+            self._next = start + 1.0 / self._rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def observe(self, events: int, payload: int, latency: float, status: Optional[int]):
+        """
+        Adjust the chunk size and rate after a post.
+
+        :param events: Number of events posted
+        :param payload: Bytes in the request body
+        :param latency: Seconds until Apptoto responded
+        :param status: HTTP status code, or None if no response arrived
+        """
+        with self._lock:
+            if events:
+                self._event_bytes = max(1, -(-payload // events))
+
+            if status is None or status == 429 or status >= 500:
+                self._chunk = max(1.0, self._chunk * DECREASE)
+                self._rate = max(MIN_RATE, (self._rate or self._reached_rate()) * DECREASE)
+                reason = f'status {status}' if status else 'no response'
+            elif latency > self._target_latency:
+                self._chunk = max(1.0, self._chunk * DECREASE)
+                reason = f'{latency:.1f} second response'
+            else:
+                self._chunk = min(float(self._max_chunk_size), self._chunk + 1)
+                if self._rate is not None:
+                    self._rate = self._rate + RATE_STEP
+                    if self._max_rate:
+                        self._rate = min(self._rate, self._max_rate)
+                reason = None
+        self._publish()
+
+        if reason:
+            logging.info(f'Apptoto posting backed off after {reason} - {self.describe()}')
+
+    def _reached_rate(self) -> float:
+        if len(self._recent) < 2 or self._recent[-1] <= self._recent[0]:
+            return MIN_RATE / DECREASE
+        return (len(self._recent) - 1) / (self._recent[-1] - self._recent[0])
+
+    def _publish(self):
+        CHUNK_SIZE_GAUGE.set(self.chunk_size)
+        RATE_GAUGE.set(self._rate or 0)
+
+    def describe(self) -> str:
+        rate = f'{self._rate:.1f} posts per second' if self._rate else 'no rate limit'
+        return f'chunk size {self.chunk_size}, {rate}'
+
+
+_controller: Optional[AdaptiveController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller(config: Dict) -> Optional[AdaptiveController]:
+    """
+    Get the process-wide controller for posting to Apptoto, if `apptoto_adaptive` is set.
+
+    All clients in the process share it, so what one request learns about Apptoto is used by the next.
+
+    :param config: A dictionary of configuration values, which may set `apptoto_max_chunk_size`,
+    `apptoto_rate_limit` and `apptoto_target_latency` as ceilings
+    :return: The controller, or None if posting is not adaptive
+    """
+    global _controller
+    if not config.get('apptoto_adaptive'):
+        return None
+
+    with _controller_lock:
+        if _controller is None:
+            rate_limit = config.get('apptoto_rate_limit')
+            _controller = AdaptiveController(
+                max_chunk_size=int(config.get('apptoto_max_chunk_size', MAX_CHUNK_SIZE)),
+                max_rate=float(rate_limit) if rate_limit else None,
+                target_latency=float(config.get('apptoto_target_latency', TARGET_LATENCY)))
+        return _controller
@@ -0,0 +1,131 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from src.apptoto_event import ApptotoEvent
+from src.participant import Participant
+from src.schedule import ONE_HOUR, SMS_TITLE
+
+EventKey = Tuple[str, str, str]
+
+
+def _start(start_time: str) -> datetime:
+    # Events are posted in local time; Apptoto may return them with an offset, converted here to local time.
+    # A time without an offset is already local, and astimezone leaves it unchanged.
+    return datetime.fromisoformat(start_time).astimezone().replace(tzinfo=None)
+
+
+def event_key(title: str, start_time: str, content: str) -> EventKey:
+    """
+    Create a key identifying an event by what it sends and when, whether planned here or listed by Apptoto.
+
+    :param title: Event title
+    :param start_time: Start time in ISO format, with or without an offset
+    :param content: Message content
+    """
+    return title, _start(start_time).isoformat(), content
+
+
+class Reconciliation:
+    def __init__(self, events: List[ApptotoEvent], kept: List[int], created: List[int], deleted: List[int]):
+        """
+        The calls needed to turn a participant's existing events into the desired events.
+
+        :param events: Desired events
+        :param kept: Positions in `events` of events Apptoto already has
+        :param created: Positions in `events` of events to create
+        :param deleted: Identifiers of existing events that are not desired
+        """
+        self.events = events
+        self.kept = kept
+        self.created = created
+        self.deleted = deleted
+        self.failed_deletions: List[int] = []
+        self.posted = False
+
+    @property
+    def events_to_create(self) -> List[ApptotoEvent]:
+        return [self.events[i] for i in self.created]
+
+    @property
+    def succeeded(self) -> bool:
+        return self.posted and not self.failed_deletions
+
+
+def diff_events(desired: List[ApptotoEvent], existing: List[Dict]) -> Reconciliation:
+    """
+    Match desired events with existing Apptoto events by title, start time and content.
+
+    Each existing event matches at most one desired event, so duplicates in Apptoto are deleted.
+
+    :param desired: Events that should exist
+    :param existing: Events listed by Apptoto, with their identifiers
+    :return: The events to keep, create and delete
+    """
+    unmatched: Dict[EventKey, List[int]] = {}
+    for e in existing:
+        unmatched.setdefault(event_key(e['title'], e['start_time'], e['content']), []).append(e['id'])
+
+    kept = []
+    created = []
+    for i, e in enumerate(desired):
+        ids = unmatched.get(event_key(e.title, e.start_time, e.content))
+        if ids:
+            ids.pop()
+            kept.append(i)
+        else:
+            created.append(i)
+
+    deleted = [event_id for ids in unmatched.values() for event_id in ids]
+    return Reconciliation(desired, kept, created, deleted)
+
+
+def _fits(starts: List[datetime], wake: datetime, sleep: datetime) -> bool:
+    return (all(wake <= s < sleep for s in starts)
+            and all((b - a).total_seconds() >= ONE_HOUR for a, b in zip(starts, starts[1:])))
+
+
+def keep_fitting_days(desired: List[ApptotoEvent], existing: List[Dict],
+                      participant: Participant) -> List[ApptotoEvent]:
+    """
+    Keep the existing intervention messages of each day that still fit the participant's wake and sleep times.
+
+    Intervention messages are sent at random times, so a new plan would move every one of them.
+    A day whose existing messages are all between the new wake and sleep times, at least an hour apart,
+    keeps them instead of the new plan's messages for that day.
+
+    :param desired: Newly planned events
+    :param existing: Events listed by Apptoto
+    :param participant: The participant, with their current wake and sleep times
+    :return: The planned events, with the existing messages of days that still fit
+    """
+    existing_days: Dict[str, List[Tuple[datetime, str]]] = {}
+    for e in existing:
+        if e['title'] == SMS_TITLE:
+            start = _start(e['start_time'])
+            existing_days.setdefault(start.date().isoformat(), []).append((start, e['content']))
+
+    desired_days: Dict[str, List[int]] = {}
+    for i, e in enumerate(desired):
+        if e.title == SMS_TITLE:
+            desired_days.setdefault(e.start_time[:10], []).append(i)
+
+    events = list(desired)
+    for day, indices in desired_days.items():
+        old = sorted(existing_days.get(day, []))
+        wake = datetime.fromisoformat(f'{day} {participant.wake_time}')
+        sleep = datetime.fromisoformat(f'{day} {participant.sleep_time}')
+        if len(old) != len(indices) or not _fits([s for s, _ in old], wake, sleep):
+            continue
+
+        for i, (start, content) in zip(indices, old):
+            e = desired[i]
+            events[i] = ApptotoEvent(calendar=e.calendar, title=e.title, start_time=start,
+                                     end_time=start + (_start(e.end_time) - _start(e.start_time)),
+                                     content=content, participants=e.participants)
+    return events
+
+
+def future_events(events: List[ApptotoEvent], begin: datetime) -> List[ApptotoEvent]:
+    """Events starting at or after `begin`, which can still be changed."""
+    return [e for e in events if _start(e.start_time) >= begin]
+
@@ -1,9 +1,65 @@
-from typing import Dict
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Union
 
 import requests
 
+from src.async_transport import AsyncTransport, get_async_transport
+from src.constants import DAYS_1, DAYS_2
 from src.enums import Condition, CodedValues
 from src.participant import Participant
+from src.redcap_mirror import RedcapMirror
+from src.transport import Transport, get_transport
+
+
+SESSION_0_EVENT = 'session_0_arm_1'
+SESSION_1_EVENT = 'session_1_arm_1'
+SESSION_0_FIELDS = ['ash_id', 'phone', 'value1_s0', 'value2_s0', 'value7_s0', 'initials',
+                    'quitdate', 'date_s0', 'waketime', 'sleeptime']
+SESSION_1_FIELDS = ['ash_id', 'condition']
+PHONE_FIELDS = ['ash_id', 'phone']
+
+
+def _filter_logic(participant_ids: List[str]) -> Optional[str]:
+    """
+    Create REDCap filter logic selecting records by participant identifier.
+
+    Identifiers containing quotes can't be valid, so they are left out rather than escaped.
+
+    :param participant_ids: Participant identifiers in the form ASHnnn
+    :return: Filter logic, or None if no identifier can match a record
+    """
+    clauses = [f"[ash_id] = '{p}'" for p in participant_ids if "'" not in p and '"' not in p]
+    if not clauses:
+        return None
+    return ' or '.join(clauses)
+
+
+def _export_data(events: List[str], fields: List[str], participant_ids: Optional[List[str]],
+                 date_range_begin: datetime = None) -> Optional[Dict[str, str]]:
+    """
+    Create the form data of a request exporting records.
+
+    :return: Form data, or None if no participant identifier can match a record
+    """
+    request_data = {'content': 'record',
+                    'format': 'json'}
+    for i, event in enumerate(events):
+        request_data[f'events[{i}]'] = event
+    for i, field in enumerate(fields):
+        request_data[f'fields[{i}]'] = field
+
+    if participant_ids is not None:
+        filter_logic = _filter_logic(participant_ids)
+        if not filter_logic:
+            return None
+        request_data['filterLogic'] = filter_logic
+
+    if date_range_begin is not None:
+        request_data['dateRangeBegin'] = date_range_begin.strftime('%Y-%m-%d %H:%M:%S')
+
+    return request_data
 
 
 class RedcapError(Exception):
@@ -16,132 +72,378 @@ class RedcapError(Exception):
         self.message = message
 
 
+def _session_0_participant(participant_id: str, session0: List[Dict[str, str]]) -> Participant:
+    """
+    Create a Participant from session 0 records.
+
+    :param participant_id: The participant identifier in the form ASHnnn
+    :param session0: Session 0 records, which may include other participants
+    :return: A Participant without a condition
+    """
+    id_temp = None
+    initials = None
+    phone_number = None
+    session_0_date_str = None
+    quit_date_str = None
+    wake_time = None
+    sleep_time = None
+    message_values = []
+    task_values = []
+    for s0 in session0:
+        id_ = s0['ash_id']
+        if id_ == participant_id:
+            id_temp = participant_id
+            initials = s0['initials']
+            phone_number = s0['phone']
+            session_0_date_str = s0['date_s0']
+            quit_date_str = s0['quitdate']
+            wake_time = s0.get('waketime')
+            sleep_time = s0.get('sleeptime')
+            message_values.append(CodedValues(int(s0['value1_s0'])))
+            message_values.append(CodedValues(int(s0['value2_s0'])))
+
+            task_values.append(CodedValues(int(s0['value1_s0'])))
+            task_values.append(CodedValues(int(s0['value7_s0'])))
+
+    if id_temp != participant_id:
+        raise RedcapError(f'Unable to find session 0 in Redcap - participant ID - {participant_id}')
+
+    if not wake_time or len(wake_time) == 0:
+        raise RedcapError(f'Unable to find wake time in session 0 in Redcap - participant ID - {participant_id}')
+
+    if not sleep_time or len(sleep_time) == 0:
+        raise RedcapError(f'Unable to find sleep time in session 0 in Redcap - participant ID - {participant_id}')
+
+    part = Participant()
+    part.participant_id = participant_id
+    part.initials = initials
+    part.phone_number = phone_number
+    part.session0_date = session_0_date_str
+    part.quit_date = quit_date_str
+    part.wake_time = wake_time
+    part.sleep_time = sleep_time
+    part.message_values = message_values
+    part.task_values = task_values
+    return part
+
+
+def _set_condition(part: Participant, session1: List[Dict[str, str]]):
+    """
+    Set the participant's condition from session 1 records.
+
+    :param part: The participant
+    :param session1: Session 1 records, which may include other participants
+    """
+    if len(session1) > 0:
+        for s1 in session1:
+            id_ = s1['ash_id']
+            if id_ == part.participant_id:
+                part.condition = Condition(int(s1['condition']))
+                break
+
+    if not part.condition:
+        raise RedcapError(f'Unable to find session 1 in Redcap - participant ID - {part.participant_id}')
+
+
+def _active_on(quit_date: str, day: date) -> bool:
+    try:
+        first_day = datetime.strptime(quit_date, '%Y-%m-%d').date()
+    except ValueError:
+        return False
+    return first_day <= day < first_day + timedelta(days=DAYS_1 + DAYS_2)
+
+
+def _participants(participant_ids: List[str], session0: List[Dict[str, str]], session1: List[Dict[str, str]]) \
+        -> Dict[str, Union[Participant, RedcapError]]:
+    """Create a Participant for each identifier from session 0 and 1 records, or the error why it can't be."""
+    session0_by_id = {}
+    for s0 in session0:
+        session0_by_id.setdefault(s0['ash_id'], []).append(s0)
+    session1_by_id = {}
+    for s1 in session1:
+        session1_by_id.setdefault(s1['ash_id'], []).append(s1)
+
+    participants = {}
+    for participant_id in participant_ids:
+        try:
+            part = _session_0_participant(participant_id, session0_by_id.get(participant_id, []))
+            _set_condition(part, session1_by_id.get(participant_id, []))
+            participants[participant_id] = part
+        except (RedcapError, KeyError, ValueError) as err:
+            if not isinstance(err, RedcapError):
+                err = RedcapError(f'Unable to read Redcap data - participant ID - {participant_id} - {err}')
+            participants[participant_id] = err
+
+    return participants
+
+
+def _participant(participant_id: str, session0: List[Dict[str, str]], session1: List[Dict[str, str]]) \
+        -> Participant:
+    """Create a Participant from session 0 and 1 records, or raise the RedcapError why it can't be."""
+    part = _participants([participant_id], session0, session1)[participant_id]
+    if isinstance(part, RedcapError):
+        raise part
+    return part
+
+
+def _phone_number(participant_id: str, session0: List[Dict[str, str]]) -> str:
+    phone_number = None
+    for s0 in session0:
+        id_ = s0['ash_id']
+        if id_ == participant_id:
+            phone_number = s0['phone']
+
+    if not phone_number:
+        raise RedcapError(f'Unable to find phone number in Redcap - participant ID - {participant_id}')
+
+    return phone_number
+
+
+def _phone_numbers(session0: List[Dict[str, str]], active_on: Optional[date]) -> Dict[str, str]:
+    phones = {}
+    for s0 in session0:
+        if not s0['ash_id'] or not s0['phone']:
+            continue
+        if active_on and not _active_on(s0['quitdate'], active_on):
+            continue
+        phones[s0['ash_id']] = s0['phone']
+
+    return phones
+
+
 class Redcap:
-    def __init__(self, api_token: str, endpoint: str = 'https://redcap.uoregon.edu/api/'):
+    def __init__(self, api_token: str, endpoint: str = 'https://redcap.uoregon.edu/api/',
+                 timeout: float = 15, transport: Transport = None, mirror: RedcapMirror = None):
         """
         Interact with the REDCap API to collect participant information.
 
         :param api_token: API token for the REDCap project
         :param endpoint: REDCap endpoint URI
+        :param timeout: Seconds to wait for a response
+        :param transport: HTTP transport, defaults to the process-wide transport
+        :param mirror: Local copy of REDCap records to read participant information from, if any
         """
         self._endpoint = endpoint
         self._headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        self._timeout = 15
+        self._timeout = timeout
         self._data = {'token': api_token}
+        self._transport = transport
+        self._mirror = mirror
+
+    @property
+    def _http(self) -> Transport:
+        return self._transport or get_transport()
 
     def get_session_0(self, participant_id: str) -> Participant:
-        session0 = self._get_session0()
-
-        id_temp = None
-        initials = None
-        phone_number = None
-        session_0_date_str = None
-        quit_date_str = None
-        wake_time = None
-        sleep_time = None
-        message_values = []
-        task_values = []
-        for s0 in session0:
-            id_ = s0['ash_id']
-            if id_ == participant_id:
-                id_temp = participant_id
-                initials = s0['initials']
-                phone_number = s0['phone']
-                session_0_date_str = s0['date_s0']
-                quit_date_str = s0['quitdate']
-                wake_time = s0.get('waketime')
-                sleep_time = s0.get('sleeptime')
-                message_values.append(CodedValues(int(s0['value1_s0'])))
-                message_values.append(CodedValues(int(s0['value2_s0'])))
-
-                task_values.append(CodedValues(int(s0['value1_s0'])))
-                task_values.append(CodedValues(int(s0['value7_s0'])))
-
-        if id_temp != participant_id:
-            raise RedcapError(f'Unable to find session 0 in Redcap - participant ID - {participant_id}')
-
-        if not wake_time or len(wake_time) == 0:
-            raise RedcapError(f'Unable to find wake time in session 0 in Redcap - participant ID - {participant_id}')
-
-        if not sleep_time or len(sleep_time) == 0:
-            raise RedcapError(f'Unable to find sleep time in session 0 in Redcap - participant ID - {participant_id}')
-
-        part = Participant()
-        part.participant_id = participant_id
-        part.initials = initials
-        part.phone_number = phone_number
-        part.session0_date = session_0_date_str
-        part.quit_date = quit_date_str
-        part.wake_time = wake_time
-        part.sleep_time = sleep_time
-        part.message_values = message_values
-        part.task_values = task_values
-        return part
+        session0 = self._get_session0([participant_id])
+        return _session_0_participant(participant_id, session0)
 
     def get_participant_specific_data(self, participant_id: str) -> Participant:
         """
         Get participant phone number, usual wake time, and usual sleep time for participant_id.
+
+        Session 0 and session 1 are exported at the same time, and joined by participant identifier.
+
         :param participant_id: The participant identifier in the form RSnnn
         :return: A Participant
         """
-        part = self.get_session_0(participant_id)
+        session0, session1 = self._get_sessions([participant_id])
+        return _participant(participant_id, session0, session1)
 
-        session1 = self._get_session1()
-
-        if len(session1) > 0:
-            for s1 in session1:
-                id_ = s1['ash_id']
-                if id_ == participant_id:
-                    part.condition = Condition(int(s1['condition']))
-                    break
+    def get_participants_specific_data(self, participant_ids: List[str]) -> Dict[str, Union[Participant, RedcapError]]:
+        """
+        Get participant specific data for many participants, with one request to REDCap for both sessions.
 
-        if not part.condition:
-            raise RedcapError(f'Unable to find session 1 in Redcap - participant ID - {participant_id}')
+        :param participant_ids: Participant identifiers in the form ASHnnn
+        :return: A Participant for each identifier, or the RedcapError describing why its data is incomplete
+        """
+        if self._mirror is None:
+            records = self._export([SESSION_0_EVENT, SESSION_1_EVENT], SESSION_0_FIELDS + SESSION_1_FIELDS[1:],
+                                   participant_ids, 'Session 0 and 1 data')
+            session0 = [r for r in records if r.get('redcap_event_name') == SESSION_0_EVENT]
+            session1 = [r for r in records if r.get('redcap_event_name') == SESSION_1_EVENT]
+        else:
+            session0, session1 = self._get_sessions(participant_ids)
 
-        return part
+        return _participants(participant_ids, session0, session1)
 
     def get_participant_phone(self, participant_id: str) -> str:
-        phone_number = None
-        session0 = self._get_session0()
-
-        for s0 in session0:
-            id_ = s0['ash_id']
-            if id_ == participant_id:
-                phone_number = s0['phone']
+        session0 = self._get_session0([participant_id], fields=PHONE_FIELDS)
+        return _phone_number(participant_id, session0)
 
-        if not phone_number:
-            raise RedcapError(f'Unable to find phone number in Redcap - participant ID - {participant_id}')
+    def get_participant_phones(self, participant_ids: Optional[List[str]] = None, active_on: date = None) \
+            -> Dict[str, str]:
+        """
+        Get the phone numbers of many participants with one request.
 
-        return phone_number
+        :param participant_ids: Participant identifiers, or None for all participants
+        :param active_on: Only include participants sent messages on this day, from their quit date through
+        the last day of messages
+        :return: Phone number of each participant found with one
+        """
+        fields = PHONE_FIELDS + ['quitdate'] if active_on else PHONE_FIELDS
+        return _phone_numbers(self._get_session0(participant_ids, fields=fields), active_on)
 
     def _make_request(self, request_data: Dict[str, str], fields_for_error: str):
         request_data.update(self._data)
-        r = requests.post(url=self._endpoint, data=request_data, headers=self._headers, timeout=self._timeout)
+        r = self._http.post(url=self._endpoint, service='redcap', operation=f'export_{request_data["content"]}',
+                            data=request_data, headers=self._headers, timeout=self._timeout)
         if r.status_code == requests.codes.ok:
             return r.json()
         else:
             raise RedcapError(f'Unable to get {fields_for_error} from Redcap - {str(r.status_code)}')
 
-    def _get_session0(self):
-        request_data = {'content': 'record',
-                        'format': 'json',
-                        'fields[0]': 'ash_id',
-                        'fields[1]': 'phone',
-                        'fields[2]': 'value1_s0',
-                        'fields[3]': 'value2_s0',
-                        'fields[4]': 'value7_s0',
-                        'fields[5]': 'initials',
-                        'fields[6]': 'quitdate',
-                        'fields[7]': 'date_s0',
-                        'fields[8]': 'waketime',
-                        'fields[9]': 'sleeptime',
-                        'events[0]': 'session_0_arm_1'}
-        return self._make_request(request_data, 'Session 0 data')
-
-    def _get_session1(self):
-        request_data = {'content': 'record',
-                        'format': 'json',
-                        'fields[0]': 'ash_id',
-                        'fields[1]': 'condition',
-                        'events[0]': 'session_1_arm_1'}
-        return self._make_request(request_data, 'Session 1 data')
+    def _export(self, events: List[str], fields: List[str], participant_ids: Optional[List[str]],
+                fields_for_error: str, date_range_begin: datetime = None):
+        """
+        Export records for some events, filtered by REDCap to `participant_ids` and projected to `fields`.
+
+        :param events: Unique event names
+        :param fields: Fields to export
+        :param participant_ids: Participant identifiers to export, or None for all participants
+        :param fields_for_error: Description of the data, used in errors
+        :param date_range_begin: Only export records created or modified after this time, if set
+        :return: List of records
+        """
+        request_data = _export_data(events, fields, participant_ids, date_range_begin)
+        if request_data is None:
+            return []
+
+        return self._make_request(request_data, fields_for_error)
+
+    def _records(self, event: str, all_fields: List[str], fields: List[str], participant_ids: Optional[List[str]],
+                 fields_for_error: str):
+        """
+        Get records for one event from the mirror if there is one, otherwise from REDCap.
+
+        The mirror keeps `all_fields` of every record, and returns only `fields`.
+        """
+        if self._mirror is None:
+            return self._export([event], fields, participant_ids, fields_for_error)
+
+        return self._mirror.records(event, fields, participant_ids,
+                                    lambda since: self._export([event], all_fields, None, fields_for_error,
+                                                               date_range_begin=since))
+
+    def _get_session0(self, participant_ids: Optional[List[str]] = None, fields: List[str] = None):
+        return self._records(SESSION_0_EVENT, SESSION_0_FIELDS, fields or SESSION_0_FIELDS, participant_ids,
+                             'Session 0 data')
+
+    def _get_session1(self, participant_ids: Optional[List[str]] = None):
+        return self._records(SESSION_1_EVENT, SESSION_1_FIELDS, SESSION_1_FIELDS, participant_ids, 'Session 1 data')
+
+    def _get_sessions(self, participant_ids: List[str]):
+        """Get session 0 and session 1 records, with session 1 requested from a worker thread at the same time."""
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            session1 = pool.submit(self._get_session1, participant_ids)
+            session0 = self._get_session0(participant_ids)
+            return session0, session1.result()
+
+
+class AsyncRedcap:
+    def __init__(self, api_token: str, endpoint: str = 'https://redcap.uoregon.edu/api/',
+                 timeout: float = 15, transport: AsyncTransport = None, mirror: RedcapMirror = None):
+        """
+        Interact with the REDCap API from asyncio code, with the same methods as `Redcap` as coroutines.
+
+        Independent exports, such as session 0 and session 1 of a participant, are requested at the same time.
+        With a mirror, records are read from it in a worker thread, as `Redcap` would.
+
+        :param api_token: API token for the REDCap project
+        :param endpoint: REDCap endpoint URI
+        :param timeout: Seconds to wait for a response
+        :param transport: Async HTTP transport, defaults to the process-wide async transport
+        :param mirror: Local copy of REDCap records to read participant information from, if any
+        """
+        self._endpoint = endpoint
+        self._headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        self._timeout = timeout
+        self._data = {'token': api_token}
+        self._transport = transport
+        self._mirror = mirror
+        self._sync = Redcap(api_token=api_token, endpoint=endpoint, timeout=timeout, mirror=mirror) if mirror else None
+
+    @property
+    def _http(self) -> AsyncTransport:
+        return self._transport or get_async_transport()
+
+    async def get_session_0(self, participant_id: str) -> Participant:
+        session0 = await self._get_session0([participant_id])
+        return _session_0_participant(participant_id, session0)
+
+    async def get_participant_specific_data(self, participant_id: str) -> Participant:
+        """
+        Get participant phone number, usual wake time, and usual sleep time for participant_id.
+        :param participant_id: The participant identifier in the form ASHnnn
+        :return: A Participant
+        """
+        session0, session1 = await asyncio.gather(self._get_session0([participant_id]),
+                                                  self._get_session1([participant_id]))
+        return _participant(participant_id, session0, session1)
+
+    async def get_participants_specific_data(self, participant_ids: List[str]) \
+            -> Dict[str, Union[Participant, RedcapError]]:
+        """
+        Get participant specific data for many participants, with one request to REDCap for both sessions.
+
+        :param participant_ids: Participant identifiers in the form ASHnnn
+        :return: A Participant for each identifier, or the RedcapError describing why its data is incomplete
+        """
+        if self._mirror is None:
+            records = await self._export([SESSION_0_EVENT, SESSION_1_EVENT], SESSION_0_FIELDS + SESSION_1_FIELDS[1:],
+                                         participant_ids, 'Session 0 and 1 data')
+            session0 = [r for r in records if r.get('redcap_event_name') == SESSION_0_EVENT]
+            session1 = [r for r in records if r.get('redcap_event_name') == SESSION_1_EVENT]
+        else:
+            session0, session1 = await asyncio.gather(self._get_session0(participant_ids),
+                                                      self._get_session1(participant_ids))
+
+        return _participants(participant_ids, session0, session1)
+
+    async def get_participant_phone(self, participant_id: str) -> str:
+        session0 = await self._get_session0([participant_id], fields=PHONE_FIELDS)
+        return _phone_number(participant_id, session0)
+
+    async def get_participant_phones(self, participant_ids: Optional[List[str]] = None, active_on: date = None) \
+            -> Dict[str, str]:
+        """
+        Get the phone numbers of many participants with one request.
+
+        :param participant_ids: Participant identifiers, or None for all participants
+        :param active_on: Only include participants sent messages on this day, from their quit date through
+        the last day of messages
+        :return: Phone number of each participant found with one
+        """
+        fields = PHONE_FIELDS + ['quitdate'] if active_on else PHONE_FIELDS
+        return _phone_numbers(await self._get_session0(participant_ids, fields=fields), active_on)
+
+    async def _export(self, events: List[str], fields: List[str], participant_ids: Optional[List[str]],
+                      fields_for_error: str):
+        request_data = _export_data(events, fields, participant_ids)
+        if request_data is None:
+            return []
+
+        request_data.update(self._data)
+        r = await self._http.post(url=self._endpoint, service='redcap', operation=f'export_{request_data["content"]}',
+                                  data=request_data, headers=self._headers, timeout=self._timeout)
+        if r.status_code == requests.codes.ok:
+            return r.json()
+        else:
+            raise RedcapError(f'Unable to get {fields_for_error} from Redcap - {str(r.status_code)}')
+
+    async def _records(self, event: str, all_fields: List[str], fields: List[str],
+                       participant_ids: Optional[List[str]], fields_for_error: str):
+        if self._mirror is None:
+            return await self._export([event], fields, participant_ids, fields_for_error)
+
+        # The mirror reads SQLite and syncs with REDCap through the blocking client, so it runs in a worker thread.
+        return await asyncio.to_thread(self._sync._records, event, all_fields, fields, participant_ids,
+                                       fields_for_error)
+
+    async def _get_session0(self, participant_ids: Optional[List[str]] = None, fields: List[str] = None):
+        return await self._records(SESSION_0_EVENT, SESSION_0_FIELDS, fields or SESSION_0_FIELDS, participant_ids,
+                                   'Session 0 data')
+
+    async def _get_session1(self, participant_ids: Optional[List[str]] = None):
+        return await self._records(SESSION_1_EVENT, SESSION_1_FIELDS, SESSION_1_FIELDS, participant_ids,
+                                   'Session 1 data')
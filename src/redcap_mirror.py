@@ -0,0 +1,138 @@
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+MIRROR_TTL = 300  # Seconds before mirrored REDCap data is refreshed
+
+# REDCap compares dateRangeBegin with its own local time, so look back far enough to cover any time zone difference.
+SYNC_OVERLAP = timedelta(days=1)
+
+Export = Callable[[Optional[datetime]], List[Dict[str, str]]]
+
+
+class RedcapMirror:
+    def __init__(self, path: str, ttl: timedelta = timedelta(seconds=MIRROR_TTL),
+                 max_stale: timedelta = timedelta(hours=1), full_sync: timedelta = timedelta(days=1)):
+        """
+        A local copy of REDCap records, kept in SQLite and refreshed with incremental exports.
+
+        Records of each event are exported in full the first time they are needed and once every `full_sync`,
+        which drops deleted records. In between, only records changed since the last sync are exported.
+        Data older than `ttl` but newer than `max_stale` is served while a sync runs in the background,
+        and data is served stale if REDCap can't be reached.
+
+        :param path: SQLite database file
+        :param ttl: Age of the data before it is refreshed
+        :param max_stale: Age of the data after which a lookup waits for it to be refreshed
+        :param full_sync: Time between full exports
+        """
+        self._path = path
+        self._ttl = ttl
+        self._max_stale = max_stale
+        self._full_sync = full_sync
+        self._sync_lock = threading.Lock()
+        self._syncing = set()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS records '
+                         '(event TEXT, ash_id TEXT, data TEXT, PRIMARY KEY (event, ash_id))')
+            conn.execute('CREATE TABLE IF NOT EXISTS syncs '
+                         '(event TEXT PRIMARY KEY, synced_at TEXT, full_synced_at TEXT)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def records(self, event: str, fields: List[str], participant_ids: Optional[List[str]], export: Export)\
+            -> List[Dict[str, str]]:
+        """
+        Get records of one event from the mirror, syncing with REDCap first if needed.
+
+        :param event: Unique event name
+        :param fields: Fields to include in each record
+        :param participant_ids: Participant identifiers to get, or None for all participants
+        :param export: Exports records of the event from REDCap changed since a time, or all records for None
+        :return: List of records
+        """
+        synced_at, _ = self._sync_times(event)
+        now = datetime.now()
+        if synced_at is None or now - synced_at > self._max_stale:
+            self._sync(event, export, required=synced_at is None)
+        elif now - synced_at > self._ttl:
+            self._sync_in_background(event, export)
+
+        rows = self._lookup(event, participant_ids)
+        if participant_ids is not None and len(rows) < len(set(participant_ids)):
+            # A participant missing from the mirror may have been added since the last sync.
+            self._sync(event, export, required=False)
+            rows = self._lookup(event, participant_ids)
+
+        records = []
+        for (data,) in rows:
+            record = json.loads(data)
+            records.append({f: record.get(f, '') for f in fields})
+        return records
+
+    def _lookup(self, event: str, participant_ids: Optional[List[str]]) -> List[tuple]:
+        with closing(self._connect()) as conn:
+            if participant_ids is None:
+                return conn.execute('SELECT data FROM records WHERE event = ?', (event,)).fetchall()
+
+            ids = list(set(participant_ids))
+            placeholders = ', '.join('?' * len(ids))
+            return conn.execute(f'SELECT data FROM records WHERE event = ? AND ash_id IN ({placeholders})',
+                                [event] + ids).fetchall()
+
+    def _sync_times(self, event: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT synced_at, full_synced_at FROM syncs WHERE event = ?', (event,)).fetchone()
+
+        if row is None:
+            return None, None
+        return datetime.fromisoformat(row[0]), datetime.fromisoformat(row[1])
+
+    def _sync_in_background(self, event: str, export: Export):
+        with self._sync_lock:
+            if event in self._syncing:
+                return
+            self._syncing.add(event)
+
+        def run():
+            try:
+                self._sync(event, export, required=False)
+            finally:
+                with self._sync_lock:
+                    self._syncing.discard(event)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _sync(self, event: str, export: Export, required: bool):
+        """
+        Export records changed since the last sync, or all records when a full sync is due, and store them.
+
+        :param event: Unique event name
+        :param export: Exports records from REDCap
+        :param required: Raise errors from REDCap instead of serving stale data
+        """
+        started_at = datetime.now()
+        synced_at, full_synced_at = self._sync_times(event)
+        full = full_synced_at is None or started_at - full_synced_at > self._full_sync
+
+        try:
+            records = export(None if full else synced_at - SYNC_OVERLAP)
+        except Exception as err:
+            if required:
+                raise
+            logging.warning(f'Unable to sync REDCap mirror for {event}, using data from {synced_at} - {err}')
+            return
+
+        with closing(self._connect()) as conn, conn:
+            if full:
+                conn.execute('DELETE FROM records WHERE event = ?', (event,))
+            conn.executemany('INSERT OR REPLACE INTO records (event, ash_id, data) VALUES (?, ?, ?)',
+                             [(event, r['ash_id'], json.dumps(r)) for r in records if r.get('ash_id')])
+            conn.execute('INSERT OR REPLACE INTO syncs (event, synced_at, full_synced_at) VALUES (?, ?, ?)',
+                         (event, started_at.isoformat(),
+                          (started_at if full else full_synced_at).isoformat()))
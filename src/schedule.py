@@ -0,0 +1,232 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.apptoto_event import ApptotoEvent
+from src.apptoto_participant import ApptotoParticipant
+from src.constants import DAYS_1, DAYS_2, MESSAGES_PER_DAY_1, MESSAGES_PER_DAY_2
+from src.enums import Condition
+from src.message import IndividualMessage
+from src.participant import Participant
+from src.profiling import section
+
+SMS_TITLE = 'ASH SMS'
+CIGS_TITLE = 'ASH CIGS'
+CIGS_CONTENT = 'UO: Good evening! Please respond with the number of cigarettes you have smoked today. ' \
+               'If you have not smoked any cigarettes, please respond with a 0. Thank you!'
+BOOSTER_CONTENT = 'UO: Booster session'
+ONE_HOUR = 3600  # Minimum number of seconds between intervention messages
+ONE_DAY = 86400
+
+# Days after the quit date of each booster session, in pairs three days apart.
+BOOSTER_DAYS = np.array([d + extra for d in range(1, 51, 7) for extra in (0, 3)])
+# Days after the first daily diary of diary rounds 2, 3 and 4, with the number of the first diary in each round.
+DIARY_ROUNDS = [(37, 5), (114, 9)]
+DIARIES_PER_ROUND = 4
+
+
+def _condition_abbrev(condition: Condition) -> str:
+    if condition == Condition.VALUES:
+        return 'Values'
+    elif condition == Condition.HIGHLEVEL:
+        return 'HLC'
+    elif condition == Condition.DOWNREG:
+        return 'CR'
+    else:
+        assert 'Invalid condition'
+
+
+@section('random_times')
+def spaced_offsets(spans: np.ndarray, n: int, gap: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw `n` sorted offsets in [0, span) for each span, each at least `gap` after the previous one.
+
+    Subtracting `i * (gap - 1)` from the i-th offset maps the valid, sorted sets of offsets one to one onto
+    the sets of `n` distinct integers in [0, span - (n - 1) * (gap - 1)), so each row draws such a set directly,
+    with Floyd's algorithm, and spreads it back out. Every valid set is equally likely, in a single pass.
+
+    :param spans: Number of possible offsets in each row
+    :param n: Number of offsets to draw in each row
+    :param gap: Minimum difference between consecutive offsets, at least 1
+    :param rng: Source of random numbers
+    :return: Array of shape (len(spans), n)
+    :raises ValueError: If `n` offsets don't fit in a span
+    """
+    spans = np.asarray(spans, dtype=np.int64)
+    if n <= 0:
+        return np.zeros((len(spans), 0), dtype=np.int64)
+
+    shrunk = spans - (n - 1) * (gap - 1)
+    if np.any(shrunk < n):
+        raise ValueError(f'Unable to fit {n} times at least {gap} seconds apart in {int(spans.min())} seconds')
+
+    # Floyd's algorithm: the k-th draw is uniform up to `top`, and takes `top` itself if the draw is already taken.
+    draws = np.empty((len(spans), n), dtype=np.int64)
+    for k in range(n):
+        top = shrunk - n + k
+        t = rng.integers(0, top + 1)
+        taken = np.any(draws[:, :k] == t[:, None], axis=1)
+        draws[:, k] = np.where(taken, top, t)
+
+    draws.sort(axis=1)
+    return draws + np.arange(n) * (gap - 1)
+
+
+class Schedule:
+    def __init__(self, bounds: np.ndarray, time: np.ndarray, title: np.ndarray, content: np.ndarray,
+                 titles: List[str], contents: List[str]):
+        """
+        Events for many participants, stored as columns.
+
+        Each participant's events are the rows from `bounds[i]` up to `bounds[i + 1]`, in the order they are posted.
+
+        :param bounds: Index of each participant's first event, followed by the number of events
+        :param time: Start time of each event, as datetime64[s]
+        :param title: Code of each event's title in `titles`
+        :param content: Code of each event's content in `contents`
+        :param titles: Distinct titles
+        :param contents: Distinct contents
+        """
+        self.bounds = bounds
+        self.time = time
+        self.title = title
+        self.content = content
+        self.titles = titles
+        self.contents = contents
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def apptoto_events(self, index: int, calendar: str, participant: ApptotoParticipant) -> List[ApptotoEvent]:
+        """
+        Convert one participant's events to ApptotoEvents.
+
+        :param index: Position of the participant in the schedule
+        :param calendar: Apptoto calendar name
+        :param participant: Apptoto participant receiving the events, shared by all of them
+        :return: List of events
+        """
+        rows = slice(self.bounds[index], self.bounds[index + 1])
+        times = self.time[rows].tolist()
+        return [ApptotoEvent(calendar=calendar,
+                             title=self.titles[title],
+                             start_time=t,
+                             end_time=t,
+                             content=self.contents[content],
+                             participants=[participant])
+                for t, title, content in zip(times, self.title[rows].tolist(), self.content[rows].tolist())]
+
+
+class _Codes:
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: str) -> int:
+        c = self._codes.get(value)
+        if c is None:
+            c = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return c
+
+
+def _day_start(participant: Participant, time_of_day: str) -> np.datetime64:
+    return np.datetime64(datetime.strptime(f'{participant.quit_date} {time_of_day}', '%Y-%m-%d %H:%M'), 's')
+
+
+def check_participant(participant: Participant):
+    """
+    Check that a participant's events can be planned.
+
+    :param participant: The participant
+    :raises ValueError: If the participant's dates or times are missing or invalid, or their intervention
+    messages don't fit between their wake and sleep times
+    """
+    span = int((_day_start(participant, participant.sleep_time) - _day_start(participant, participant.wake_time))
+               / np.timedelta64(1, 's'))
+    per_day = max(MESSAGES_PER_DAY_1, MESSAGES_PER_DAY_2)
+    if span < (per_day - 1) * ONE_HOUR + 1:
+        raise ValueError(f'Unable to fit {per_day} messages at least an hour apart between wake and sleep times '
+                         f'- {participant.participant_id}')
+    participant.daily_diary_time()
+
+
+@section('schedule')
+def build_schedule(participants: List[Participant], messages: List[List[IndividualMessage]],
+                   rng: Optional[np.random.Generator] = None) -> Schedule:
+    """
+    Plan intervention messages, messages about daily cigarette usage, messages for boosters, and daily diary
+    rounds 2, 3 and 4 for many participants.
+
+    Each kind of event is planned for all participants at once, with array operations.
+
+    :param participants: Participants with a quit date, wake and sleep times, condition and session 0 date
+    :param messages: Intervention messages of each participant, one for each intervention event
+    :param rng: Source of random numbers, by default a new generator
+    :return: The schedule, with each participant's events in the same order as `participants`
+    :raises ValueError: If a participant's messages don't fit between their wake and sleep times
+    """
+    rng = rng or np.random.default_rng()
+    titles = _Codes()
+    contents = _Codes()
+    p = len(participants)
+    if p == 0:
+        return Schedule(np.zeros(1, dtype=np.int64), np.array([], dtype='datetime64[s]'),
+                        np.array([], dtype=np.int32), np.array([], dtype=np.int32), [], [])
+
+    for part in participants:
+        check_participant(part)
+
+    wake = np.array([_day_start(part, part.wake_time) for part in participants])
+    sleep = np.array([_day_start(part, part.sleep_time) for part in participants])
+    diary = np.array([np.datetime64(part.daily_diary_time(), 's') for part in participants])
+    span = (sleep - wake).astype(np.int64)
+
+    times = []
+    title_codes = []
+    content_codes = []
+
+    # Intervention messages: MESSAGES_PER_DAY_1 a day for DAYS_1 days, then MESSAGES_PER_DAY_2 a day for DAYS_2 days.
+    sms = titles.code(SMS_TITLE)
+    first = 0
+    for first_day, days, per_day in [(0, DAYS_1, MESSAGES_PER_DAY_1), (DAYS_1, DAYS_2, MESSAGES_PER_DAY_2)]:
+        offsets = spaced_offsets(np.repeat(span, days), per_day, ONE_HOUR, rng).reshape(p, days, per_day)
+        day = (first_day + np.arange(days)) * ONE_DAY
+        times.append(wake[:, None] + (day[None, :, None] + offsets).reshape(p, -1))
+        title_codes.append(np.full((p, days * per_day), sms))
+
+        # Prepend each message with "UO: "
+        count = days * per_day
+        content_codes.append(np.array([[contents.code('UO: ' + m.message) for m in ms[first:first + count]]
+                                       for ms in messages]))
+        first += count
+
+    # One message per day, an hour before sleep time, asking for a reply with the number of cigarettes smoked
+    day = np.arange(DAYS_1 + DAYS_2) * ONE_DAY
+    times.append(sleep[:, None] - ONE_HOUR + day[None, :])
+    title_codes.append(np.full((p, len(day)), titles.code(CIGS_TITLE)))
+    content_codes.append(np.full((p, len(day)), contents.code(CIGS_CONTENT)))
+
+    # Booster messages, three hours before sleep time
+    times.append(sleep[:, None] - 3 * ONE_HOUR + BOOSTER_DAYS[None, :] * ONE_DAY)
+    title_codes.append(np.array([[titles.code(f'{_condition_abbrev(part.condition)} Booster {n}')
+                                  for n in range(1, len(BOOSTER_DAYS) + 1)] for part in participants]))
+    content_codes.append(np.full((p, len(BOOSTER_DAYS)), contents.code(BOOSTER_CONTENT)))
+
+    # Daily diary messages
+    for first_day, first_number in DIARY_ROUNDS:
+        day = (first_day + np.arange(DIARIES_PER_ROUND)) * ONE_DAY
+        times.append(diary[:, None] + day[None, :])
+        names = [f'Daily Diary #{first_number + i}' for i in range(DIARIES_PER_ROUND)]
+        title_codes.append(np.tile([titles.code(f'ASH {name}') for name in names], (p, 1)))
+        content_codes.append(np.tile([contents.code(f'UO: {name}') for name in names], (p, 1)))
+
+    time = np.concatenate(times, axis=1).astype('datetime64[s]')
+    bounds = np.arange(p + 1) * time.shape[1]
+    return Schedule(bounds,
+                    time.ravel(),
+                    np.concatenate(title_codes, axis=1).astype(np.int32).ravel(),
+                    np.concatenate(content_codes, axis=1).astype(np.int32).ravel(),
+                    titles.values,
+                    contents.values)
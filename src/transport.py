@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.metrics import (
+    UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY, UPSTREAM_RECEIVED_BYTES, UPSTREAM_REQUESTS, UPSTREAM_SENT_BYTES
+)
+from src.profiling import section
+
+POOL_MAXSIZE = 10  # Connections kept alive for each host
+TIMEOUT = 30  # Seconds to wait for a response when a client does not set a timeout
+
+
+class Transport:
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE, timeout: float = TIMEOUT):
+        """
+        HTTP transport shared by the Apptoto and REDCap clients.
+
+        Each host gets its own session and connection pool, which live as long as the transport,
+        so repeated calls to the same host reuse warm connections.
+
+        :param pool_maxsize: Maximum number of connections kept alive for each host
+        :param timeout: Default number of seconds to wait for a response
+        """
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """
+        Get the session for the host of `url`, creating it on first use.
+
+        :param url: Any URL on the host
+        :return: The host's session
+        """
+        parts = urlsplit(url)
+        host = f'{parts.scheme}://{parts.netloc}'
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount(f'{host}/', adapter)
+                self._sessions[host] = session
+
+        return session
+
+    def request(self, method: str, url: str, service: str = None, operation: str = None,
+                **kwargs) -> requests.Response:
+        """
+        Send a request, recording its latency, status code and size in the upstream metrics.
+
+        Latency is measured until the response headers arrive, so it excludes reading a streamed body.
+
+        :param method: HTTP method
+        :param url: URL of the request
+        :param service: Name of the service, for metrics, defaulting to the host
+        :param operation: Name of the call, for metrics, defaulting to the method
+        :param kwargs: Arguments to `requests.Session.request`
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        labels = {'service': service or urlsplit(url).netloc, 'operation': operation or method}
+        UPSTREAM_IN_FLIGHT.inc(**labels)
+        start = time.perf_counter()
+        try:
+            with section(labels['service']):
+                r = self.session(url).request(method=method, url=url, **kwargs)
+        except requests.RequestException:
+            UPSTREAM_REQUESTS.inc(status='error', **labels)
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, **labels)
+            UPSTREAM_IN_FLIGHT.dec(**labels)
+
+        UPSTREAM_REQUESTS.inc(status=str(r.status_code), **labels)
+        if r.request is not None and r.request.body:
+            UPSTREAM_SENT_BYTES.inc(len(r.request.body), **labels)
+        if r.headers.get('Content-Length', '').isdigit():
+            UPSTREAM_RECEIVED_BYTES.inc(int(r.headers['Content-Length']), **labels)
+        return r
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        """
+        Space out requests so that no more than `rate` start each second, across all threads.
+
+        :param rate: Requests per second
+        """
+        self._interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request may start."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """Get the process-wide transport, creating it with default settings on first use."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+def set_transport(transport: Optional[Transport]) -> Optional[Transport]:
+    """
+    Replace the process-wide transport.
+
+    :param transport: The new transport, or None to create a default one on next use
+    :return: The previous transport
+    """
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
+
+
+def configure_transport(config: Dict[str, str]) -> Transport:
+    """
+    Create the process-wide transport from configuration values.
+
+    :param config: A dictionary of configuration values, which may set `http_pool_maxsize` and `http_timeout`
+    :return: The new transport
+    """
+    transport = Transport(pool_maxsize=int(config.get('http_pool_maxsize', POOL_MAXSIZE)),
+                          timeout=float(config.get('http_timeout', TIMEOUT)))
+    previous = set_transport(transport)
+    if previous is not None:
+        previous.close()
+    return transport
+
+
+@contextmanager
+def use_transport(transport: Transport):
+    """
+    Use `transport` as the process-wide transport inside a with block, for example a fake transport in tests.
+
+    :param transport: The transport to use
+    """
+    previous = set_transport(transport)
+    try:
+        yield transport
+    finally:
+        set_transport(previous)
@@ -0,0 +1,179 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import jsonpickle
+
+from src.apptoto import Apptoto
+import src.apptoto_event
+from src.apptoto_event import ApptotoEvent, encode_events
+from src.apptoto_participant import ApptotoParticipant
+from src.constants import ASH_CALENDAR_ID
+from tests.apptoto.fake_apptoto import FakeApptoto
+
+
+def _events(n):
+    start = datetime(year=2021, month=5, day=19, hour=7)
+    part = ApptotoParticipant(name='ABC', phone='555-555-1234')
+    return [ApptotoEvent(calendar='ASH Messages',
+                         title='ASH SMS',
+                         start_time=start + timedelta(minutes=i),
+                         end_time=start + timedelta(minutes=i),
+                         content=f'UO: Test message {i}',
+                         participants=[part]) for i in range(n)]
+
+
+class TestApptoto:
+    def test_post_events_concurrently(self):
+        events = _events(338)
+        with FakeApptoto(latency=0.05) as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=8)
+
+            begin = time.perf_counter()
+            posted = apptoto.post_events(events)
+            elapsed = time.perf_counter() - begin
+
+        assert posted
+        assert sorted(e['content'] for e in fake.posted) == sorted(e.content for e in events)
+        assert fake.max_concurrent <= 8
+        # Connections are kept alive and reused between chunks.
+        assert len(fake.connections) <= 8
+        # 68 chunks posted one at a time would take at least 3.4 seconds.
+        assert elapsed < 68 * 0.05 / 2
+
+    def test_post_events_failure(self):
+        events = _events(50)
+        with FakeApptoto(fail_after=2) as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=1)
+
+            posted = apptoto.post_events(events)
+
+        assert not posted
+        assert [e['content'] for e in fake.posted] == [e.content for e in events[:10]]
+
+    def test_post_no_events(self):
+        apptoto = Apptoto(api_token='test token', user='test user', endpoint='http://127.0.0.1:1/v1')
+
+        assert apptoto.post_events([])
+
+    def test_get_events_paginates(self, requests_mock):
+        apptoto = Apptoto(api_token='test token', user='test user')
+        pages = [[{'id': p * 3 + i, 'calendar_id': ASH_CALENDAR_ID, 'is_deleted': i == 2} for i in range(3)]
+                 for p in range(3)]
+        requests_mock.get('https://api.apptoto.com/v1/events',
+                          [{'json': {'events': pages[0]}}, {'json': {'events': pages[1]}},
+                           {'json': {'events': pages[2][:1]}}])
+
+        events = apptoto.iter_events(begin=datetime(year=2021, month=5, day=19), phone_number='555-555-1234',
+                                     page_size=3)
+
+        assert [e['id'] for e in events] == [0, 1, 3, 4, 6]
+        assert [r.qs['page'] for r in requests_mock.request_history] == [['0'], ['1'], ['2']]
+        assert requests_mock.last_request.qs['calendar_id'] == [str(ASH_CALENDAR_ID)]
+
+    def test_get_events_other_calendar(self, requests_mock):
+        apptoto = Apptoto(api_token='test token', user='test user')
+        requests_mock.get('https://api.apptoto.com/v1/events',
+                          json={'events': [{'id': 1, 'calendar_id': 1}, {'id': 2, 'calendar_id': ASH_CALENDAR_ID}]})
+
+        event_ids = apptoto.get_events(begin=datetime(year=2021, month=5, day=19), phone_number='555-555-1234')
+
+        assert event_ids == [2]
+
+    def test_delete_events_retries(self, requests_mock, monkeypatch):
+        monkeypatch.setattr('src.apptoto.DELETE_BACKOFF', 0)
+        apptoto = Apptoto(api_token='test token', user='test user')
+        attempts = {}
+
+        def delete(request, context):
+            event_id = int(request.qs['id'][0])
+            attempts[event_id] = attempts.get(event_id, 0) + 1
+            # Event 1 fails once, event 2 always fails on the server, and event 3 is unknown.
+            if (event_id == 1 and attempts[event_id] == 1) or event_id == 2:
+                context.status_code = 500
+            elif event_id == 3:
+                context.status_code = 404
+            return ''
+
+        requests_mock.delete('https://api.apptoto.com/v1/events', text=delete)
+        progress = []
+
+        results = apptoto.delete_events([0, 1, 2, 3], progress=lambda done, total: progress.append((done, total)),
+                                        attempts=3)
+
+        assert [r.event_id for r in results] == [0, 1, 2, 3]
+        assert [r.deleted for r in results] == [True, True, False, False]
+        assert [r.attempts for r in results] == [1, 2, 3, 1]
+        assert results[2].error.startswith('500')
+        assert progress[-1] == (4, 4)
+
+    def test_delete_events_concurrent(self):
+        with FakeApptoto(latency=0.05) as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=4)
+
+            results = apptoto.delete_events(range(8))
+
+            assert all(r.deleted for r in results)
+            assert sorted(fake.deleted) == list(range(8))
+            assert fake.max_concurrent == 4
+
+    def test_delete_event_connection_error(self):
+        apptoto = Apptoto(api_token='test token', user='test user', endpoint='http://127.0.0.1:1/v1')
+
+        assert not apptoto.delete_event(1)
+
+    def test_iter_replies(self, requests_mock):
+        apptoto = Apptoto(api_token='test token', user='test user')
+        messages = [{'event_type': 'sent', 'at': '2021-05-19T10:00:00', 'content': 'How many cigarettes?'},
+                    {'event_type': 'replied', 'at': '2021-05-19T10:05:00', 'content': '3'}]
+        events = [{'id': 1, 'calendar_id': ASH_CALENDAR_ID, 'participants': [{'conversations': [{'messages': messages}]}]},
+                  {'id': 2, 'calendar_id': ASH_CALENDAR_ID, 'participants': [{'conversations': []}]},
+                  {'id': 3, 'calendar_id': ASH_CALENDAR_ID, 'is_deleted': True,
+                   'participants': [{'conversations': [{'messages': messages}]}]}]
+        requests_mock.get('https://api.apptoto.com/v1/events', json={'events': events})
+
+        replies = list(apptoto.iter_replies(phone_number='555-555-1234', end=datetime(year=2021, month=5, day=20)))
+
+        assert replies == [('2021-05-19T10:05:00', '3'), ('2021-05-19T10:05:00', '3')]
+        assert requests_mock.last_request.qs['begin'] == ['2021-04-01t00:00:00']
+        assert requests_mock.last_request.qs['include_conversations'] == ['true']
+
+    def test_get_conversations_failure(self, requests_mock):
+        apptoto = Apptoto(api_token='test token', user='test user')
+        requests_mock.get('https://api.apptoto.com/v1/events', status_code=500)
+
+        assert apptoto.get_conversations(phone_number='555-555-1234') == []
+
+    def test_iter_replies_by_phone(self, requests_mock):
+        apptoto = Apptoto(api_token='test token', user='test user')
+
+        def participant(phone, content):
+            messages = [{'event_type': 'replied', 'at': '2021-05-19T10:05:00', 'content': content}]
+            return {'phone': phone, 'conversations': [{'messages': messages}]}
+
+        events = [{'id': 1, 'calendar_id': ASH_CALENDAR_ID, 'participants': [participant('(555) 555-1234', '3')]},
+                  {'id': 2, 'calendar_id': ASH_CALENDAR_ID, 'participants': [participant('+15555559999', '0')]},
+                  {'id': 3, 'calendar_id': ASH_CALENDAR_ID, 'participants': [participant('555-555-0000', '7')]}]
+        requests_mock.get('https://api.apptoto.com/v1/events', json={'events': events})
+
+        replies = list(apptoto.iter_replies_by_phone(['555-555-1234', '555-555-9999']))
+
+        assert replies == [('555-555-1234', '2021-05-19T10:05:00', '3'), ('555-555-9999', '2021-05-19T10:05:00', '0')]
+        assert requests_mock.call_count == 1
+        assert 'phone_number' not in requests_mock.last_request.qs
+
+    def test_encode_events_backends_match(self, monkeypatch):
+        events = _events(3)
+        encoded = encode_events(events, prevent_calendar_creation=True)
+        monkeypatch.setattr(src.apptoto_event, 'orjson', None)
+
+        assert json.loads(encode_events(events, prevent_calendar_creation=True)) == json.loads(encoded)
+        assert json.loads(encoded)['events'][0] == events[0].to_dict()
+        assert json.loads(encoded)['prevent_calendar_creation']
+
+    def test_encode_events_matches_jsonpickle(self):
+        # Events were encoded with jsonpickle before encode_events, and Apptoto must receive the same body.
+        events = _events(5)
+        pickled = jsonpickle.encode({'events': events, 'prevent_calendar_creation': True}, unpicklable=False)
+
+        assert json.loads(encode_events(events, prevent_calendar_creation=True)) == json.loads(pickled)
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.constants import ASH_CALENDAR_ID
+
+
+class FakeApptoto:
+    def __init__(self, latency: float = 0.0, fail_after: int = None, throttle_every: int = None):
+        """
+        A local stand-in for the Apptoto API, which adds latency to every request.
+
+        :param latency: Seconds to wait before responding to each request
+        :param fail_after: Number of successful posts before responding with an error
+        :param throttle_every: Respond to every n-th post with 429 Too Many Requests
+        """
+        self.latency = latency
+        self.fail_after = fail_after
+        self.throttle_every = throttle_every
+        self.throttled = 0
+        self.chunk_sizes = []
+        self.posted = []
+        self.deleted = []
+        self.events = {}
+        self.connections = set()
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._posts = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                with fake._lock:
+                    fake.connections.add(self.client_address)
+                    fake._concurrent += 1
+                    fake.max_concurrent = max(fake.max_concurrent, fake._concurrent)
+                    fake._posts += 1
+                    failed = fake.fail_after is not None and fake._posts > fake.fail_after
+                    throttled = fake.throttle_every is not None and fake._posts % fake.throttle_every == 0
+
+                time.sleep(fake.latency)
+
+                with fake._lock:
+                    fake._concurrent -= 1
+                    if throttled:
+                        fake.throttled += 1
+                    elif not failed:
+                        fake.chunk_sizes.append(len(json.loads(body)['events']))
+                        for e in json.loads(body)['events']:
+                            fake.posted.append(e)
+                            fake.events[len(fake.posted)] = dict(e, id=len(fake.posted), calendar_id=ASH_CALENDAR_ID)
+
+                self._respond(429 if throttled else 500 if failed else 200, {'events': []})
+
+            def do_GET(self):
+                query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+                page, page_size = int(query['page']), int(query['page_size'])
+                with fake._lock:
+                    events = [e for _, e in sorted(fake.events.items())
+                              if e['start_time'] >= query['begin']
+                              and query.get('phone_number') in (None, *(p['phone'] for p in e['participants']))]
+
+                self._respond(200, {'events': events[page * page_size:(page + 1) * page_size]})
+
+            def do_DELETE(self):
+                event_id = int(parse_qs(urlsplit(self.path).query)['id'][0])
+                with fake._lock:
+                    fake._concurrent += 1
+                    fake.max_concurrent = max(fake.max_concurrent, fake._concurrent)
+
+                time.sleep(fake.latency)
+
+                with fake._lock:
+                    fake._concurrent -= 1
+                    fake.deleted.append(event_id)
+                    fake.events.pop(event_id, None)
+
+                self._respond(200, {'id': event_id})
+
+            def _respond(self, status: int, body):
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from src.apptoto import Apptoto, AsyncApptoto, ApptotoError
+from src.async_transport import AsyncTransport
+from src.redcap import AsyncRedcap, RedcapError
+from tests.apptoto.apptoto_test import _events
+from tests.apptoto.fake_apptoto import FakeApptoto
+from tests.redcap.redcap_test import session0_data, session1_data
+
+SESSION_0 = 'session_0_arm_1'
+BEGIN = datetime(year=2021, month=5, day=19)
+
+
+def _redcap_handler(request: httpx.Request) -> httpx.Response:
+    form = {k: v[0] for k, v in parse_qs(request.content.decode()).items()}
+    if form['events[0]'] == SESSION_0:
+        return httpx.Response(200, json=[dict(session0_data, redcap_event_name=SESSION_0)])
+    return httpx.Response(200, json=[dict(session1_data, redcap_event_name='session_1_arm_1')])
+
+
+async def _with_transport(transport: AsyncTransport, coroutine):
+    try:
+        return await coroutine
+    finally:
+        await transport.aclose()
+
+
+class TestAsyncRedcap:
+    def test_get_participant_specific_data(self):
+        transport = AsyncTransport(http_transport=httpx.MockTransport(_redcap_handler))
+        rc = AsyncRedcap(api_token='test token', transport=transport)
+
+        part = asyncio.run(_with_transport(transport, rc.get_participant_specific_data('ASH999')))
+
+        assert part.participant_id == 'ASH999'
+        assert part.phone_number == '555-555-1234'
+        assert part.condition.value == 3
+
+    def test_get_participant_phone_failure(self):
+        transport = AsyncTransport(http_transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+        rc = AsyncRedcap(api_token='test token', transport=transport)
+
+        with pytest.raises(RedcapError) as e:
+            asyncio.run(_with_transport(transport, rc.get_participant_phone('ASH999')))
+
+        assert '500' in str(e.value)
+
+
+class TestAsyncApptoto:
+    def test_list_events_and_replies(self):
+        events = _events(40)
+        messages = [{'event_type': 'replied', 'at': '2021-05-19T10:05:00', 'content': '3'}]
+
+        async def run(apptoto):
+            listed = [e async for e in apptoto.iter_events(begin=BEGIN, page_size=15)]
+            replies = [r async for r in apptoto.iter_replies_by_phone(['(555) 555-1234'])]
+            return listed, replies
+
+        with FakeApptoto() as fake:
+            assert Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint).post_events(events)
+            fake.events[1]['participants'][0]['conversations'] = [{'messages': messages}]
+            transport = AsyncTransport()
+            apptoto = AsyncApptoto(api_token='test token', user='test user', endpoint=fake.endpoint,
+                                   transport=transport)
+
+            listed, replies = asyncio.run(_with_transport(transport, run(apptoto)))
+
+        assert sorted(e['content'] for e in listed) == sorted(e.content for e in events)
+        assert replies == [('(555) 555-1234', '2021-05-19T10:05:00', '3')]
+
+    def test_iter_events_failure(self):
+        transport = AsyncTransport(http_transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+        apptoto = AsyncApptoto(api_token='test token', user='test user', transport=transport)
+
+        async def run():
+            return [e async for e in apptoto.iter_events(begin=BEGIN)]
+
+        with pytest.raises(ApptotoError):
+            asyncio.run(_with_transport(transport, run()))
+
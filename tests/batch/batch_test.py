@@ -0,0 +1,73 @@
+import io
+import zipfile
+from pathlib import Path
+
+import requests
+
+from src.batch import generate_batch, parse_participant_ids, write_archive
+
+REDCAP_ENDPOINT = 'https://redcap.uoregon.edu/api/'
+APPTOTO_EVENTS = 'https://api.apptoto.com/v1/events'
+config = {'redcap_api_token': 'test token',
+          'apptoto_api_token': 'test token',
+          'apptoto_user': 'test user',
+          'apptoto_calendar': 'ASH Messages',
+          'message_file': 'messages.csv'}
+
+
+def _records(participant_id, condition):
+    return [{'ash_id': participant_id,
+             'redcap_event_name': 'session_0_arm_1',
+             'phone': '555-555-1234',
+             'value1_s0': '1',
+             'value2_s0': '2',
+             'value7_s0': '7',
+             'initials': 'ABC',
+             'date_s0': '2021-04-19',
+             'quitdate': '2021-05-19',
+             'waketime': '07:00',
+             'sleeptime': '21:00',
+             'condition': ''},
+            {'ash_id': participant_id,
+             'redcap_event_name': 'session_1_arm_1',
+             'condition': condition}]
+
+
+def test_parse_participant_ids():
+    assert parse_participant_ids('ASH001, ASH002\nASH001 ASH003') == ['ASH001', 'ASH002', 'ASH003']
+
+
+def test_generate_batch(requests_mock):
+    requests_mock.post(REDCAP_ENDPOINT, json=_records('ASH001', '3') + _records('ASH002', '1'))
+    requests_mock.post(APPTOTO_EVENTS, json={})
+    instance_path = str(Path.cwd() / 'message' / 'data')
+
+    progress = []
+
+    results = generate_batch(config, instance_path, ['ASH001', 'ASH002', 'ASH003', 'BAD'],
+                             progress=lambda done, total: progress.append((done, total)))
+
+    assert [r.participant_id for r in results] == ['ASH001', 'ASH002', 'ASH003', 'BAD']
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert [r.generated for r in results] == [True, True, False, False]
+    assert 'session 0' in results[2].error
+    assert 'ASHnnn' in results[3].error
+    # One REDCap request for every participant
+    assert sum(1 for r in requests_mock.request_history if r.url == REDCAP_ENDPOINT) == 1
+
+    archive = io.BytesIO()
+    write_archive(results, archive)
+    with zipfile.ZipFile(archive) as zf:
+        assert sorted(zf.namelist()) == ['ASH001.csv', 'ASH002.csv', 'report.csv']
+        assert len(zf.read('ASH001.csv').decode().splitlines()) == 253
+
+
+def test_generate_batch_apptoto_failure(requests_mock):
+    requests_mock.post(REDCAP_ENDPOINT, json=_records('ASH001', '3'))
+    requests_mock.post(APPTOTO_EVENTS, status_code=requests.codes.server_error)
+    instance_path = str(Path.cwd() / 'message' / 'data')
+
+    results = generate_batch(config, instance_path, ['ASH001'])
+
+    assert not results[0].generated
+    assert results[0].messages_csv is None
@@ -0,0 +1,45 @@
+import copy
+from datetime import datetime, timedelta
+
+import jsonpickle
+import pytest
+
+import src.apptoto_event
+from src.apptoto_event import ApptotoEvent, encode_events
+from src.apptoto_participant import ApptotoParticipant
+
+START = datetime(year=2021, month=5, day=19, hour=7)
+
+
+def _events(n, shared=True):
+    part = ApptotoParticipant(name='ABC', phone='555-555-1234')
+    return [ApptotoEvent(calendar='ASH Messages',
+                         title='ASH SMS',
+                         start_time=START + timedelta(hours=i),
+                         end_time=START + timedelta(hours=i),
+                         content=f'UO: Message {i}',
+                         participants=[part if shared else copy.copy(part)]) for i in range(n)]
+
+
+def jsonpickle_encode(events):
+    """The request body as it was encoded before encode_events."""
+    return jsonpickle.encode({'events': events, 'prevent_calendar_creation': True}, unpicklable=False)
+
+
+@pytest.mark.parametrize('n', [5, 338])
+def test_jsonpickle(benchmark, n):
+    benchmark.group = f'encode {n} events'
+    benchmark(jsonpickle_encode, _events(n, shared=False))
+
+
+@pytest.mark.parametrize('n', [5, 338])
+def test_encode_events(benchmark, n):
+    benchmark.group = f'encode {n} events'
+    benchmark(encode_events, _events(n), prevent_calendar_creation=True)
+
+
+@pytest.mark.parametrize('n', [5, 338])
+def test_encode_events_json(benchmark, monkeypatch, n):
+    monkeypatch.setattr(src.apptoto_event, 'orjson', None)
+    benchmark.group = f'encode {n} events'
+    benchmark(encode_events, _events(n), prevent_calendar_creation=True)
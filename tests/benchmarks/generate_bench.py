@@ -0,0 +1,32 @@
+from src.event_generator import EventGenerator
+
+
+class StubApptoto:
+    """Accepts every event without a network round trip, so only planning is measured."""
+
+    def __init__(self):
+        self.posted = 0
+
+    def post_events(self, events, progress=None, on_posted=None) -> bool:
+        self.posted += len(events)
+        return True
+
+
+def test_generate(benchmark, make_generator):
+    apptoto = StubApptoto()
+
+    def generate():
+        return make_generator(apptoto).generate()
+
+    assert benchmark(generate)
+    assert apptoto.posted > 0
+
+
+def test_plan_many(benchmark, make_generator):
+    def plan():
+        generators = [make_generator() for _ in range(50)]
+        EventGenerator.plan_many(generators)
+        return generators
+
+    benchmark.group = 'plan 50 participants'
+    benchmark(plan)
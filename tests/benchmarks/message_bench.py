@@ -0,0 +1,47 @@
+import csv
+import random
+
+import pytest
+
+from src.enums import Condition, CodedValues
+from src.message import MessageLibrary
+
+SIZES = [10_000, 100_000, 1_000_000]
+NUM_MESSAGES = 28 * (5 + 4)
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=lambda n: f'{n // 1000}k')
+def message_file(request, tmp_path_factory):
+    """A message file like the study's, with `n` messages spread over the conditions and values."""
+    path = tmp_path_factory.mktemp('messages') / f'messages_{request.param}.csv'
+    rng = random.Random(1234)
+    values = [v.name for v in CodedValues if v != CodedValues.none]
+    with open(path, 'w', newline='') as f:
+        filewriter = csv.writer(f)
+        filewriter.writerow(['UO_ID', 'OSU_Wave', 'OSU_RandomID', 'ConditionNo', 'ConditionLabel',
+                             'Value1', 'Value2', 'Message'])
+        for i in range(1, request.param + 1):
+            condition = rng.choice(list(Condition))
+            value = rng.choice(values) if condition == Condition.VALUES else ''
+            filewriter.writerow([i, 1, i, condition.value, condition.name, value, '', f'Test message {i}'])
+    return str(path)
+
+
+def test_message_library_read(benchmark, message_file):
+    benchmark.group = 'MessageLibrary read'
+    benchmark.pedantic(MessageLibrary, args=(message_file,), rounds=3, iterations=1)
+
+
+def test_message_library_load_cached(benchmark, message_file):
+    benchmark.group = 'MessageLibrary.load cached'
+    MessageLibrary.load(message_file)
+    benchmark(MessageLibrary.load, message_file)
+
+
+@pytest.mark.parametrize('balance', [False, True], ids=['proportional', 'balanced'])
+def test_get_messages_by_condition(benchmark, message_file, balance):
+    benchmark.group = f'get_messages_by_condition {"balanced" if balance else "proportional"}'
+    library = MessageLibrary.load(message_file)
+    messages = benchmark(library.get_messages_by_condition, Condition.VALUES,
+                         [CodedValues.humor, CodedValues.relationships], NUM_MESSAGES, balance=balance)
+    assert len(messages) == NUM_MESSAGES
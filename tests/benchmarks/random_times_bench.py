@@ -0,0 +1,40 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.event_generator import intervals_valid, random_times
+
+START = datetime(year=2021, month=5, day=19, hour=7)
+
+
+def rejection_random_times(start: datetime, end: datetime, n: int):
+    """random_times as it was, redrawing all offsets until they are an hour apart."""
+    delta = end - start
+    r = [random.randrange(int(delta.total_seconds())) for _ in range(n)]
+    r.sort()
+
+    while not intervals_valid(r):
+        r = [random.randrange(int(delta.total_seconds())) for _ in range(n)]
+        r.sort()
+
+    return [start + timedelta(seconds=x) for x in r]
+
+
+@pytest.mark.parametrize('hours', [16, 10, 6])
+def test_random_times(benchmark, hours):
+    benchmark.group = f'random_times {hours}h window'
+    benchmark(random_times, START, START + timedelta(hours=hours), 5)
+
+
+@pytest.mark.parametrize('hours', [16, 10, 6])
+def test_rejection_random_times(benchmark, hours):
+    benchmark.group = f'random_times {hours}h window'
+    benchmark(rejection_random_times, START, START + timedelta(hours=hours), 5)
+
+
+@pytest.mark.parametrize('n', [5, 50, 500])
+def test_intervals_valid(benchmark, n):
+    benchmark.group = f'intervals_valid {n} times'
+    offsets = [i * 3600 for i in range(n)]
+    assert benchmark(intervals_valid, offsets)
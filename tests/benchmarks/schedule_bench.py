@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.apptoto_participant import ApptotoParticipant
+from src.enums import Condition, CodedValues
+from src.event_generator import random_times
+from src.message import IndividualMessage
+from src.participant import Participant
+from src.schedule import build_schedule
+
+NUM_MESSAGES = 28 * (5 + 4)
+MESSAGES = [IndividualMessage(random_id=i, message=f'Message {i}', condition=Condition.VALUES,
+                              coded_values=CodedValues.humor) for i in range(NUM_MESSAGES)]
+
+
+def _participants(n):
+    participants = []
+    for i in range(n):
+        part = Participant(identifier=f'ASH{i:03}', phone='555-555-1234')
+        part.session0_date = '2021-04-19'
+        part.quit_date = '2021-05-19'
+        part.wake_time = '07:00'
+        part.sleep_time = '21:00'
+        part.condition = Condition.VALUES
+        participants.append(part)
+    return participants
+
+
+def loop_sms_times(participants):
+    """Intervention message times as EventGenerator planned them, one day of one participant at a time."""
+    times = []
+    for part in participants:
+        s = datetime.strptime(f'{part.quit_date} {part.wake_time}', '%Y-%m-%d %H:%M')
+        e = datetime.strptime(f'{part.quit_date} {part.sleep_time}', '%Y-%m-%d %H:%M')
+        for days, per_day in [(range(28), 5), (range(28, 56), 4)]:
+            for day in days:
+                times.extend(random_times(s + timedelta(days=day), e + timedelta(days=day), per_day))
+    return times
+
+
+@pytest.mark.parametrize('n', [1, 200])
+def test_loop_sms_times(benchmark, n):
+    benchmark.group = f'schedule {n} participants'
+    benchmark(loop_sms_times, _participants(n))
+
+
+@pytest.mark.parametrize('n', [1, 200])
+def test_build_schedule(benchmark, n):
+    benchmark.group = f'schedule {n} participants'
+    benchmark(build_schedule, _participants(n), [MESSAGES] * n)
+
+
+@pytest.mark.parametrize('n', [1, 200])
+def test_build_schedule_to_apptoto_events(benchmark, n):
+    benchmark.group = f'schedule {n} participants'
+    part = ApptotoParticipant(name='ABC', phone='555-555-1234')
+
+    def plan():
+        schedule = build_schedule(_participants(n), [MESSAGES] * n)
+        return [schedule.apptoto_events(i, 'ASH Messages', part) for i in range(n)]
+
+    benchmark(plan)
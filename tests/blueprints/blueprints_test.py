@@ -0,0 +1,100 @@
+import io
+import time
+import zipfile
+
+import pytest
+
+from src.constants import ASH_CALENDAR_ID
+from src.flask_app import create_app
+
+APPTOTO_EVENTS = 'https://api.apptoto.com/v1/events'
+
+
+@pytest.fixture
+def client(tmp_path, requests_mock, monkeypatch):
+    monkeypatch.setattr('src.apptoto.DELETE_BACKOFF', 0)
+    # Databases are absolute paths under tmp_path, so nothing is written to the instance folder.
+    app = create_app(test_config={'TESTING': True,
+                                  'AUTOMATIONCONFIG': {'redcap_api_token': 'test token',
+                                                       'apptoto_api_token': 'test token',
+                                                       'apptoto_user': 'test user',
+                                                       'job_database': str(tmp_path / 'jobs.sqlite3'),
+                                                       'posting_journal': str(tmp_path / 'journal.sqlite3'),
+                                                       'conversation_database': str(tmp_path / 'conversations.sqlite3')}})
+    app.extensions['journal'].save_plan('ASH999', [], [])
+    requests_mock.post('https://redcap.uoregon.edu/api/', json=[{'ash_id': 'ASH999', 'phone': '555-555-1234'}])
+    requests_mock.get(APPTOTO_EVENTS, json={'events': [{'id': 1, 'calendar_id': ASH_CALENDAR_ID},
+                                                       {'id': 2, 'calendar_id': ASH_CALENDAR_ID}]})
+    with app.test_client() as client:
+        yield app, client
+
+
+class TestDelete:
+    def test_deleted_events_clear_journal(self, client, requests_mock):
+        app, client = client
+        requests_mock.delete(APPTOTO_EVENTS, json={})
+
+        page = client.post('/delete', data={'participant': 'ASH999', 'submit': 'submit'}).get_data(as_text=True)
+
+        assert 'Deleted 2 messages' in page
+        assert app.extensions['journal'].plan('ASH999') is None
+
+    def test_failed_deletion_keeps_journal(self, client, requests_mock):
+        app, client = client
+
+        def delete(request, context):
+            context.status_code = 500 if request.qs['id'] == ['2'] else 200
+            return ''
+
+        requests_mock.delete(APPTOTO_EVENTS, text=delete)
+
+        page = client.post('/delete', data={'participant': 'ASH999', 'submit': 'submit'}).get_data(as_text=True)
+
+        assert 'Failed to delete 1 of 2 messages' in page
+        assert app.extensions['journal'].plan('ASH999') is not None
+
+    def test_listing_failure_deletes_nothing(self, client, requests_mock):
+        app, client = client
+        requests_mock.get(APPTOTO_EVENTS, status_code=500)
+
+        page = client.post('/delete', data={'participant': 'ASH999', 'submit': 'submit'}).get_data(as_text=True)
+
+        assert 'Failed to get events' in page
+        assert not any(r.method == 'DELETE' for r in requests_mock.request_history)
+        assert app.extensions['journal'].plan('ASH999') is not None
+
+
+class TestCounts:
+    def test_counts(self, client, requests_mock):
+        app, client = client
+        messages = [{'event_type': 'replied', 'at': '2021-05-19T10:05:00', 'content': '3'}]
+        requests_mock.get(APPTOTO_EVENTS, json={'events': [
+            {'id': 1, 'calendar_id': ASH_CALENDAR_ID,
+             'participants': [{'phone': '555-555-1234', 'conversations': [{'messages': messages}]}]}]})
+
+        response = client.get('/counts?participants=ASH999,ASH998')
+
+        assert response.status_code == 200
+        assert response.json == {'responses': {'ASH999': [['2021-05-19T10:05:00', '3']]}, 'missing': ['ASH998']}
+
+
+class TestBatch:
+    def test_batch_runs_as_job(self, client):
+        app, client = client
+
+        response = client.post('/batch', data={'participants': 'BAD1, BAD2', 'submit': 'submit'})
+
+        assert response.status_code == 302
+        status_url = response.headers['Location']
+        job = client.get(status_url, headers={'Accept': 'application/json'}).json
+        while job['status'] not in ('finished', 'failed'):
+            time.sleep(0.01)
+            job = client.get(status_url, headers={'Accept': 'application/json'}).json
+        assert (job['kind'], job['status'], job['progress'], job['total']) == ('batch', 'finished', 2, 2)
+        assert '2 participants' in client.get(status_url).get_data(as_text=True)
+
+        archive = client.get(f'{status_url}/result')
+        assert archive.mimetype == 'application/zip'
+        with zipfile.ZipFile(io.BytesIO(archive.data)) as zf:
+            report = zf.read('report.csv').decode().splitlines()
+        assert [line.split(',')[0] for line in report[1:]] == ['BAD1', 'BAD2']
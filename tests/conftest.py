@@ -1,5 +1,17 @@
+from pathlib import Path
+
 import pytest
+
+from src.enums import Condition, CodedValues
+from src.event_generator import EventGenerator
 from src.flask_app import create_app
+from src.participant import Participant
+
+MESSAGE_DATA = str(Path(__file__).parent / 'message' / 'data')
+GENERATOR_CONFIG = {'apptoto_api_token': 'test token',
+                    'apptoto_user': 'test user',
+                    'apptoto_calendar': 'ASH Messages',
+                    'message_file': 'messages.csv'}
 
 
 @pytest.fixture
@@ -9,3 +21,30 @@ def app():
     })
 
     yield app
+
+
+@pytest.fixture
+def make_participant():
+    """Create a participant ready to plan, quitting on 2021-05-19, with any of these fields changed."""
+    def make(identifier='ASH999', condition=Condition.VALUES, wake_time='07:00', sleep_time='21:00'):
+        part = Participant(identifier=identifier, phone='555-555-1234')
+        part.initials = 'ABC'
+        part.session0_date = '2021-04-19'
+        part.quit_date = '2021-05-19'
+        part.wake_time = wake_time
+        part.sleep_time = sleep_time
+        part.condition = condition
+        part.message_values = [CodedValues.humor, CodedValues.relationships]
+        return part
+
+    return make
+
+
+@pytest.fixture
+def make_generator(make_participant):
+    """Create an event generator reading the test messages, for a participant from `make_participant` by default."""
+    def make(apptoto=None, participant=None):
+        return EventGenerator(config=GENERATOR_CONFIG, participant=participant or make_participant(),
+                              instance_path=MESSAGE_DATA, apptoto=apptoto)
+
+    return make
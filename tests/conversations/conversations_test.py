@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+import pytest
+
+from src.apptoto import ApptotoError
+from src.conversations import ConversationStore
+
+
+class FakeFetch:
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+        self.error = None
+
+    def __call__(self, begin, end):
+        self.calls.append((begin, end))
+        if self.error:
+            raise self.error
+        return list(self.replies)
+
+
+def test_first_sync_fetches_everything(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    fetch = FakeFetch([('2021-05-20T10:00:00', '3'), ('2021-05-19T10:00:00', '5')])
+
+    replies = store.replies('555-555-1234', fetch)
+
+    assert replies == [('2021-05-19T10:00:00', '5'), ('2021-05-20T10:00:00', '3')]
+    assert fetch.calls[0][0] is None
+
+
+def test_later_syncs_fetch_since_cursor(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'), lookback=timedelta(days=2))
+    fetch = FakeFetch([('2021-05-19T10:00:00', '5')])
+    store.replies('555-555-1234', fetch)
+    first_end = fetch.calls[0][1]
+
+    # The next sync returns an overlapping reply, which is only stored once.
+    fetch.replies = [('2021-05-19T10:00:00', '5'), ('2021-05-21T10:00:00', '2')]
+    replies = store.replies('555-555-1234', fetch)
+
+    assert replies == [('2021-05-19T10:00:00', '5'), ('2021-05-21T10:00:00', '2')]
+    assert fetch.calls[1][0] == first_end - timedelta(days=2)
+
+
+def test_phone_numbers_synced_separately(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    store.replies('555-555-1234', FakeFetch([('2021-05-19T10:00:00', '5')]))
+    fetch = FakeFetch([('2021-05-19T11:00:00', '1')])
+
+    replies = store.replies('555-555-9999', fetch)
+
+    assert replies == [('2021-05-19T11:00:00', '1')]
+    assert fetch.calls[0][0] is None
+
+
+def test_failed_sync_serves_stored_replies(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    fetch = FakeFetch([('2021-05-19T10:00:00', '5')])
+    store.replies('555-555-1234', fetch)
+    first_end = fetch.calls[0][1]
+    fetch.error = ApptotoError('Failed to get events - 500')
+
+    assert store.replies('555-555-1234', fetch) == [('2021-05-19T10:00:00', '5')]
+
+    # The cursor doesn't move, so the next sync covers the failed one.
+    fetch.error = None
+    store.replies('555-555-1234', fetch)
+    assert fetch.calls[2][0] == first_end - timedelta(days=2)
+
+
+def test_failed_first_sync(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    fetch = FakeFetch([])
+    fetch.error = ApptotoError('Failed to get events - 500')
+
+    with pytest.raises(ApptotoError):
+        store.replies('555-555-1234', fetch)
+
+
+def test_replies_by_phone_fetch_from_oldest_sync(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'), lookback=timedelta(days=2))
+    first = FakeFetch([('2021-05-19T10:00:00', '5')])
+    store.replies('555-555-1234', first)
+    store.replies('555-555-9999', FakeFetch([]))
+    fetch = FakeFetch([('555-555-1234', '2021-05-21T10:00:00', '2'), ('555-555-9999', '2021-05-21T11:00:00', '0')])
+
+    replies = store.replies_by_phone(['555-555-1234', '555-555-9999'], fetch)
+
+    assert replies == {'555-555-1234': [('2021-05-19T10:00:00', '5'), ('2021-05-21T10:00:00', '2')],
+                       '555-555-9999': [('2021-05-21T11:00:00', '0')]}
+    assert len(fetch.calls) == 1
+    assert fetch.calls[0][0] == first.calls[0][1] - timedelta(days=2)
+
+
+def test_replies_by_phone_new_phone_fetches_everything(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    store.replies('555-555-1234', FakeFetch([]))
+    fetch = FakeFetch([])
+
+    store.replies_by_phone(['555-555-1234', '555-555-9999'], fetch)
+
+    assert fetch.calls[0][0] is None
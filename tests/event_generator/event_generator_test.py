@@ -1,4 +1,13 @@
-from src.event_generator import intervals_valid, random_times
+import csv
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from src.enums import CodedValues
+from src.event_generator import EventGenerator, intervals_valid, random_times
+from src.participant import Participant
 from datetime import datetime
 
 
@@ -31,3 +40,63 @@ def test_random_times():
     times = random_times(start, end, n)
 
     assert (len(times) == n)
+
+
+def test_random_times_one_hour_apart():
+    start = datetime(year=2021, month=1, day=1, hour=7)
+    end = datetime(year=2021, month=1, day=1, hour=11, second=1)
+    n = 5
+
+    times = random_times(start, end, n)
+
+    # A window of exactly four hours leaves only one valid set of times.
+    assert times == [datetime(year=2021, month=1, day=1, hour=h) for h in range(7, 12)]
+
+
+def test_random_times_window_too_short():
+    start = datetime(year=2021, month=1, day=1, hour=7)
+    end = datetime(year=2021, month=1, day=1, hour=11)
+
+    with pytest.raises(ValueError):
+        random_times(start, end, 5)
+
+
+def test_random_times_sleep_before_wake():
+    start = datetime(year=2021, month=1, day=1, hour=7)
+    end = datetime(year=2021, month=1, day=1, hour=0, minute=30)
+
+    with pytest.raises(ValueError):
+        random_times(start, end, 5)
+
+
+def _task_generator(compression=None):
+    part = Participant(identifier='ASH999', phone='555-555-1234')
+    part.task_values = [CodedValues.humor, CodedValues.relationships]
+    config = {'message_file': 'messages.csv'}
+    if compression:
+        config['task_archive_compression'] = compression
+    return EventGenerator(config=config, participant=part, instance_path=str(Path.cwd() / 'message' / 'data'))
+
+
+def test_task_input_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+
+    with zipfile.ZipFile(_task_generator().task_input_file()) as zf:
+        names = zf.namelist()
+        with zf.open(names[0]) as f:
+            rows = list(csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline='')))
+
+        assert all(i.compress_type == zipfile.ZIP_DEFLATED for i in zf.infolist())
+
+    assert names == [f'VAFF_ASH999_Session{s}_Run{r}.csv' for s in range(1, 3) for r in range(1, 5)]
+    assert len(rows) == 20
+    assert rows[1]['iti'] == '1.2'
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_task_input_file_compression():
+    with zipfile.ZipFile(_task_generator(compression='stored').task_input_file()) as zf:
+        assert all(i.compress_type == zipfile.ZIP_STORED for i in zf.infolist())
+
+    with pytest.raises(ValueError):
+        _task_generator().task_input_file(compression='rar')
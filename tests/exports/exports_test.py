@@ -0,0 +1,40 @@
+import csv
+import io
+import json
+
+import pytest
+
+from src.exports import MESSAGE_FIELDS, ExportError, export_rows, iter_csv
+
+rows = [{'UO_ID': '1', 'Message': 'Call a friend, and laugh'},
+        {'UO_ID': '2', 'Message': 'Say "thank you" to someone'}]
+
+
+def test_iter_csv_round_trip():
+    chunks = list(iter_csv(rows, MESSAGE_FIELDS))
+
+    assert len(chunks) == len(rows)
+    assert list(csv.DictReader(io.StringIO(''.join(chunks), newline=''))) == rows
+
+
+def test_iter_csv_no_rows():
+    assert list(iter_csv([], MESSAGE_FIELDS)) == ['UO_ID,Message\r\n']
+
+
+def test_export_ndjson():
+    lines = ''.join(export_rows(rows, MESSAGE_FIELDS, 'ndjson')).splitlines()
+
+    assert [json.loads(line) for line in lines] == rows
+
+
+def test_export_parquet():
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    (data,) = export_rows(rows, MESSAGE_FIELDS, 'parquet')
+
+    assert pq.read_table(io.BytesIO(data)).to_pylist() == rows
+
+
+def test_export_unknown_format():
+    with pytest.raises(ExportError):
+        export_rows(rows, MESSAGE_FIELDS, 'xlsx')
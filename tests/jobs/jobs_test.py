@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from src.jobs import FAILED, FINISHED, QUEUED, RUNNING, JobError, JobRunner, JobStore
+
+
+def _stop_heartbeat(store, ago):
+    stale = (datetime.now() - ago).isoformat()
+    with closing(store._connect()) as conn, conn:
+        conn.execute('UPDATE jobs SET heartbeat_at = ?, updated_at = ?', (stale, stale))
+
+
+def _wait(store, job_id, timeout=5):
+    end = time.monotonic() + timeout
+    job = store.get(job_id)
+    while not job.done and time.monotonic() < end:
+        time.sleep(0.01)
+        job = store.get(job_id)
+    return job
+
+
+class TestJobs:
+    def test_submit_returns_before_job_runs(self, tmp_path):
+        release = threading.Event()
+
+        def handler(job, progress):
+            release.wait()
+            progress(5, 10)
+            return f'result for {job.params["participant_id"]}'
+
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        runner = JobRunner(store, {'generate': handler})
+
+        job = runner.submit('generate', {'participant_id': 'ASH999'})
+
+        assert store.get(job.job_id).status in (QUEUED, RUNNING)
+        release.set()
+        finished = _wait(store, job.job_id)
+        assert finished.status == FINISHED
+        assert finished.result == 'result for ASH999'
+        assert (finished.progress, finished.total) == (5, 10)
+
+    def test_failed_job(self, tmp_path):
+        def handler(job, progress):
+            raise JobError('Failed to create some messages')
+
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        runner = JobRunner(store, {'generate': handler})
+
+        job = _wait(store, runner.submit('generate', {'participant_id': 'ASH999'}).job_id)
+
+        assert job.status == FAILED
+        assert job.error == 'Failed to create some messages'
+
+    def test_resume_abandoned_job(self, tmp_path):
+        path = str(tmp_path / 'jobs.sqlite3')
+        store = JobStore(path)
+        job = store.create('generate', {'participant_id': 'ASH999'})
+        # The worker running the job stopped ten minutes ago.
+        store.claim(job.job_id, 'stopped-host:1')
+        store.update(job.job_id, progress=100, total=338)
+        _stop_heartbeat(store, timedelta(minutes=10))
+
+        runner = JobRunner(JobStore(path), {'generate': lambda j, p: 'done'})
+        resumed = runner.resume()
+
+        assert resumed == [job.job_id]
+        assert _wait(store, job.job_id).status == FINISHED
+
+    def test_resume_skips_running_job(self, tmp_path):
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        job = store.create('generate', {'participant_id': 'ASH999'})
+        store.claim(job.job_id, 'other-host:1')
+
+        runner = JobRunner(store, {'generate': lambda j, p: 'done'})
+
+        assert runner.resume() == []
+        assert store.get(job.job_id).status == RUNNING
+
+    def test_heartbeat_keeps_long_job_running(self, tmp_path):
+        release = threading.Event()
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        runner = JobRunner(store, {'generate': lambda j, p: release.wait()},
+                           heartbeat=timedelta(seconds=0.05), stale_after=timedelta(seconds=0.2))
+
+        job = runner.submit('generate', {'participant_id': 'ASH999'})
+        time.sleep(0.5)
+
+        assert store.requeue_abandoned(timedelta(seconds=0.2)) == []
+        running = store.get(job.job_id)
+        assert running.status == RUNNING
+        assert running.owner.endswith(f':{os.getpid()}')
+        release.set()
+        assert _wait(store, job.job_id).status == FINISHED
+
+    def test_resume_keeps_looking(self, tmp_path):
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        runner = JobRunner(store, {'generate': lambda j, p: 'done'},
+                           heartbeat=timedelta(seconds=0.05), stale_after=timedelta(seconds=0.2))
+        assert runner.resume() == []
+
+        # Another worker stops after the runner has resumed jobs.
+        job = store.create('generate', {'participant_id': 'ASH999'})
+        store.claim(job.job_id, 'stopped-host:1')
+        _stop_heartbeat(store, timedelta(minutes=10))
+
+        assert _wait(store, job.job_id).status == FINISHED
+
+    def test_database_without_owners(self, tmp_path):
+        path = str(tmp_path / 'jobs.sqlite3')
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute('CREATE TABLE jobs (job_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, '
+                         'progress INTEGER, total INTEGER, error TEXT, result TEXT, created_at TEXT, '
+                         'updated_at TEXT)')
+
+        store = JobStore(path)
+        job = store.create('generate', {'participant_id': 'ASH999'})
+
+        assert store.claim(job.job_id, 'host:1')
+        assert store.get(job.job_id).owner == 'host:1'
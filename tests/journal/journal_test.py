@@ -0,0 +1,75 @@
+from collections import Counter
+from datetime import date, timedelta
+
+from src.apptoto import Apptoto
+from src.journal import PostingJournal, event_keys
+from src.schedule import SMS_TITLE
+from tests.apptoto.fake_apptoto import FakeApptoto
+
+
+class TestPostingJournal:
+    def test_retry_posts_only_missing_events(self, tmp_path, make_generator):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        with FakeApptoto(fail_after=20) as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=4)
+
+            assert not make_generator(apptoto).generate(journal=journal)
+            posted_before_retry = len(fake.posted)
+
+            fake.fail_after = None
+            progress = []
+            assert make_generator(apptoto).generate(progress=lambda d, t: progress.append((d, t)), journal=journal)
+
+        plan = journal.plan('ASH999')
+        assert plan.completed
+        posted = Counter((e['title'], e['start_time'], e['content']) for e in fake.posted)
+        assert sorted(posted) == sorted((e.title, e.start_time, e.content) for e in plan.events)
+        assert max(posted.values()) == 1
+        assert posted_before_retry >= 100
+        assert progress[-1] == (len(plan.events), len(plan.events))
+
+    def test_completed_plan_not_posted_again(self, tmp_path, make_generator):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint)
+
+            first = make_generator(apptoto)
+            assert first.generate(journal=journal)
+            posted = len(fake.posted)
+            second = make_generator(apptoto)
+            assert second.generate(journal=journal)
+
+        assert len(fake.posted) == posted
+        assert [m.message_id for m in second._messages] == [m.message_id for m in first._messages]
+        assert not fake.deleted
+
+    def test_changed_participant_replanned(self, tmp_path, make_generator, make_participant):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        part = make_participant()
+        # Only future events are changed, so the participant quits in the future.
+        part.session0_date = (date.today() + timedelta(days=1)).isoformat()
+        part.quit_date = (date.today() + timedelta(days=30)).isoformat()
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint)
+            assert make_generator(apptoto, part).generate(journal=journal)
+
+            # The participant's sleep time was corrected in REDCap after their events were posted.
+            part.sleep_time = '20:00'
+            assert make_generator(apptoto, part).generate(journal=journal)
+
+        plan = journal.plan('ASH999')
+        assert plan.completed
+        assert fake.deleted
+        assert all(e.start_time[11:16] < '20:00' for e in plan.events if e.title == SMS_TITLE)
+        assert (sorted((e['title'], e['start_time'], e['content']) for e in fake.events.values())
+                == sorted((e.title, e.start_time, e.content) for e in plan.events))
+
+    def test_event_keys_stable_and_unique(self, tmp_path, make_generator):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        events = make_generator()._plan_events()
+        journal.save_plan('ASH999', events + events[:1], [])
+
+        keys = event_keys(journal.plan('ASH999').events)
+
+        assert keys[:-1] == event_keys(events)
+        assert len(set(keys)) == len(keys)
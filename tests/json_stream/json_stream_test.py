@@ -0,0 +1,42 @@
+import json
+
+import pytest
+from hypothesis import given, strategies as st
+
+from src.json_stream import iter_array
+
+json_values = st.recursive(st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False) | st.text(),
+                           lambda children: st.lists(children) | st.dictionaries(st.text(), children),
+                           max_leaves=10)
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@given(items=st.lists(json_values, max_size=10), other=json_values, size=st.integers(min_value=1, max_value=50))
+def test_iter_array_matches_json(items, other, size):
+    data = json.dumps({'meta': other, 'events': items, 'after': other}).encode()
+
+    assert list(iter_array(_chunks(data, size), 'events')) == items
+
+
+def test_iter_array_multibyte_split():
+    data = json.dumps({'events': ['café', 'naïve']}, ensure_ascii=False).encode()
+
+    assert list(iter_array(_chunks(data, 1), 'events')) == ['café', 'naïve']
+
+
+def test_iter_array_missing_key():
+    assert list(iter_array([b'{"other": [1, 2]}'], 'events')) == []
+
+
+def test_iter_array_yields_before_end():
+    items = iter_array(iter([b'{"events": [{"id": 1}, ', b'{"id": 2}', b']}']), 'events')
+
+    assert next(items) == {'id': 1}
+
+
+def test_iter_array_invalid():
+    with pytest.raises(ValueError):
+        list(iter_array([b'{"events": [1 2]}'], 'events'))
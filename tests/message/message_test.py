@@ -1,5 +1,8 @@
+import os
+import shutil
 from pathlib import Path
 
+import pytest
 from hypothesis import given, strategies as st
 
 from src.event_generator import MESSAGES_PER_DAY_1, MESSAGES_PER_DAY_2
@@ -18,3 +21,91 @@ def test_enough_messages(c, v):
     condition_messages = messages.get_messages_by_condition(c, v, num_required_messages)
 
     assert len(condition_messages) >= num_required_messages
+
+
+def test_load_shares_library():
+    path = str(Path.cwd() / 'message' / 'data' / 'messages.csv')
+
+    assert MessageLibrary.load(path) is MessageLibrary.load(path)
+
+
+def test_load_reloads_changed_file(tmp_path):
+    path = tmp_path / 'messages.csv'
+    shutil.copy(Path.cwd() / 'message' / 'data' / 'messages.csv', path)
+    library = MessageLibrary.load(str(path))
+
+    # Touching the file without changing it keeps the library.
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert MessageLibrary.load(str(path)) is library
+
+    with open(path, 'a') as f:
+        f.write('\n9999,1,9999,1,DownReg,,,New message\n')
+    reloaded = MessageLibrary.load(str(path))
+
+    assert reloaded is not library
+    messages = reloaded.get_messages_by_condition(Condition.DOWNREG, [], 10000)
+    assert 'New message' in {m.message for m in messages}
+
+
+def test_messages_by_condition_match_values():
+    messages = MessageLibrary(path=str(Path.cwd() / 'message' / 'data' / 'messages.csv'))
+    values = [CodedValues.humor, CodedValues.athletic]
+
+    condition_messages = messages.get_messages_by_condition(Condition.VALUES, values, 20)
+
+    assert all(m.condition is Condition.VALUES and m.coded_value in values for m in condition_messages)
+
+
+def _small_library(tmp_path, rows):
+    path = tmp_path / 'messages.csv'
+    with open(path, 'w') as f:
+        f.write('UO_ID,OSU_Wave,OSU_RandomID,ConditionNo,ConditionLabel,Value1,Value2,Message\n')
+        for i, (condition, value) in enumerate(rows):
+            f.write(f'{i},1,{i},{condition},Label,{value},,Message {i}\n')
+    return MessageLibrary(path=str(path))
+
+
+def test_messages_reshuffled_each_pass(tmp_path):
+    messages = _small_library(tmp_path, [(1, '')] * 4)
+
+    condition_messages = messages.get_messages_by_condition(Condition.DOWNREG, [], 400)
+
+    assert len(condition_messages) == 400
+    passes = [condition_messages[i:i + 4] for i in range(0, 400, 4)]
+    # Every message is used once in each pass.
+    assert all(sorted(m.message_id for m in p) == [0, 1, 2, 3] for p in passes)
+    # No message is sent twice in a row, and passes are not all in the same order.
+    assert all(a is not b for a, b in zip(condition_messages, condition_messages[1:]))
+    assert len({tuple(m.message_id for m in p) for p in passes}) > 1
+
+
+def test_messages_balanced_across_values(tmp_path):
+    messages = _small_library(tmp_path, [(3, 'humor')] * 10 + [(3, 'athletic')] * 2)
+
+    condition_messages = messages.get_messages_by_condition(Condition.VALUES,
+                                                            [CodedValues.humor, CodedValues.athletic],
+                                                            21, balance=True)
+
+    counts = [sum(1 for m in condition_messages if m.coded_value is v)
+              for v in (CodedValues.humor, CodedValues.athletic)]
+    assert sorted(counts) == [10, 11]
+
+
+def test_no_messages_for_values(tmp_path):
+    messages = _small_library(tmp_path, [(3, 'humor')])
+
+    with pytest.raises(ValueError):
+        messages.get_messages_by_condition(Condition.VALUES, [CodedValues.athletic], 5)
+
+
+def test_message_with_line_break(tmp_path):
+    path = tmp_path / 'messages.csv'
+    with open(path, 'w', newline='') as f:
+        f.write('UO_ID,OSU_Wave,OSU_RandomID,ConditionNo,ConditionLabel,Value1,Value2,Message\r\n')
+        f.write('1,1,1,1,DownReg,,,"First line,\nsecond line"\r\n')
+        f.write('2,1,2,1,DownReg,,,Message 2\r\n')
+
+    messages = MessageLibrary(path=str(path)).get_messages_by_condition(Condition.DOWNREG, [], 2)
+
+    assert sorted(m.message for m in messages) == ['First line,\nsecond line', 'Message 2']
@@ -0,0 +1,88 @@
+import requests
+from flask import Flask
+
+from src.metrics import Counter, Histogram, Registry, UPSTREAM_LATENCY, UPSTREAM_REQUESTS, \
+    UPSTREAM_SENT_BYTES, init_metrics
+from src.transport import Transport
+
+
+def _app():
+    app = Flask(__name__)
+
+    @app.route('/count/<participant_id>')
+    def count(participant_id):
+        return {'participant_id': participant_id}
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('failed')
+
+    init_metrics(app)
+    return app
+
+
+class TestMetrics:
+    def test_render(self):
+        registry = Registry()
+        counter = registry.register(Counter('things_total', 'Things counted', ['kind']))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='b"c')
+
+        assert registry.render() == ('# HELP things_total Things counted\n'
+                                     '# TYPE things_total counter\n'
+                                     'things_total{kind="a"} 3\n'
+                                     'things_total{kind="b\\"c"} 1\n')
+
+    def test_histogram_buckets_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        assert histogram.render()[2:] == ['latency_seconds_bucket{le="0.1"} 2',
+                                          'latency_seconds_bucket{le="1"} 3',
+                                          'latency_seconds_bucket{le="+Inf"} 4',
+                                          'latency_seconds_sum 2.65',
+                                          'latency_seconds_count 4']
+
+    def test_routes_labelled_by_rule(self):
+        client = _app().test_client()
+        client.get('/count/ASH001')
+        client.get('/count/ASH002')
+        client.get('/fail')
+
+        body = client.get('/metrics').get_data(as_text=True)
+
+        assert 'http_requests_total{route="/count/<participant_id>",method="GET",status="200"} 2' in body
+        assert 'http_requests_total{route="/fail",method="GET",status="500"} 1' in body
+        assert 'http_request_duration_seconds_count{route="/count/<participant_id>",method="GET"} 2' in body
+        assert 'http_requests_in_flight{route="/count/<participant_id>"} 0' in body
+        assert 'ASH001' not in body
+
+    def test_upstream_calls_measured(self, requests_mock):
+        labels = {'service': 'apptoto', 'operation': 'test_post'}
+        requests_mock.post('https://api.apptoto.com/v1/events', status_code=500)
+        requests_mock.get('https://api.apptoto.com/v1/down', exc=requests.ConnectionError)
+        transport = Transport()
+
+        transport.post('https://api.apptoto.com/v1/events', data=b'12345', **labels)
+        try:
+            transport.get('https://api.apptoto.com/v1/down', **labels)
+        except requests.ConnectionError:
+            pass
+
+        assert UPSTREAM_REQUESTS.value(status='500', **labels) == 1
+        assert UPSTREAM_REQUESTS.value(status='error', **labels) == 1
+        assert UPSTREAM_LATENCY.count(**labels) == 2
+        assert UPSTREAM_SENT_BYTES.value(**labels) == 5
+        assert requests_mock.last_request.timeout == transport.timeout
+        transport.close()
+
+    def test_upstream_service_defaults_to_host(self, requests_mock):
+        requests_mock.get('https://redcap.example.org/api/', text='ok')
+        transport = Transport()
+
+        transport.get('https://redcap.example.org/api/')
+
+        assert UPSTREAM_REQUESTS.value(service='redcap.example.org', operation='GET', status='200') == 1
+        transport.close()
@@ -0,0 +1,140 @@
+import asyncio
+import pstats
+import time
+
+import pytest
+from flask import Flask
+
+from src.jobs import FINISHED, QUEUED, JobRunner, JobStore
+from src.profiling import PROFILE_HEADER, ProfileStore, init_profiling, is_profiling, profile_call, section
+
+TOKEN = 'test token'
+
+
+def _async_replies(participant_id):
+    return [participant_id.lower()] * 1000
+
+
+def _app(tmp_path, **config):
+    app = Flask(__name__, instance_path=str(tmp_path))
+
+    @app.route('/count/<participant_id>')
+    def count(participant_id):
+        with section('redcap'):
+            phone = participant_id.lower()
+        with section('apptoto'):
+            replies = [phone] * 1000
+        return {'profiled': is_profiling(), 'replies': len(replies)}
+
+    @app.route('/async/<participant_id>')
+    async def count_async(participant_id):
+        await asyncio.sleep(0)
+        with section('apptoto'):
+            replies = _async_replies(participant_id)
+        return {'profiled': is_profiling(), 'replies': len(replies)}
+
+    init_profiling(app, {'profile_token': TOKEN, **config})
+    return app
+
+
+class TestProfiling:
+    def test_profile_requested_by_header(self, tmp_path):
+        client = _app(tmp_path).test_client()
+
+        assert not client.get('/count/ASH001').json['profiled']
+        assert client.get('/count/ASH001', headers={PROFILE_HEADER: TOKEN}).json['profiled']
+        assert not client.get('/count/ASH001', headers={PROFILE_HEADER: 'wrong'}).json['profiled']
+
+        profiles = client.get('/profiles', headers={PROFILE_HEADER: TOKEN}).json
+        assert len(profiles) == 1
+        profile = profiles[0]
+        assert profile['name'] == 'GET /count/<participant_id>'
+        assert profile['status'] == 200
+        assert set(profile['sections']) == {'redcap', 'apptoto'}
+        assert profile['sections']['redcap']['calls'] == 1
+        assert profile['memory_peak_bytes'] > 0
+
+        text = client.get(f'/profiles/{profile["id"]}?format=text', headers={PROFILE_HEADER: TOKEN})
+        assert 'cumulative' in text.get_data(as_text=True)
+        dump = client.get(f'/profiles/{profile["id"]}?format=pstats', headers={PROFILE_HEADER: TOKEN})
+        path = tmp_path / 'downloaded.prof'
+        path.write_bytes(dump.data)
+        assert pstats.Stats(str(path)).total_calls > 0
+
+    def test_async_view_profiled(self, tmp_path):
+        client = _app(tmp_path).test_client()
+
+        assert client.get('/async/ASH001', headers={PROFILE_HEADER: TOKEN}).json['profiled']
+
+        profile = client.get('/profiles', headers={PROFILE_HEADER: TOKEN}).json[0]
+        assert profile['name'] == 'GET /async/<participant_id>'
+        assert profile['sections']['apptoto']['calls'] == 1
+        stats = pstats.Stats(_app(tmp_path).extensions['profiles'].stats_path(profile['id'])).stats
+        assert {'count_async', '_async_replies'} <= {name for _, _, name in stats}
+
+    def test_admin_endpoints_need_token(self, tmp_path):
+        client = _app(tmp_path).test_client()
+
+        assert client.get('/profiles').status_code == 404
+        assert client.get('/profiles', headers={PROFILE_HEADER: 'wrong'}).status_code == 404
+        assert client.get('/profiles/unknown', headers={PROFILE_HEADER: TOKEN}).status_code == 404
+
+    def test_admin_toggle(self, tmp_path):
+        client = _app(tmp_path).test_client()
+
+        assert client.post('/profiles/enabled?enabled=true', headers={PROFILE_HEADER: TOKEN}).json['enabled']
+        assert client.get('/count/ASH001').json['profiled']
+        assert not client.post('/profiles/enabled?enabled=false', headers={PROFILE_HEADER: TOKEN}).json['enabled']
+        assert not client.get('/count/ASH001').json['profiled']
+
+        assert len(client.get('/profiles', headers={PROFILE_HEADER: TOKEN}).json) == 1
+
+    def test_sampled(self, tmp_path):
+        client = _app(tmp_path, profile_sample_rate=1).test_client()
+
+        assert client.get('/count/ASH001').json['profiled']
+
+    def test_oldest_removed(self, tmp_path):
+        client = _app(tmp_path, profile_keep=2).test_client()
+        for _ in range(3):
+            client.get('/count/ASH001', headers={PROFILE_HEADER: TOKEN})
+
+        assert len(client.get('/profiles', headers={PROFILE_HEADER: TOKEN}).json) == 2
+        assert len(list((tmp_path / 'profiles').glob('*.prof'))) == 2
+
+    def test_profile_call_keeps_failures(self, tmp_path):
+        store = ProfileStore(str(tmp_path))
+
+        def fail():
+            with section('schedule'):
+                raise ValueError('no time')
+
+        with pytest.raises(ValueError):
+            profile_call(store, 'job generate', fail)
+
+        profile, = store.list()
+        assert profile['name'] == 'job generate'
+        assert 'no time' in profile['error']
+        assert profile['sections']['schedule']['calls'] == 1
+        assert not is_profiling()
+
+    def test_job_submitted_by_profiled_request(self, tmp_path):
+        app = _app(tmp_path)
+        store = app.extensions['profiles']
+        runner = JobRunner(JobStore(str(tmp_path / 'jobs.sqlite3')),
+                           {'generate': lambda job, progress: 'result'}, profiles=store)
+
+        @app.route('/generate')
+        def generate():
+            job = runner.submit('generate', {'participant_id': 'ASH001'}, profile=is_profiling())
+            # Return only once the job has started, while this request's profile is still running.
+            while runner.store.get(job.job_id).status == QUEUED:
+                time.sleep(0.01)
+            return {'job_id': job.job_id}
+
+        job_id = app.test_client().get('/generate', headers={PROFILE_HEADER: TOKEN}).json['job_id']
+        end = time.monotonic() + 5
+        while runner.store.get(job_id).status != FINISHED and time.monotonic() < end:
+            time.sleep(0.01)
+
+        assert sorted(p['name'] for p in store.list()) == ['GET /generate', 'job generate']
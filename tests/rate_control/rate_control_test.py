@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timedelta
+
+from src.apptoto import Apptoto
+from src.apptoto_event import ApptotoEvent
+from src.apptoto_participant import ApptotoParticipant
+from src.rate_control import AdaptiveController, MIN_RATE
+from tests.apptoto.fake_apptoto import FakeApptoto
+
+
+def _events(n):
+    participant = ApptotoParticipant(name='ABC', phone='555-555-1234')
+    start = datetime(2021, 5, 19, 8)
+    return [ApptotoEvent(calendar='ASH Messages', title='ASH SMS', start_time=start + timedelta(minutes=i),
+                         end_time=start + timedelta(minutes=i), content=f'UO: message {i}',
+                         participants=[participant]) for i in range(n)]
+
+
+class TestAdaptiveController:
+    def test_grows_additively_to_ceiling(self):
+        controller = AdaptiveController(chunk_size=5, max_chunk_size=8)
+        for size in (6, 7, 8, 8):
+            controller.observe(events=5, payload=500, latency=0.1, status=200)
+            assert controller.chunk_size == size
+        assert controller.rate is None
+
+    def test_halves_after_rejection(self):
+        controller = AdaptiveController(chunk_size=20, max_rate=10)
+
+        controller.observe(events=20, payload=2000, latency=0.1, status=429)
+        assert controller.chunk_size == 10
+        assert controller.rate == 5
+
+        controller.observe(events=10, payload=1000, latency=0.1, status=503)
+        controller.observe(events=5, payload=500, latency=0.1, status=None)
+        assert controller.chunk_size == 2
+        assert controller.rate == 1.25
+
+        controller.observe(events=2, payload=200, latency=0.1, status=200)
+        assert controller.chunk_size == 3
+        assert controller.rate == 2.25
+
+    def test_rate_ceiling_and_floor(self):
+        controller = AdaptiveController(max_rate=2)
+        for _ in range(5):
+            controller.observe(events=1, payload=100, latency=0.1, status=429)
+        assert controller.rate == MIN_RATE
+
+        for _ in range(5):
+            controller.observe(events=1, payload=100, latency=0.1, status=200)
+        assert controller.rate == 2
+
+    def test_slow_posts_shrink_chunks_only(self):
+        controller = AdaptiveController(chunk_size=10, target_latency=1.0)
+
+        controller.observe(events=10, payload=1000, latency=3.0, status=200)
+
+        assert controller.chunk_size == 5
+        assert controller.rate is None
+
+    def test_payload_limits_chunk_size(self):
+        controller = AdaptiveController(chunk_size=40, max_payload=10_000)
+
+        controller.observe(events=10, payload=5000, latency=0.1, status=200)
+
+        assert controller.chunk_size == 20
+
+
+class TestAdaptivePosting:
+    def test_chunks_grow(self):
+        events = _events(300)
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=1,
+                              controller=AdaptiveController(chunk_size=5, max_chunk_size=20))
+            progress = []
+            assert apptoto.post_events(events, progress=lambda d, t: progress.append(d))
+
+        assert [e['content'] for e in fake.posted] == [e.content for e in events]
+        assert fake.chunk_sizes[:4] == [5, 6, 7, 8]
+        assert max(fake.chunk_sizes) == 20
+        assert progress[-1] == len(events)
+        assert progress == sorted(progress)
+
+    def test_throttled_posts_sent_again(self):
+        events = _events(100)
+        with FakeApptoto(throttle_every=6) as fake:
+            controller = AdaptiveController(chunk_size=5, max_chunk_size=20)
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=4,
+                              controller=controller)
+            posted = []
+            assert apptoto.post_events(events, on_posted=lambda start, chunk: posted.append((start, len(chunk))))
+
+        assert sorted(e['content'] for e in fake.posted) == sorted(e.content for e in events)
+        assert fake.throttled > 0
+        assert controller.rate is not None
+        assert sum(n for _, n in posted) == len(events)
+        assert [start for start, _ in sorted(posted)] == [0] + [s + n for s, n in sorted(posted)][:-1]
+
+    def test_fixed_chunks_without_controller(self):
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, chunk_size=5)
+            assert apptoto.post_events(_events(23))
+
+        assert sorted(fake.chunk_sizes) == [3, 5, 5, 5, 5]
+
+    def test_rate_limit_with_controller(self):
+        # Both settings on, as from apptoto_rate_limit with apptoto_adaptive: the controller alone paces posts.
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint, max_in_flight=4,
+                              rate_limit=20, controller=AdaptiveController(chunk_size=1, max_chunk_size=1, max_rate=20))
+            start = time.monotonic()
+            assert apptoto.post_events(_events(41))
+            elapsed = time.monotonic() - start
+
+        assert len(fake.chunk_sizes) == 41
+        # 40 intervals at 20 posts a second take 2 seconds.
+        assert 1.9 < elapsed < 2.3
@@ -0,0 +1,127 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from src.apptoto import Apptoto
+from src.apptoto_event import ApptotoEvent
+from src.apptoto_participant import ApptotoParticipant
+from src.journal import PostingJournal
+from src.reconcile import diff_events, event_key, keep_fitting_days
+from src.schedule import CIGS_TITLE, SMS_TITLE
+from tests.apptoto.fake_apptoto import FakeApptoto
+
+BEFORE_QUIT = datetime(2021, 5, 1)
+
+
+@pytest.fixture
+def pacific(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _event(title, start, content='UO: hello'):
+    t = datetime.fromisoformat(start)
+    return ApptotoEvent(calendar='ASH Messages', title=title, start_time=t, end_time=t, content=content,
+                        participants=[ApptotoParticipant(name='ABC', phone='555-555-1234')])
+
+
+def _existing(event_id, title, start, content='UO: hello'):
+    return {'id': event_id, 'title': title, 'start_time': start, 'content': content}
+
+
+def _keys(events):
+    return sorted((e['title'], e['start_time'], e['content']) for e in events)
+
+
+class TestReconcile:
+    def test_diff_by_title_time_and_content(self):
+        desired = [_event(SMS_TITLE, '2021-05-19T08:00:00'),
+                   _event(SMS_TITLE, '2021-05-19T10:00:00'),
+                   _event(CIGS_TITLE, '2021-05-19T20:00:00', 'UO: count')]
+        existing = [_existing(1, SMS_TITLE, '2021-05-19T08:00:00-07:00'),
+                    _existing(2, SMS_TITLE, '2021-05-19T08:00:00'),
+                    _existing(3, SMS_TITLE, '2021-05-19T11:00:00'),
+                    _existing(4, CIGS_TITLE, '2021-05-19T20:00:00', 'UO: count')]
+
+        result = diff_events(desired, existing)
+
+        assert result.kept == [0, 2]
+        assert result.created == [1]
+        assert sorted(result.deleted) == [1, 3]
+
+    def test_offset_converted_to_local_time(self, pacific):
+        local = event_key(SMS_TITLE, '2021-05-19T08:00:00', 'UO: hello')
+
+        assert event_key(SMS_TITLE, '2021-05-19T08:00:00-07:00', 'UO: hello') == local
+        assert event_key(SMS_TITLE, '2021-05-19T15:00:00+00:00', 'UO: hello') == local
+        assert event_key(SMS_TITLE, '2021-05-19T08:00:00+00:00', 'UO: hello') != local
+
+    def test_keep_days_that_still_fit(self, make_participant):
+        part = make_participant(wake_time='09:00')
+        desired = [_event(SMS_TITLE, '2021-05-19T09:30:00', 'UO: new 1'),
+                   _event(SMS_TITLE, '2021-05-19T12:00:00', 'UO: new 2'),
+                   _event(SMS_TITLE, '2021-05-20T10:00:00', 'UO: new 3'),
+                   _event(SMS_TITLE, '2021-05-20T13:00:00', 'UO: new 4')]
+        existing = [_existing(1, SMS_TITLE, '2021-05-19T10:00:00', 'UO: old 1'),
+                    _existing(2, SMS_TITLE, '2021-05-19T15:00:00', 'UO: old 2'),
+                    _existing(3, SMS_TITLE, '2021-05-20T08:00:00', 'UO: old 3'),
+                    _existing(4, SMS_TITLE, '2021-05-20T14:00:00', 'UO: old 4')]
+
+        events = keep_fitting_days(desired, existing, part)
+
+        assert [(e.start_time, e.content) for e in events] == [('2021-05-19T10:00:00', 'UO: old 1'),
+                                                               ('2021-05-19T15:00:00', 'UO: old 2'),
+                                                               ('2021-05-20T10:00:00', 'UO: new 3'),
+                                                               ('2021-05-20T13:00:00', 'UO: new 4')]
+
+    def test_unchanged_participant_needs_no_calls(self, tmp_path, make_generator):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint)
+            assert make_generator(apptoto).generate(journal=journal)
+            posted = len(fake.posted)
+
+            result = make_generator(apptoto).reconcile(journal=journal, now=BEFORE_QUIT)
+
+        assert result.succeeded
+        assert len(result.kept) == posted
+        assert result.created == [] and result.deleted == []
+        assert len(fake.posted) == posted and fake.deleted == []
+
+    def test_later_sleep_time_changes_only_evening_events(self, tmp_path, make_generator, make_participant):
+        journal = PostingJournal(str(tmp_path / 'journal.sqlite3'))
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint)
+            assert make_generator(apptoto).generate(journal=journal)
+            sms_before = _keys(e for e in fake.events.values() if e['title'] == SMS_TITLE)
+
+            later = make_participant(sleep_time='22:00')
+            result = make_generator(apptoto, later).reconcile(journal=journal, now=BEFORE_QUIT)
+            remaining = list(fake.events.values())
+
+            # Reconciling again finds nothing left to change.
+            again = make_generator(apptoto, later).reconcile(journal=journal, now=BEFORE_QUIT)
+
+        assert result.succeeded
+        assert len(result.created) == len(result.deleted) < 100
+        assert _keys(e for e in remaining if e['title'] == SMS_TITLE) == sms_before
+        assert _keys(remaining) == sorted((e.title, e.start_time, e.content) for e in result.events)
+        assert again.created == [] and again.deleted == []
+        assert journal.plan('ASH999').completed
+
+    def test_only_future_events_changed(self, make_generator, make_participant):
+        with FakeApptoto() as fake:
+            apptoto = Apptoto(api_token='test token', user='test user', endpoint=fake.endpoint)
+            assert make_generator(apptoto).generate()
+            now = datetime(2021, 6, 1, 12)
+            past = [e for e in fake.events.values() if e['start_time'] < now.isoformat()]
+
+            result = make_generator(apptoto, make_participant(wake_time='08:00')).reconcile(now=now)
+
+        assert result.succeeded
+        assert all(e.start_time >= now.isoformat() for e in result.events)
+        assert all(e['id'] in fake.events for e in past)
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+import pytest
+import requests
+
+from src.redcap import Redcap, RedcapError
+from src.redcap_mirror import RedcapMirror
+
+
+class FakeExport:
+    def __init__(self, *responses):
+        """Answer exports with each of `responses` in turn, raising any that are exceptions."""
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, since):
+        self.calls.append(since)
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+ash999 = {'ash_id': 'ASH999', 'phone': '555-555-1234', 'condition': '3'}
+ash998 = {'ash_id': 'ASH998', 'phone': '555-555-9876', 'condition': '1'}
+
+
+class TestRedcapMirror:
+    def test_first_lookup_full_sync(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'))
+        export = FakeExport([ash999, ash998])
+
+        records = mirror.records('session_0_arm_1', ['ash_id', 'phone'], ['ASH999'], export)
+
+        assert records == [{'ash_id': 'ASH999', 'phone': '555-555-1234'}]
+        assert export.calls == [None]
+
+    def test_fresh_lookup_does_not_export(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'))
+        export = FakeExport([ash999, ash998])
+
+        mirror.records('session_0_arm_1', ['ash_id'], ['ASH999'], export)
+        records = mirror.records('session_0_arm_1', ['ash_id', 'condition'], ['ASH998'], export)
+
+        assert records == [{'ash_id': 'ASH998', 'condition': '1'}]
+        assert len(export.calls) == 1
+
+    def test_stale_lookup_incremental_sync(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'), ttl=timedelta(0), max_stale=timedelta(0))
+        changed = dict(ash999, phone='555-555-0000')
+        export = FakeExport([ash999], [changed])
+
+        mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+        records = mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+
+        assert records == [{'phone': '555-555-0000'}]
+        assert export.calls[0] is None
+        assert export.calls[1] is not None
+
+    def test_unreachable_redcap_serves_stale(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'), ttl=timedelta(0), max_stale=timedelta(0))
+        export = FakeExport([ash999], RedcapError('Unable to get Session 0 data from Redcap - 500'))
+
+        mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+        records = mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+
+        assert records == [{'phone': '555-555-1234'}]
+
+    def test_unreachable_redcap_without_data(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'))
+        export = FakeExport(RedcapError('Unable to get Session 0 data from Redcap - 500'))
+
+        with pytest.raises(RedcapError):
+            mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+
+    def test_missing_participant_syncs(self, tmp_path):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'))
+        export = FakeExport([ash999], [ash998])
+
+        mirror.records('session_0_arm_1', ['phone'], ['ASH999'], export)
+        records = mirror.records('session_0_arm_1', ['phone'], ['ASH998'], export)
+
+        assert records == [{'phone': '555-555-9876'}]
+        assert len(export.calls) == 2
+
+    def test_redcap_reads_from_mirror(self, tmp_path, requests_mock):
+        mirror = RedcapMirror(path=str(tmp_path / 'mirror.sqlite3'))
+        rc = Redcap(api_token='test token', mirror=mirror)
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[ash999, ash998])
+
+        assert rc.get_participant_phone('ASH999') == '555-555-1234'
+        assert rc.get_participant_phone('ASH998') == '555-555-9876'
+        assert requests_mock.call_count == 1
+        assert 'filterLogic' not in requests_mock.last_request.text
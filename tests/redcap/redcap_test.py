@@ -1,7 +1,11 @@
 from src.redcap import Redcap, RedcapError
-from src.enums import CodedValues
+from src.enums import CodedValues, Condition
+import json
 import requests
 import pytest
+import threading
+from urllib.parse import parse_qs
+from datetime import date
 
 session0_data = {'ash_id': 'ASH999',
                  'phone': '555-555-1234',
@@ -96,19 +100,44 @@ class TestRedcap:
         assert part.task_values == [CodedValues.humor, CodedValues.athletic]
 
     def test_get_participant_specific_data_missing_session(self, requests_mock):
-        # Test when session 1 is missing
+        # Test when session 1 is missing. Both sessions are requested at the same time, so match them by event.
         rc = Redcap(api_token='test token')
-        requests_mock.post(rc._endpoint,
-                           [
-                               {'json': [session0_data], 'status_code': requests.codes.ok},
-                               {'json': [], 'status_code': requests.codes.ok}
-                           ])
+
+        def export(request, context):
+            return [session0_data] if parse_qs(request.text)['events[0]'] == ['session_0_arm_1'] else []
+
+        requests_mock.post(rc._endpoint, status_code=requests.codes.ok, json=export)
 
         with pytest.raises(RedcapError) as e:
             rc.get_participant_specific_data('ASH999')
 
         assert 'session 1' in str(e.value)
 
+    def test_get_participant_specific_data_concurrent(self):
+        both_waiting = threading.Barrier(2, timeout=5)
+        exports = []
+
+        class BarrierTransport:
+            # Each export waits for the other, so this fails unless they are sent at the same time.
+            def post(self, url, data, **kwargs):
+                exports.append(data['events[0]'])
+                both_waiting.wait()
+                if data['events[0]'] == 'session_0_arm_1':
+                    records = [session0_data, dict(session0_data, ash_id='ASH998')]
+                else:
+                    records = [dict(session1_data, ash_id='ASH998', condition='1'), session1_data]
+                r = requests.Response()
+                r.status_code = requests.codes.ok
+                r._content = json.dumps(records).encode()
+                return r
+
+        rc = Redcap(api_token='test token', transport=BarrierTransport())
+
+        part = rc.get_participant_specific_data('ASH999')
+
+        assert part.condition == Condition.VALUES
+        assert sorted(exports) == ['session_0_arm_1', 'session_1_arm_1']
+
     def test_get_participant_specific_data_does_not_follow_schema(self, requests_mock):
         rc = Redcap(api_token='test token')
         requests_mock.post(url=rc._endpoint,
@@ -160,3 +189,72 @@ class TestRedcap:
             rc.get_session_0('ASH999')
 
         assert 'sleep time' in str(e.value)
+
+    def test_get_participant_phone_filters_on_server(self, requests_mock):
+        rc = Redcap(api_token='test token')
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[session0_data])
+
+        rc.get_participant_phone('ASH999')
+
+        request_data = parse_qs(requests_mock.last_request.text)
+        assert request_data['filterLogic'] == ["[ash_id] = 'ASH999'"]
+        assert request_data['fields[0]'] == ['ash_id']
+        assert request_data['fields[1]'] == ['phone']
+        assert 'fields[2]' not in request_data
+
+    def test_get_session_0_quoted_id(self, requests_mock):
+        rc = Redcap(api_token='test token')
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[session0_data])
+
+        with pytest.raises(RedcapError):
+            rc.get_session_0("ASH999' or '1' = '1")
+
+        assert not requests_mock.called
+
+    def test_get_participants_specific_data(self, requests_mock):
+        rc = Redcap(api_token='test token')
+        session0 = dict(session0_data, redcap_event_name='session_0_arm_1')
+        session1 = dict(session1_data, redcap_event_name='session_1_arm_1')
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[session0, session1])
+
+        participants = rc.get_participants_specific_data(['ASH999', 'ASH998'])
+
+        assert participants['ASH999'].condition == Condition.VALUES
+        assert isinstance(participants['ASH998'], RedcapError)
+        request_data = parse_qs(requests_mock.last_request.text)
+        assert request_data['events[0]'] == ['session_0_arm_1']
+        assert request_data['events[1]'] == ['session_1_arm_1']
+        assert request_data['filterLogic'] == ["[ash_id] = 'ASH999' or [ash_id] = 'ASH998'"]
+
+    def test_get_participant_phones_active(self, requests_mock):
+        rc = Redcap(api_token='test token')
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[{'ash_id': 'ASH997', 'phone': '555-555-0001', 'quitdate': '2021-05-01'},
+                                 {'ash_id': 'ASH998', 'phone': '555-555-0002', 'quitdate': '2021-03-01'},
+                                 {'ash_id': 'ASH999', 'phone': '', 'quitdate': '2021-05-01'}])
+
+        phones = rc.get_participant_phones(active_on=date(year=2021, month=5, day=19))
+
+        assert phones == {'ASH997': '555-555-0001'}
+        request_data = parse_qs(requests_mock.last_request.text)
+        assert 'filterLogic' not in request_data
+        assert request_data['fields[2]'] == ['quitdate']
+
+    def test_get_participant_phones_by_id(self, requests_mock):
+        rc = Redcap(api_token='test token')
+        requests_mock.post(url=rc._endpoint,
+                           status_code=requests.codes.ok,
+                           json=[{'ash_id': 'ASH999', 'phone': '555-555-1234'}])
+
+        phones = rc.get_participant_phones(['ASH999', 'ASH998'])
+
+        assert phones == {'ASH999': '555-555-1234'}
+        request_data = parse_qs(requests_mock.last_request.text)
+        assert request_data['filterLogic'] == ["[ash_id] = 'ASH999' or [ash_id] = 'ASH998'"]
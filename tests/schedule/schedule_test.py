@@ -0,0 +1,91 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from src.apptoto_participant import ApptotoParticipant
+from src.enums import Condition, CodedValues
+from src.message import IndividualMessage
+from src.schedule import ONE_HOUR, build_schedule, spaced_offsets
+
+NUM_MESSAGES = 28 * (5 + 4)
+
+
+def _messages(prefix=''):
+    return [IndividualMessage(random_id=i, message=f'{prefix}Message {i}', condition=Condition.VALUES,
+                              coded_values=CodedValues.humor) for i in range(NUM_MESSAGES)]
+
+
+def test_build_schedule_events(make_participant):
+    part = ApptotoParticipant(name='ABC', phone='555-555-1234')
+    schedule = build_schedule([make_participant()], [_messages()])
+
+    events = schedule.apptoto_events(0, 'ASH Messages', part)
+
+    assert len(events) == NUM_MESSAGES + 56 + 16 + 8
+    assert Counter(e.title for e in events)['ASH SMS'] == NUM_MESSAGES
+    assert [e.content for e in events[:NUM_MESSAGES]] == [f'UO: Message {i}' for i in range(NUM_MESSAGES)]
+    assert all(e.participants[0] is part and e.calendar == 'ASH Messages' for e in events)
+
+    cigs = [e for e in events if e.title == 'ASH CIGS']
+    assert cigs[0].start_time == '2021-05-19T20:00:00'
+    assert cigs[-1].start_time == '2021-07-13T20:00:00'
+
+    boosters = [e for e in events if 'Booster' in e.title]
+    assert [e.title for e in boosters[:2]] == ['Values Booster 1', 'Values Booster 2']
+    assert [e.start_time for e in boosters[:2]] == ['2021-05-20T18:00:00', '2021-05-23T18:00:00']
+
+    # Session 0 is on a Monday, so the first daily diary is two days later, two hours before sleep time.
+    diaries = events[-8:]
+    assert [e.title for e in diaries] == [f'ASH Daily Diary #{n}' for n in range(5, 13)]
+    assert diaries[0].start_time == (datetime(2021, 4, 21, 19) + timedelta(days=37)).isoformat()
+    assert diaries[4].start_time == (datetime(2021, 4, 21, 19) + timedelta(days=114)).isoformat()
+
+
+def test_build_schedule_sms_times(make_participant):
+    schedule = build_schedule([make_participant(wake_time='08:00', sleep_time='13:00')], [_messages()])
+    events = schedule.apptoto_events(0, 'ASH Messages', ApptotoParticipant(name='ABC', phone='555-555-1234'))
+
+    sms = [datetime.fromisoformat(e.start_time) for e in events if e.title == 'ASH SMS']
+    days = [sms[:140][i:i + 5] for i in range(0, 140, 5)] + [sms[140:][i:i + 4] for i in range(0, 112, 4)]
+    for day, times in enumerate(days):
+        start = datetime(2021, 5, 19, 8) + timedelta(days=day)
+        assert all(start <= t < start + timedelta(hours=5) for t in times)
+        assert all((b - a).total_seconds() >= ONE_HOUR for a, b in zip(times, times[1:]))
+
+
+def test_build_schedule_many_participants(make_participant):
+    participants = [make_participant('ASH001'), make_participant('ASH002', condition=Condition.DOWNREG, sleep_time='22:30')]
+    schedule = build_schedule(participants, [_messages('A '), _messages('B ')])
+
+    first = schedule.apptoto_events(0, 'ASH Messages', ApptotoParticipant(name='A', phone='1'))
+    second = schedule.apptoto_events(1, 'ASH Messages', ApptotoParticipant(name='B', phone='2'))
+
+    assert len(schedule) == len(first) + len(second)
+    assert first[0].content == 'UO: A Message 0' and second[0].content == 'UO: B Message 0'
+    assert 'CR Booster 1' in [e.title for e in second]
+    assert [e.start_time for e in second if e.title == 'ASH CIGS'][0] == '2021-05-19T21:30:00'
+
+
+def test_build_schedule_window_too_short(make_participant):
+    with pytest.raises(ValueError) as e:
+        build_schedule([make_participant(wake_time='08:00', sleep_time='11:00')], [_messages()])
+
+    assert 'ASH999' in str(e.value)
+
+
+def test_spaced_offsets_same_distribution_as_rejection():
+    # Every sorted pair of offsets in [0, 8) at least 3 apart is equally likely when redrawing until valid.
+    valid = [c for c in combinations(range(8), 2) if c[1] - c[0] >= 3]
+    draws = 30000
+
+    offsets = spaced_offsets(np.full(draws, 8), 2, 3, np.random.default_rng(1234))
+    counts = Counter(map(tuple, offsets.tolist()))
+
+    assert set(counts) == set(valid)
+    expected = draws / len(valid)
+    chi_square = sum((counts[c] - expected) ** 2 / expected for c in valid)
+    # 99.9th percentile of chi-square with 14 degrees of freedom
+    assert chi_square < 36.1
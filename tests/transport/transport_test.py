@@ -0,0 +1,53 @@
+import json
+
+import requests
+
+from src.redcap import Redcap
+from src.transport import Transport, get_transport, use_transport
+
+
+class FakeTransport(Transport):
+    def __init__(self, responses):
+        """A transport that answers every request from `responses` without using the network."""
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        r = requests.Response()
+        r.status_code = requests.codes.ok
+        r._content = json.dumps(self.responses.pop(0)).encode()
+        return r
+
+
+class TestTransport:
+    def test_session_per_host(self):
+        transport = Transport()
+
+        a = transport.session('https://redcap.uoregon.edu/api/')
+        b = transport.session('https://redcap.uoregon.edu/other')
+        c = transport.session('https://api.apptoto.com/v1/events')
+
+        assert a is b
+        assert a is not c
+        transport.close()
+
+    def test_default_timeout(self, requests_mock):
+        transport = Transport(timeout=5)
+        requests_mock.get('https://api.apptoto.com/v1/events', json={})
+
+        transport.get('https://api.apptoto.com/v1/events')
+
+        assert requests_mock.last_request.timeout == 5
+
+    def test_use_fake_transport(self):
+        fake = FakeTransport([[{'ash_id': 'ASH999', 'phone': '555-555-1234'}]])
+        rc = Redcap(api_token='test token')
+
+        with use_transport(fake):
+            phone_number = rc.get_participant_phone('ASH999')
+
+        assert phone_number == '555-555-1234'
+        assert fake.requests[0][0] == 'POST'
+        assert get_transport() is not fake